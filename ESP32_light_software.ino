@@ -28,6 +28,12 @@ const char* server_url = "http://192.168.1.143:5000/api/lights/light-17676687298
 const int LED_PIN = 2;
 bool configMode = false;
 
+// Change feed: the server answers 304 while the light revision is unchanged
+// and holds long-poll requests open until the state changes
+const int LONG_POLL_WAIT = 25;  // Seconds the server may hold the request
+String lastEtag = "";
+long lastRevision = -1;
+
 // HTML page for WiFi configuration
 const char* configPage = R"(
 <!DOCTYPE html>
@@ -191,11 +197,26 @@ void loop() {
     // Normal operation - check light status
     if (WiFi.status() == WL_CONNECTED) {
       HTTPClient http;
-      
-      http.begin(server_url);
+      const char* headerKeys[] = {"ETag"};
+
+      String url = String(server_url);
+      if (lastRevision >= 0) {
+        url += "?wait=" + String(LONG_POLL_WAIT) + "&since=" + String(lastRevision);
+      }
+
+      http.begin(url);
+      http.setTimeout((LONG_POLL_WAIT + 5) * 1000);
+      http.collectHeaders(headerKeys, 1);
+      if (lastEtag.length() > 0) {
+        http.addHeader("If-None-Match", lastEtag);
+      }
       int httpResponseCode = http.GET();
-      
-      if (httpResponseCode > 0) {
+      bool pollAgain = false;
+
+      if (httpResponseCode == HTTP_CODE_NOT_MODIFIED) {
+        // Long-poll expired without changes, ask again right away
+        pollAgain = true;
+      } else if (httpResponseCode > 0) {
         String payload = http.getString();
         JsonDocument doc;
         DeserializationError error = deserializeJson(doc, payload);
@@ -210,6 +231,10 @@ void loop() {
             Serial.println(lightState ? "ON" : "OFF");
             
             digitalWrite(LED_PIN, lightState ? HIGH : LOW);
+
+            lastEtag = http.header("ETag");
+            lastRevision = doc["light"]["rev"] | 0;
+            pollAgain = true;
           } else {
             Serial.println("API returned success: false");
           }
@@ -220,8 +245,14 @@ void loop() {
       } else {
         Serial.print("HTTP Error: ");
         Serial.println(httpResponseCode);
+        lastEtag = "";
+        lastRevision = -1;
       }
       http.end();
+
+      if (pollAgain) {
+        return;  // Skip the retry delay, the server paces long-polls
+      }
     } else if (WiFi.status() != WL_CONNECTED) {
       Serial.println("WiFi disconnected, attempting reconnect...");
       if (!connectToWiFi()) {
@@ -5,236 +5,404 @@ Handles audio upload, processing, and response generation
 Now with ESP32 light registration support
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, make_response, Response, stream_with_context
 from flask_cors import CORS
 import speech_recognition as sr
-from gtts import gTTS
-from pydub import AudioSegment
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 import os
 from datetime import datetime
-import tempfile
-import json
+import threading
+import copy
+import base64
+import time
+from collections import deque
+from light_events import EventBus, format_sse
+from lights_store import open_store, RevisionConflict, StripedLocks
+from voice_pipeline import StageTimer, decode_stream, iter_stream, pcm_duration
+from audio_store import AudioStore, clean_directory
+from tts_cache import TTSCache
+from intents import IntentRegistry
+from spotify_service import SpotifyService, SpotifyUnavailable, MemoryToken
+from voice_jobs import VoiceJobs, Stage, UploadStream, JobFailed, VoiceJobsSaturated
+from speech_engines import SpeechRecognizer, GoogleEngine, VoskEngine, EngineUnavailable
+from frame_ring import FrameRing
+from metrics import CONTENT_TYPE, STAGE_BUCKETS, Registry, family, profiler_from_env, read_pushed, read_pushed_profile
+from motion_clips import clip_path, list_clips
+from motion_events import MotionEventLog
+from motion_history import MotionHistory, PAGE_SIZE, THUMBNAIL_TYPES, valid_time
+
+try:
+    import cv2  # Only needed to serve camera frames
+except ImportError:
+    cv2 = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Metrics for /metrics (see metrics.py); the detectors push theirs into METRICS_PUSH_DIR
+metrics = Registry()
+request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Time to answer a request (to the first byte of a stream)',
+    ('method', 'route', 'status')
+)
+voice_stage_seconds = metrics.histogram(
+    'voice_stage_seconds', 'Time a voice job spent in each stage, and waiting for it', ('stage',)
+)
+store_flush_seconds = metrics.histogram(
+    'store_flush_seconds', 'Time to write buffered changes to disk', ('store',), buckets=STAGE_BUCKETS
+)
+profiler = profiler_from_env()  # SMART_HOUSE_PROFILE=<ms> samples stacks for /metrics/profile
+
+@app.before_request
+def start_request_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    # Few lookups through the request proxy, each costs microseconds
+    environ, rule = request.environ, request.url_rule
+    start = environ.get('metrics.start')
+    if start is not None:
+        # The route template, not the path, so a light id does not make a series of its own
+        route = rule.rule if rule is not None else 'unmatched'
+        request_seconds.labels(environ['REQUEST_METHOD'], route, str(response.status_code)).observe(
+            time.perf_counter() - start
+        )
+    return response
+
 # Create directories
-UPLOAD_FOLDER = '/tmp/voice_assistant'
+UPLOAD_FOLDER = '/tmp/voice_assistant'  # Only cleaned up, uploads are decoded in memory
 RESPONSE_FOLDER = '/tmp/voice_responses'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESPONSE_FOLDER, exist_ok=True)
 
+# Temp files of the old upload pipeline left behind by a crash
+leftovers = clean_directory(UPLOAD_FOLDER)
+if leftovers:
+    print(f"Removed {leftovers} leftover files from {UPLOAD_FOLDER}")
+
+# Generated audio: size/age quota, background sweeper, hot clips in memory
+AUDIO_MAX_BYTES = 50 * 1024 * 1024
+AUDIO_MAX_AGE = 30 * 24 * 3600  # Seconds a clip may go unused before it is removed
+AUDIO_MEMORY_BYTES = 8 * 1024 * 1024
+AUDIO_CACHE_MAX_AGE = 365 * 24 * 3600  # Browser cache lifetime, clip names never change content
+audio_store = AudioStore(
+    RESPONSE_FOLDER,
+    max_disk_bytes=AUDIO_MAX_BYTES,
+    max_age=AUDIO_MAX_AGE,
+    memory_bytes=AUDIO_MEMORY_BYTES
+).start()
+
+# Speech synthesis cache (see tts_cache.py)
+TTS_PREWARM = True  # Synthesize the fixed replies in the background at startup
+tts_cache = TTSCache(audio_store, lang='es')
+
+# Speech recognition configuration
+SPEECH_ENGINE = 'google'  # Default engine: 'google' (online) or 'vosk' (offline)
+VOSK_MODEL_PATH = '/home/tomas/vosk-model-small-es-0.42'
+SPEECH_WORKERS = 4  # Concurrent transcriptions
+
+# Voice job pipeline
+VOICE_DECODE_WORKERS = 2
+VOICE_RECOGNIZE_WORKERS = 4
+VOICE_RESPOND_WORKERS = 4
+VOICE_QUEUE_SIZE = 8  # Jobs waiting per stage before new uploads get a 503
+VOICE_SYNC_TIMEOUT = 60  # Seconds a non-async request waits for its result
+VOICE_RETRY_AFTER = 2  # Retry-After sent with a 503
+
+speech_recognizer = SpeechRecognizer(
+    [GoogleEngine(), VoskEngine(VOSK_MODEL_PATH)],
+    default=SPEECH_ENGINE,
+    workers=SPEECH_WORKERS
+).start()
+
 # Spotify Configuration
 SPOTIPY_CLIENT_ID = ''
 SPOTIPY_CLIENT_SECRET = ''
 SPOTIPY_REDIRECT_URI = 'http://127.0.0.1:8888/callback'
 
-# Initialize Spotify client
-spotify_client = None
-
-def get_spotify_client():
-    """Get or create Spotify client with user authentication"""
-    global spotify_client
-    if spotify_client is None:
-        try:
-            sp_oauth = SpotifyOAuth(
-                client_id=SPOTIPY_CLIENT_ID,
-                client_secret=SPOTIPY_CLIENT_SECRET,
-                redirect_uri=SPOTIPY_REDIRECT_URI,
-                scope='user-modify-playback-state user-read-playback-state',
-                cache_path='/tmp/.spotify_cache',
-                open_browser=False
-            )
-            spotify_client = spotipy.Spotify(auth_manager=sp_oauth)
-            print("Spotify client initialized")
-        except Exception as e:
-            print(f"Error initializing Spotify: {e}")
-            return None
-    return spotify_client
+def create_spotify_client(session):
+    """spotipy client with user authentication, sharing the service's connection pool"""
+    sp_oauth = SpotifyOAuth(
+        client_id=SPOTIPY_CLIENT_ID,
+        client_secret=SPOTIPY_CLIENT_SECRET,
+        redirect_uri=SPOTIPY_REDIRECT_URI,
+        scope='user-modify-playback-state user-read-playback-state',
+        cache_path='/tmp/.spotify_cache',
+        open_browser=False
+    )
+    # Failures are handled by the circuit breaker, not by spotipy's retries
+    return spotipy.Spotify(
+        auth_manager=MemoryToken(sp_oauth),
+        requests_session=session,
+        requests_timeout=5,
+        retries=0,
+        status_retries=0
+    )
+
+# Cached searches and devices, circuit breaker (see spotify_service.py)
+spotify = SpotifyService(create_spotify_client)
+if SPOTIPY_CLIENT_ID:
+    spotify.start()
 
 # Voice processing endpoints (keeping your existing code)
 @app.route('/api/process_voice', methods=['POST'])
 def process_voice():
-    """Handle voice processing request"""
-    if 'audio' not in request.files:
+    """
+    Handle voice processing request
+    Accepts a multipart form with an 'audio' file, or the raw audio as the
+    request body (Content-Type: audio/*, may use chunked transfer encoding
+    so decoding starts before the upload finishes).
+    Optional parameters (form field or query string):
+      - engine: speech engine to use ('google', 'vosk'), default SPEECH_ENGINE
+      - device: id of the recording device for the noise calibration cache
+        (also X-Device-Id header, defaults to the client address)
+      - async: answer 202 with a job id right after the upload instead of
+        waiting for the result (see /api/voice/jobs/<job_id>)
+    Answers 503 with Retry-After when the voice workers are saturated.
+    """
+    if 'audio' in request.files:
+        upload = iter_stream(request.files['audio'].stream)
+    elif request.mimetype.startswith('audio/') or request.mimetype == 'application/octet-stream':
+        upload = iter_stream(request.stream)
+    else:
         return jsonify({'success': False, 'error': 'No audio file provided'}), 400
 
-    audio_file = request.files['audio']
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    temp_audio_path = os.path.join(UPLOAD_FOLDER, f'audio_{timestamp}_original.webm')
-    wav_path = os.path.join(UPLOAD_FOLDER, f'audio_{timestamp}.wav')
-
+    engine = request.values.get('engine')
+    device = request.values.get('device') or request.headers.get('X-Device-Id') or request.remote_addr
     try:
-        audio_file.save(temp_audio_path)
-        print(f"Saved original audio to: {temp_audio_path}")
-
-        print("Converting audio to WAV...")
-        audio = AudioSegment.from_file(temp_audio_path)
-        audio = audio.set_frame_rate(16000).set_channels(1)
-        audio.export(wav_path, format='wav')
-        print(f"Converted audio saved to: {wav_path}")
+        speech_recognizer.engine(engine)
+    except EngineUnavailable as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
-        if not os.path.exists(wav_path):
-            return jsonify({
-                'success': False,
-                'error': 'Audio conversion failed - WAV file not created'
-            }), 500
-
-        result = process_audio_file(wav_path)
-
-        try:
-            os.remove(temp_audio_path)
-            os.remove(wav_path)
-        except:
-            pass
-
-        return jsonify(result)
+    stream = UploadStream()
+    try:
+        job = voice_jobs.submit(stream, engine=engine, device=device)
+    except VoiceJobsSaturated:
+        response = jsonify({'success': False, 'error': 'Voice assistant busy, try again shortly'})
+        response.headers['Retry-After'] = str(VOICE_RETRY_AFTER)
+        return response, 503
 
+    try:
+        # The decode stage is already reading from the stream
+        stream.feed(upload)
     except Exception as e:
-        try:
-            if os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
-            if os.path.exists(wav_path):
-                os.remove(wav_path)
-        except:
-            pass
+        return jsonify({'success': False, 'error': f'Error receiving audio: {str(e)}'}), 400
 
+    if parse_bool(request.values.get('async', '')):
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/api/voice/jobs/{job.id}'
+        }), 202
+
+    if not job.wait(VOICE_SYNC_TIMEOUT):
         return jsonify({
             'success': False,
-            'error': f'Error processing audio: {str(e)}'
-        }), 500
+            'error': 'Timed out processing audio',
+            'job_id': job.id
+        }), 504
+    print(f"Voice pipeline: {job.timer.summary()}")
+    return jsonify(job.result), job.http_status
+
+@app.route('/api/voice/jobs/<job_id>', methods=['GET'])
+def get_voice_job(job_id):
+    """
+    Status of a voice job, with its result once done
+    ?wait=N long-polls up to N seconds for the job to finish.
+    """
+    job = voice_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
 
-def process_audio_file(audio_file_path):
-    """Process audio file and return transcript and response"""
-    recognizer = sr.Recognizer()
+    wait = request.args.get('wait', type=float)
+    if wait and not job.done:
+        job.wait(min(wait, LONG_POLL_MAX_WAIT))
+    return jsonify({'success': True, 'job': job.to_dict()})
 
+@app.route('/api/voice/jobs/<job_id>/events', methods=['GET'])
+def voice_job_events(job_id):
+    """
+    Server-Sent Events stream of a voice job
+    Sends a 'status' event on every stage change and a final 'result' event.
+    """
+    job = voice_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    def stream():
+        version = None
+        while True:
+            if version is not None and not job.wait(SSE_KEEPALIVE, version):
+                yield ": keep-alive\n\n"
+                continue
+            version = job.version
+            event = job.to_dict()
+            if job.done:
+                yield format_sse(dict(event, type='result'))
+                return
+            yield format_sse(dict(event, type='status'))
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def decode_voice(job, upload):
+    """Decode stage: uploaded audio -> 16 kHz mono PCM, in memory"""
+    timer = StageTimer()
+    pcm = decode_stream(upload, timer)
+    job.timer.add('upload', timer.timings.get('upload', 0.0))
+    if not pcm:
+        raise JobFailed('Audio conversion failed - no audio decoded', 500)
+    print(f"Decoded {pcm_duration(pcm):.1f}s of audio")
+    return pcm
+
+def recognize_voice(job, pcm):
+    """Recognize stage: PCM -> transcript"""
     try:
-        with sr.AudioFile(audio_file_path) as source:
-            print("Limpiando ruido de fondo...")
-            recognizer.adjust_for_ambient_noise(source, duration=0.5)
-            print("Procesando audio...")
-            audio_data = recognizer.record(source)
-
         print("Transcribiendo...")
-        transcript = recognizer.recognize_google(audio_data, language="es-ES")
-        print(f"Transcripción: {transcript}")
-
-        response_text = process_command(transcript)
+        transcript, engine = speech_recognizer.transcribe(
+            pcm, engine=job.options.get('engine'), device=job.options.get('device')
+        )
+    except sr.UnknownValueError:
+        raise JobFailed("No se pudo entender el audio")
+    except sr.RequestError as e:
+        raise JobFailed(f"Error del servicio de reconocimiento: {e}")
+    print(f"Transcripción ({engine}): {transcript}")
+    return {'transcript': transcript, 'engine': engine}
+
+def respond_voice(job, recognized):
+    """Respond stage: run the command (may call Spotify) and synthesize the reply"""
+    with job.timer.stage('command'):
+        response_text = process_command(recognized['transcript'])
+    with job.timer.stage('tts'):
         audio_file = generate_audio_response(response_text)
 
-        return {
-            "success": True,
-            "transcript": transcript,
-            "response_text": response_text,
-            "audio_file": audio_file
-        }
+    return {
+        "success": True,
+        "transcript": recognized['transcript'],
+        "engine": recognized['engine'],
+        "response_text": response_text,
+        "audio_file": audio_file
+    }
 
-    except sr.UnknownValueError:
-        return {"success": False, "error": "No se pudo entender el audio"}
-    except sr.RequestError as e:
-        return {"success": False, "error": f"Error del servicio de reconocimiento: {e}"}
-    except Exception as e:
-        return {"success": False, "error": f"Error procesando audio: {str(e)}"}
+# Decoding runs ffmpeg (CPU), recognition and the reply mostly wait on the
+# network, so each stage gets its own pool; see voice_jobs.py
+voice_jobs = VoiceJobs([
+    Stage('decode', decode_voice, workers=VOICE_DECODE_WORKERS, queue_size=VOICE_QUEUE_SIZE),
+    Stage('recognize', recognize_voice, workers=VOICE_RECOGNIZE_WORKERS, queue_size=VOICE_QUEUE_SIZE),
+    Stage('respond', respond_voice, workers=VOICE_RESPOND_WORKERS, queue_size=VOICE_QUEUE_SIZE),
+], timer=voice_stage_seconds.timer()).start()
+
+# Fixed replies, pre-synthesized at startup
+RESPONSES = {
+    'ask_song': "¿Qué canción quieres escuchar?",
+    'greeting': "¡Hola! ¿En qué puedo ayudarte hoy?",
+    'no_weather': "Lo siento, aún no tengo acceso a información meteorológica",
+    'no_recent_motion': "No se ha detectado movimiento reciente",
+    'no_motion_info': "No hay información de movimiento disponible",
+    'name': "Soy tu asistente de voz de Casa. Puedes llamarme Asistente",
+    'help': "Puedo decirte la hora, la fecha, consultar el estado de las cámaras, reproducir música en Spotify, y responder preguntas básicas",
+    'thanks': "¡De nada! Estoy aquí para ayudarte",
+    'goodbye': "¡Hasta luego! Que tengas un buen día",
+    'spotify_unavailable': "No pude conectar con Spotify",
+    'paused': "Música pausada",
+    'pause_error': "Error al pausar la música",
+    'resumed': "Continuando la música",
+    'resume_error': "Error al reanudar la música",
+}
+
+MONTHS = {
+    1: 'enero', 2: 'febrero', 3: 'marzo', 4: 'abril',
+    5: 'mayo', 6: 'junio', 7: 'julio', 8: 'agosto',
+    9: 'septiembre', 10: 'octubre', 11: 'noviembre', 12: 'diciembre'
+}
+
+# Fixed parts of the replies with numbers in them (see tts_cache.split_segments)
+RESPONSE_FRAGMENTS = [
+    "La hora actual es",
+    "Hoy es",
+    *(f"de {month} de" for month in MONTHS.values()),
+    "Se detectó movimiento hace", "segundos",
+    "El último movimiento fue hace", "minutos",
+    *(str(number) for number in range(60)),
+]
+
+# Voice commands, matched by the registry in intents.py. Spotify controls
+# outrank playing music so "para la música" or "continúa la música" are not
+# taken as a request for a song called "la música".
+intents = IntentRegistry()
+
+@intents.intent('play_music', ['canción', 'canciones', 'música', 'reproduce'], priority=5, slot='song')
+def play_music_intent(match):
+    song_query = match.slots['song']
+    if song_query:
+        return play_spotify_song(song_query)
+    return RESPONSES['ask_song']
+
+@intents.intent('pause_music', ['pausa', 'detén', 'para la música'], priority=10)
+def pause_music_intent(match):
+    return pause_spotify()
+
+@intents.intent('resume_music', ['continúa', 'reanuda'], priority=10)
+def resume_music_intent(match):
+    return resume_spotify()
+
+@intents.intent('time', ['hora', 'qué hora'])
+def time_intent(match):
+    current_time = datetime.now().strftime('%H:%M')
+    return f"La hora actual es {current_time}"
+
+@intents.intent('date', ['fecha', 'qué día', 'día es'])
+def date_intent(match):
+    now = datetime.now()
+    month_name = MONTHS[now.month]
+    return f"Hoy es {now.day} de {month_name} de {now.year}"
+
+@intents.intent('motion', ['cámara', 'cámaras', 'movimiento'])
+def motion_intent(match):
+    event = motion_events.latest()
+    if event is None:
+        return RESPONSES['no_motion_info']
+    time_diff = datetime.now().timestamp() - event['time']
+    if time_diff < 60:
+        return f"Se detectó movimiento hace {int(time_diff)} segundos"
+    elif time_diff < 3600:
+        return f"El último movimiento fue hace {int(time_diff / 60)} minutos"
+    else:
+        return RESPONSES['no_recent_motion']
+
+intents.add('greeting', ['hola', 'buenos días', 'buenas tardes'], response=RESPONSES['greeting'])
+intents.add('weather', ['clima', 'tiempo'], response=RESPONSES['no_weather'])
+intents.add('name', ['cómo te llamas', 'tu nombre'], response=RESPONSES['name'])
+intents.add('help', ['ayuda', 'qué puedes hacer'], response=RESPONSES['help'])
+intents.add('thanks', ['gracias'], response=RESPONSES['thanks'])
+intents.add('goodbye', ['adiós', 'hasta luego', 'chau'], response=RESPONSES['goodbye'])
+
+@intents.fallback
+def unknown_intent(match):
+    return f"Escuché: {match.text}. ¿Puedes reformular tu pregunta?"
 
 def process_command(text):
     """Process voice command and generate appropriate response"""
-    text_lower = text.lower()
-
-    if "canción" in text_lower or "música" in text_lower or "reproduce" in text_lower:
-        song_query = ""
-        if "canción" in text_lower:
-            parts = text_lower.split("canción", 1)
-            if len(parts) > 1:
-                song_query = parts[1].strip()
-        elif "música" in text_lower:
-            parts = text_lower.split("música", 1)
-            if len(parts) > 1:
-                song_query = parts[1].strip()
-        elif "reproduce" in text_lower:
-            parts = text_lower.split("reproduce", 1)
-            if len(parts) > 1:
-                song_query = parts[1].strip()
-
-        song_query = song_query.replace("de ", "").replace("la ", "").strip()
-
-        if song_query:
-            return play_spotify_song(song_query)
-        else:
-            return "¿Qué canción quieres escuchar?"
-
-    elif "pausa" in text_lower or "detén" in text_lower or "para la música" in text_lower:
-        return pause_spotify()
-    elif "continúa" in text_lower or "reanuda" in text_lower:
-        return resume_spotify()
-    elif "hola" in text_lower or "buenos días" in text_lower or "buenas tardes" in text_lower:
-        return "¡Hola! ¿En qué puedo ayudarte hoy?"
-    elif "hora" in text_lower or "qué hora" in text_lower:
-        current_time = datetime.now().strftime('%H:%M')
-        return f"La hora actual es {current_time}"
-    elif "fecha" in text_lower or "qué día" in text_lower or "día es" in text_lower:
-        months = {
-            1: 'enero', 2: 'febrero', 3: 'marzo', 4: 'abril',
-            5: 'mayo', 6: 'junio', 7: 'julio', 8: 'agosto',
-            9: 'septiembre', 10: 'octubre', 11: 'noviembre', 12: 'diciembre'
-        }
-        now = datetime.now()
-        month_name = months[now.month]
-        return f"Hoy es {now.day} de {month_name} de {now.year}"
-    elif "clima" in text_lower or "tiempo" in text_lower:
-        return "Lo siento, aún no tengo acceso a información meteorológica"
-    elif "cámara" in text_lower or "movimiento" in text_lower:
-        try:
-            with open('/var/www/html/motion_alert.txt', 'r') as f:
-                last_motion = float(f.read().strip())
-                time_diff = datetime.now().timestamp() - last_motion
-                if time_diff < 60:
-                    return f"Se detectó movimiento hace {int(time_diff)} segundos"
-                elif time_diff < 3600:
-                    return f"El último movimiento fue hace {int(time_diff / 60)} minutos"
-                else:
-                    return "No se ha detectado movimiento reciente"
-        except:
-            return "No hay información de movimiento disponible"
-    elif "cómo te llamas" in text_lower or "tu nombre" in text_lower:
-        return "Soy tu asistente de voz de Casa. Puedes llamarme Asistente"
-    elif "ayuda" in text_lower or "qué puedes hacer" in text_lower:
-        return "Puedo decirte la hora, la fecha, consultar el estado de las cámaras, reproducir música en Spotify, y responder preguntas básicas"
-    elif "gracias" in text_lower:
-        return "¡De nada! Estoy aquí para ayudarte"
-    elif "adiós" in text_lower or "hasta luego" in text_lower or "chau" in text_lower:
-        return "¡Hasta luego! Que tengas un buen día"
-    else:
-        return f"Escuché: {text}. ¿Puedes reformular tu pregunta?"
+    return intents.dispatch(text)
 
 def play_spotify_song(song_query):
     """Search and play a song on Spotify"""
     try:
-        sp = get_spotify_client()
-        if sp is None:
-            return "No pude conectar con Spotify. Verifica la configuración"
-
         print(f"Searching Spotify for: {song_query}")
-        results = sp.search(q=song_query, limit=1, type='track')
-
-        if results['tracks']['items']:
-            track = results['tracks']['items'][0]
-            track_name = track['name']
-            artist_name = track['artists'][0]['name']
-            track_uri = track['uri']
-
-            devices = sp.devices()
-            if not devices['devices']:
-                return "No encontré ningún dispositivo de Spotify activo. Abre Spotify en tu teléfono o computadora"
-
-            device_id = devices['devices'][0]['id']
-            sp.start_playback(device_id=device_id, uris=[track_uri])
-
-            return f"Reproduciendo {track_name} de {artist_name}"
-        else:
+        track = spotify.play(song_query)
+        if track is None:
             return f"No encontré ninguna canción llamada {song_query}"
+        return f"Reproduciendo {track['name']} de {track['artist']}"
 
+    except SpotifyUnavailable as e:
+        print(f"Spotify error: {e}")
+        return "No pude conectar con Spotify. Verifica la configuración"
+    except LookupError:
+        return "No encontré ningún dispositivo de Spotify activo. Abre Spotify en tu teléfono o computadora"
     except Exception as e:
         print(f"Spotify error: {e}")
         return f"Error al reproducir música: {str(e)}"
@@ -242,76 +410,399 @@ def play_spotify_song(song_query):
 def pause_spotify():
     """Pause Spotify playback"""
     try:
-        sp = get_spotify_client()
-        if sp is None:
-            return "No pude conectar con Spotify"
-        sp.pause_playback()
-        return "Música pausada"
+        spotify.pause()
+        return RESPONSES['paused']
+    except SpotifyUnavailable:
+        return RESPONSES['spotify_unavailable']
     except Exception as e:
         print(f"Spotify pause error: {e}")
-        return "Error al pausar la música"
+        return RESPONSES['pause_error']
 
 def resume_spotify():
     """Resume Spotify playback"""
     try:
-        sp = get_spotify_client()
-        if sp is None:
-            return "No pude conectar con Spotify"
-        sp.start_playback()
-        return "Continuando la música"
+        spotify.resume()
+        return RESPONSES['resumed']
+    except SpotifyUnavailable:
+        return RESPONSES['spotify_unavailable']
     except Exception as e:
         print(f"Spotify resume error: {e}")
-        return "Error al reanudar la música"
+        return RESPONSES['resume_error']
 
 def generate_audio_response(text):
-    """Generate audio file from text using Google TTS"""
+    """Return the URL of a clip saying text, synthesized by Google TTS on a cache miss"""
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        audio_filename = f"response_{timestamp}.mp3"
-        audio_path = os.path.join(RESPONSE_FOLDER, audio_filename)
-
-        tts = gTTS(text=text, lang='es')
-        tts.save(audio_path)
-
-        return f"/api/audio/{audio_filename}"
+        return f"/api/audio/{tts_cache.speak(text)}"
 
     except Exception as e:
         print(f"Error generating audio: {e}")
         return None
 
+if TTS_PREWARM:
+    tts_cache.prewarm_async(list(RESPONSES.values()) + RESPONSE_FRAGMENTS)
+
 @app.route('/api/audio/<filename>')
 def serve_audio(filename):
-    """Serve generated audio files"""
-    audio_path = os.path.join(RESPONSE_FOLDER, filename)
-    if os.path.exists(audio_path):
-        return send_file(audio_path, mimetype='audio/mpeg')
-    return jsonify({'error': 'File not found'}), 404
+    """
+    Serve generated audio files from the audio store
+    Supports Range requests, If-None-Match revalidation and long browser caching.
+    """
+    data = audio_store.get(filename)
+    if data is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    response = Response(data, mimetype='audio/mpeg')
+    response.set_etag(os.path.splitext(filename)[0])
+    response.cache_control.public = True
+    response.cache_control.max_age = AUDIO_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+@app.route('/api/audio/metrics')
+def audio_metrics():
+    """Size of the audio store and how often clips are served from memory"""
+    return jsonify({
+        'store': audio_store.stats(),
+        'tts': tts_cache.stats()
+    })
 
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'service': 'voice_assistant'})
+    return jsonify({
+        'status': 'ok',
+        'service': 'voice_assistant',
+        'speech_engines': {
+            name: engine.available for name, engine in speech_recognizer.engines.items()
+        },
+        'voice_jobs': voice_jobs.stats(),
+        'audio': audio_store.stats(),
+        'motion': motion_events.stats(),
+        'spotify': spotify.stats()
+    })
+
+# ========== METRICS API ==========
+
+METRICS_PUSH_DIR = '/dev/shm/smart_house_metrics'  # Where motion_detection.py / motion_supervisor.py push theirs
+
+@metrics.collect
+def collect_server_metrics():
+    """Numbers the server's objects already count, read when /metrics is scraped"""
+    audio = audio_store.stats()
+    tts = tts_cache.stats()
+    music = spotify.stats()
+    caches = {
+        'audio_memory': (audio['memory_hits'], audio['disk_hits'] + audio['misses']),
+        'audio': (audio['memory_hits'] + audio['disk_hits'], audio['misses']),
+        'tts': (tts['hits'], tts['misses']),
+        'spotify_search': (music['search_hits'], music['search_misses']),
+    }
+    jobs = voice_jobs.stats()
+    families = [
+        family('cache_hits_total', 'counter', 'Lookups answered from a cache',
+               [({'cache': name}, hits) for name, (hits, _) in caches.items()]),
+        family('cache_misses_total', 'counter', 'Lookups a cache could not answer',
+               [({'cache': name}, misses) for name, (_, misses) in caches.items()]),
+        family('cache_hit_ratio', 'gauge', 'Share of lookups answered from a cache since startup',
+               [({'cache': name}, hits / (hits + misses) if hits + misses else None)
+                for name, (hits, misses) in caches.items()]),
+        family('audio_store_bytes', 'gauge', 'Generated audio kept',
+               [({'where': 'disk'}, audio['disk_bytes']), ({'where': 'memory'}, audio['memory_bytes'])]),
+        family('voice_jobs_queued', 'gauge', 'Voice jobs waiting for a stage',
+               [({'stage': name}, stage['queued']) for name, stage in jobs['stages'].items()]),
+        family('voice_jobs_busy', 'gauge', 'Workers of a stage processing a job',
+               [({'stage': name}, stage['busy']) for name, stage in jobs['stages'].items()]),
+        family('voice_jobs_rejected_total', 'counter', 'Voice requests refused with a 503',
+               [({}, jobs['rejected'])]),
+        family('lights_revision', 'gauge', 'Revision of the light store', [({}, light_store.revision)]),
+        family('light_event_subscribers', 'gauge', 'Open light event streams',
+               [({}, light_bus.subscriber_count)]),
+        family('motion_events_received_total', 'counter', 'Motion events received from the detectors',
+               [({}, motion_events.stats()['received'])]),
+    ]
+    if motion_history is not None:
+        families.append(family('motion_history_pending', 'gauge', 'Motion events waiting to be written',
+                               [({}, motion_history.stats()['pending'])]))
+    return families
+
+# What the detector processes pushed, labelled with their process name
+metrics.collect(lambda: read_pushed(METRICS_PUSH_DIR))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Server and detector metrics in the Prometheus text format (see metrics.py)"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+@app.route('/metrics/profile')
+def sampled_profile():
+    """
+    Stacks counted by the sampling profiler, in the folded format of
+    flamegraph.pl and speedscope. ?process=<name> returns the ones a
+    detector pushed. Needs SMART_HOUSE_PROFILE in that process's environment.
+    """
+    process = request.args.get('process')
+    folded = read_pushed_profile(process, METRICS_PUSH_DIR) if process else (profiler and profiler.folded())
+    if folded is None:
+        return jsonify({'success': False, 'error': 'Profiler not enabled (set SMART_HOUSE_PROFILE)'}), 404
+    return Response(folded, mimetype='text/plain')
+
+# ========== MOTION DETECTION API ==========
+
+# Detectors POST their events here (motion_events.MotionPublisher); the recent
+# ones are kept in memory for /api/motion/latest and pushed to the pages over
+# /api/motion/stream, every event and its thumbnail is also stored in the
+# history under MOTION_HISTORY_DIR (motion_history.py)
+MOTION_HISTORY_DIR = '/home/tomas/motion_history'
+MOTION_HISTORY_QUOTA = 2 * 1024 * 1024 * 1024  # Bytes, the oldest days are deleted beyond it
+MOTION_EVENTS_KEPT = 500  # Recent events kept in memory
+MOTION_MAX_BATCH = 100  # Events accepted per POST
+MOTION_MAX_THUMBNAIL = 256 * 1024  # Bytes of an encoded thumbnail
+MOTION_MAX_PAGE = 500  # Events per page of /api/motion/events
+MOTION_CLIPS_DIR = '/home/tomas/motion_clips'  # Where the detectors record clips (motion_clips.py)
+MOTION_MAX_CLIPS = 200  # Clips per /api/motion/clips response
+
+try:
+    motion_history = MotionHistory(
+        MOTION_HISTORY_DIR, MOTION_HISTORY_QUOTA, timer=store_flush_seconds.timer()
+    ).start()
+except OSError as e:
+    print(f"Motion history disabled: {e}")
+    motion_history = None
+motion_bus = EventBus()
+motion_events = MotionEventLog(motion_history, MOTION_EVENTS_KEPT, bus=motion_bus)
+
+def valid_motion_event(event):
+    if not isinstance(event, dict) or not isinstance(event.get('camera'), str):
+        return False
+    if not valid_time(event.get('time')) or not isinstance(event.get('area', 0), (int, float)):
+        return False
+    thumbnail = event.get('thumbnail', '')
+    if not isinstance(thumbnail, str) or len(thumbnail) > MOTION_MAX_THUMBNAIL * 4 // 3 + 4:  # base64
+        return False
+    boxes = event.get('boxes', [])
+    return isinstance(boxes, list) and all(
+        isinstance(box, list) and len(box) == 4 and all(isinstance(v, (int, float)) for v in box)
+        for box in boxes
+    )
+
+@app.route('/api/motion/events', methods=['POST'])
+def add_motion_events():
+    """
+    Publish motion events (from motion_detection.py / motion_supervisor.py)
+    Body: one event {time, camera, label, boxes, area, thumbnail} or
+    {"events": [...]}; thumbnail is an optional base64 JPEG/WebP
+    """
+    data = request.get_json(silent=True)
+    events = data.get('events') if isinstance(data, dict) and 'events' in data else [data]
+    if not isinstance(events, list) or not events or len(events) > MOTION_MAX_BATCH:
+        return jsonify({'success': False, 'error': 'Expected an event or a list of events'}), 400
+    if not all(valid_motion_event(event) for event in events):
+        return jsonify({'success': False, 'error': 'Invalid motion event'}), 400
+
+    thumbnails = []
+    for event in events:
+        try:
+            thumbnails.append(base64.b64decode(event['thumbnail'], validate=True) if event.get('thumbnail') else None)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid thumbnail'}), 400
+
+    ids = [motion_events.add({
+        'time': event['time'],
+        'camera': event['camera'],
+        'label': event.get('label') or event['camera'],
+        'boxes': event.get('boxes', []),
+        'area': event.get('area', 0),
+    }, thumbnail)['id'] for event, thumbnail in zip(events, thumbnails)]
+    return jsonify({'success': True, 'ids': ids})
+
+def parse_event_time(value):
+    """Unix seconds or an ISO date/time (local time) from a query parameter"""
+    if value is None or value == '':
+        return None
+    try:
+        timestamp = float(value)
+    except ValueError:
+        timestamp = datetime.fromisoformat(value).timestamp()
+    if not valid_time(timestamp):
+        raise ValueError(f'Time out of range: {value}')
+    return timestamp
+
+@app.route('/api/motion/events', methods=['GET'])
+def list_motion_events():
+    """
+    Stored motion events, newest first
+    Query: from / to (unix seconds or ISO time, to is exclusive), camera,
+    limit, cursor (the 'next' value of the previous page)
+    """
+    if motion_history is None:
+        return jsonify({'success': False, 'error': 'Motion history is not available'}), 503
+    try:
+        start = parse_event_time(request.args.get('from'))
+        end = parse_event_time(request.args.get('to'))
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MOTION_MAX_PAGE)
+        events, next_cursor = motion_history.query(
+            start, end, request.args.get('camera'), limit, request.args.get('cursor')
+        )
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid from, to, limit or cursor'}), 400
+    return jsonify({'success': True, 'events': events, 'count': len(events), 'next': next_cursor})
+
+@app.route('/api/motion/thumbnails/<partition>/<filename>')
+def motion_thumbnail(partition, filename):
+    """Thumbnail of a stored event (the event's 'thumbnail' path)"""
+    path = motion_history.thumbnail_path(f'{partition}/{filename}') if motion_history else None
+    if path is None:
+        return jsonify({'success': False, 'error': 'Thumbnail not found'}), 404
+    response = send_file(path, mimetype=THUMBNAIL_TYPES[os.path.splitext(filename)[1]])
+    response.headers['Cache-Control'] = f'public, max-age={AUDIO_CACHE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/api/motion/clips')
+def list_motion_clips():
+    """
+    Clips recorded around motion events, newest first
+    Query: camera, limit. Each clip has file, camera, label, start, end,
+    events (times) and bytes; play it from /api/motion/clips/<file>
+    """
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MOTION_MAX_CLIPS)
+    clips = list_clips(MOTION_CLIPS_DIR, request.args.get('camera'), limit)
+    return jsonify({'success': True, 'clips': clips, 'count': len(clips)})
+
+@app.route('/api/motion/clips/<filename>')
+def motion_clip(filename):
+    """A recorded clip (MP4); Range requests are answered so players can seek"""
+    path = clip_path(MOTION_CLIPS_DIR, filename)
+    if path is None:
+        return jsonify({'success': False, 'error': 'Clip not found'}), 404
+    response = send_file(path, mimetype='video/mp4', conditional=True)
+    response.headers['Cache-Control'] = f'public, max-age={AUDIO_CACHE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/api/motion/latest')
+def latest_motion():
+    """Newest motion event, from memory (optional ?camera=<name>)"""
+    event = motion_events.latest(request.args.get('camera'))
+    if event is None:
+        return jsonify({'success': False, 'error': 'No motion detected yet'}), 404
+    return jsonify({'success': True, 'event': event, 'age': round(time.time() - event['time'], 3)})
+
+@app.route('/api/motion/stream')
+def motion_events_stream():
+    """
+    Server-Sent Events stream of motion events ('motion'), optionally for one
+    ?camera=<name>. A reconnecting EventSource sends Last-Event-ID and gets the
+    events it missed that are still in memory.
+    """
+    camera = request.args.get('camera')
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = motion_bus.subscribe()
+    last_sent = last_event_id if last_event_id is not None else motion_events.last_id
+
+    def stream():
+        nonlocal last_sent
+        with subscription:
+            yield "retry: 3000\n\n"
+            missed = motion_events.since(last_sent)
+            while True:
+                for event in missed:
+                    if event['id'] > last_sent:
+                        last_sent = event['id']
+                        if camera is None or event['camera'] == camera:
+                            yield format_sse(event, event['id'])
+                event = subscription.get(timeout=SSE_KEEPALIVE)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    missed = ()
+                elif event['type'] == 'resync':
+                    missed = motion_events.since(last_sent)  # Fell behind: catch up from memory
+                else:
+                    missed = (event,)
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+MOTION_RING_NAME = 'motion_frames'  # FrameRing shared by motion_detection.py
+CAMERA_RING_NAME = 'motion_frames_{name}'  # One per camera of motion_supervisor.py
+motion_rings = {}
+motion_rings_lock = threading.Lock()
+
+def motion_ring(camera=None):
+    """The detector's frame ring for a camera, mapped once; None if it is not running"""
+    name = CAMERA_RING_NAME.format(name=camera) if camera else MOTION_RING_NAME
+    with motion_rings_lock:
+        ring = motion_rings.get(name)
+        if ring is not None and ring.replaced():
+            ring.close()
+            del motion_rings[name]
+            ring = None
+        if ring is None:
+            try:
+                ring = motion_rings[name] = FrameRing.attach(name)
+            except (FileNotFoundError, ValueError):
+                return None
+        return ring
+
+@app.route('/api/motion/frame')
+def motion_frame():
+    """
+    A recent frame analyzed by the motion detector, as JPEG, read from its
+    shared frame ring. Query: camera (motion_supervisor.py camera name),
+    back (0 = newest, 1 = the one before...)
+    """
+    camera = request.args.get('camera')
+    back = request.args.get('back', 0, type=int)
+    if camera is not None and not camera.replace('_', '').replace('-', '').isalnum():
+        return jsonify({'success': False, 'error': 'Invalid camera'}), 400
+    if cv2 is None:
+        return jsonify({'success': False, 'error': 'OpenCV is not installed'}), 503
+
+    ring = motion_ring(camera)
+    if ring is None:
+        return jsonify({'success': False, 'error': 'Motion detection is not running'}), 404
+    if not 0 <= back < ring.capacity:
+        return jsonify({'success': False, 'error': f'back must be from 0 to {ring.capacity - 1}'}), 400
+    frames, stamps = ring.copy_last(back + 1)
+    if len(frames) < back + 1:
+        return jsonify({'success': False, 'error': 'Frame not available'}), 404
+
+    ok, jpeg = cv2.imencode('.jpg', frames[0], [cv2.IMWRITE_JPEG_QUALITY, 80])
+    if not ok:
+        return jsonify({'success': False, 'error': 'Could not encode frame'}), 500
+    response = Response(jpeg.tobytes(), mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Frame-Time'] = f'{stamps[0]:.3f}'
+    return response
 
 # ========== LIGHTS CONTROL API ==========
 
+LIGHTS_BACKEND = 'json'  # 'json' (LIGHTS_FILE) or 'sqlite' (LIGHTS_DB)
 LIGHTS_FILE = '/home/tomas/lights_state.json'
+LIGHTS_DB = '/home/tomas/lights_state.db'
+LIGHTS_FLUSH_DELAY = 1.0  # Seconds to coalesce changes before writing them
+LIGHTS_JOURNAL = False  # Append changes to LIGHTS_FILE.journal between snapshots
+LIGHTS_COMPACT_EVERY = 500  # Journal entries before rewriting the snapshot
+STALE_AFTER = 300  # Seconds without a heartbeat before a light counts as stale
+LIGHTS_WATCH_INTERVAL = 0.2  # SQLite only: seconds between checks for other workers' changes
 
 def load_lights():
-    """Load lights from JSON file"""
-    try:
-        with open(LIGHTS_FILE, 'r') as f:
-            data = json.load(f)
-            if data:
-                return data
-            return initialize_default_lights()
-    except FileNotFoundError:
-        return initialize_default_lights()
-    except Exception as e:
-        print(f"Error loading lights: {e}")
-        return initialize_default_lights()
+    """Open the configured light store, seeding it with the defaults when empty"""
+    store = open_store(
+        LIGHTS_BACKEND,
+        LIGHTS_FILE,
+        LIGHTS_DB,
+        flush_delay=LIGHTS_FLUSH_DELAY,
+        journal=LIGHTS_JOURNAL,
+        compact_every=LIGHTS_COMPACT_EVERY,
+        timer=store_flush_seconds.timer()
+    )
+    if len(store) == 0:
+        store.apply(initialize_default_lights())
+    return store
 
 def initialize_default_lights():
-    """Initialize with default lights"""
+    """Default lights used to seed an empty store"""
     default_lights = {
         'living': {
             'id': 'living',
@@ -356,38 +847,236 @@ def initialize_default_lights():
             'state': False
         }
     }
-    save_lights_to_file(default_lights)
     return default_lights
 
-def save_lights_to_file(lights_data):
-    """Save lights to JSON file"""
-    try:
-        with open(LIGHTS_FILE, 'w') as f:
-            json.dump(lights_data, f, indent=2)
-        return True
-    except Exception as e:
-        print(f"Error saving lights: {e}")
-        return False
+# Initialize the light registry (JSON file or SQLite, see LIGHTS_BACKEND)
+light_store = load_lights()
+
+# ========== LIGHTS CHANGE FEED ==========
+# Every mutation bumps a global, monotonically increasing revision and stamps
+# it on the changed light as 'rev'. Clients use it as an ETag (304 when nothing
+# changed) or long-poll with ?wait=<seconds>&since=<rev> until it moves.
+
+LONG_POLL_MAX_WAIT = 60  # Seconds a long-poll request may block
+SSE_KEEPALIVE = 15  # Seconds between keep-alive comments on idle event streams
+
+# Concurrency model: read-modify-write cycles hold a per-light striped lock
+# and write back with compare-and-swap on the light revision, retrying on a
+# conflict. The lock keeps retries rare inside one process, the revision check
+# (an SQLite transaction with the sqlite backend) keeps other workers honest.
+CAS_RETRIES = 20
+
+lights_changed = threading.Condition()
+light_bus = EventBus()  # Push channel fed by every mutation path
+light_locks = StripedLocks()
+published_revisions = deque(maxlen=4096)  # Revisions this process already published
+
+def publish_light_changes(applied, batch=False):
+    """
+    Wake long-polling clients and publish one event per applied change,
+    or a single 'batch' event covering all of them
+    """
+    with lights_changed:
+        lights_changed.notify_all()
+
+    if batch and applied:
+        light_bus.publish({
+            'type': 'batch',
+            'rev': max(rev for _, _, rev in applied),
+            'lights': {light_id: light for light_id, light, _ in applied if light is not None},
+            'deleted': [light_id for light_id, light, _ in applied if light is None]
+        })
+        return
+
+    for light_id, light, rev in applied:
+        if light is not None:
+            light_bus.publish({'type': 'light', 'rev': rev, 'light_id': light_id, 'light': light})
+        else:
+            light_bus.publish({'type': 'deleted', 'rev': rev, 'light_id': light_id})
+
+def apply_light_changes(changes, expected=None, batch=False):
+    """
+    Store {light_id: light or None} (None deletes), then notify subscribers
+    Raises RevisionConflict if a light in expected is no longer at that revision.
+    Returns the applied changes.
+    """
+    applied = light_store.apply(changes, expected=expected)
+    published_revisions.extend(rev for _, _, rev in applied)
+    publish_light_changes(applied, batch=batch)
+    return applied
 
-# Initialize lights from file
-lights_state = load_lights()
+def save_light(light):
+    """Store a single light unconditionally and return it with its new revision"""
+    return apply_light_changes({light['id']: light})[0][1]
+
+def update_light(light_id, mutate):
+    """
+    Read-modify-write one light without losing concurrent updates
+    mutate(light or None) returns the new light, or None to leave it unchanged.
+    Returns (light, changed).
+    """
+    with light_locks.get(light_id):
+        for _ in range(CAS_RETRIES):
+            current = light_store.get(light_id)
+            updated = mutate(copy.deepcopy(current) if current is not None else None)
+            if updated is None:
+                return current, False
+            try:
+                applied = apply_light_changes(
+                    {light_id: updated},
+                    expected={light_id: current['rev'] if current is not None else None}
+                )
+                return applied[0][1], True
+            except RevisionConflict:
+                continue  # Another worker got there first, re-read and retry
+    raise RevisionConflict(light_id, None, light_revision(light_id))
+
+def watch_light_store():
+    """Publish changes committed by other worker processes (shared SQLite store)"""
+    seen = light_store.revision
+    while True:
+        time.sleep(LIGHTS_WATCH_INTERVAL)
+        try:
+            if light_store.revision <= seen:
+                continue
+            changes = light_store.changes_since(seen)
+            if changes:
+                seen = max(seen, changes[-1][2])
+            local = set(published_revisions)
+            publish_light_changes([change for change in changes if change[2] not in local])
+        except Exception as e:
+            print(f"Error watching light store: {e}")
+
+if LIGHTS_BACKEND == 'sqlite':
+    threading.Thread(target=watch_light_store, name='lights-watcher', daemon=True).start()
+
+def light_revision(light_id):
+    """Current revision of a light, or None if it does not exist"""
+    light = light_store.get(light_id)
+    return light['rev'] if light is not None else None
+
+def parse_bool(value):
+    """Parse a query-string boolean such as 'true', '1' or 'on'"""
+    return value.lower() in ('1', 'true', 'on', 'yes')
+
+def wait_for_change(predicate, timeout):
+    """Block until predicate() is true or timeout expires, return predicate()"""
+    with lights_changed:
+        return lights_changed.wait_for(predicate, timeout=timeout)
+
+def get_long_poll_args():
+    """Parse ?wait=&since= arguments, return (wait_seconds, since_revision)"""
+    wait = request.args.get('wait', type=float)
+    since = request.args.get('since', type=int)
+    if wait is None:
+        return 0, since
+    return max(0.0, min(wait, LONG_POLL_MAX_WAIT)), since
+
+def not_modified(etag):
+    """Build an empty 304 response carrying the current ETag"""
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+def versioned_response(payload, etag):
+    """Build a JSON response tagged with an ETag that clients must revalidate"""
+    response = make_response(jsonify(payload))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/lights', methods=['GET'])
 def get_lights():
-    """Get all lights and their states"""
+    """Get all lights and their states (optionally filtered by ?location=&state=)"""
+    wait, since = get_long_poll_args()
+    if wait and since is not None:
+        wait_for_change(lambda: light_store.revision > since, wait)
+
+    revision = light_store.revision
+    etag = f'lights-{revision}'
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    location = request.args.get('location')
+    state = request.args.get('state', type=parse_bool)
+    if location is not None or state is not None:
+        lights = light_store.query(location=location, state=state)
+    else:
+        lights = light_store.all()
+
+    return versioned_response({
+        'success': True,
+        'revision': revision,
+        'lights': lights
+    }, etag)
+
+@app.route('/api/lights/stale', methods=['GET'])
+def get_stale_lights():
+    """List lights without a heartbeat in the last ?seconds= (default STALE_AFTER)"""
+    seconds = request.args.get('seconds', default=STALE_AFTER, type=float)
     return jsonify({
         'success': True,
-        'lights': lights_state
+        'lights': light_store.stale(seconds)
     })
 
+@app.route('/api/lights/events', methods=['GET'])
+def light_events_stream():
+    """
+    Server-Sent Events stream of light changes
+    Starts with a 'snapshot' event, then sends 'light' / 'deleted' events.
+    A 'resync' event means the client fell behind and should reload.
+    Optional ?light=<id> restricts the stream to a single light.
+    """
+    light_id = request.args.get('light')
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = light_bus.subscribe(light_id=light_id)
+
+    with lights_changed:
+        revision = light_store.revision
+        if light_id is not None:
+            light = light_store.get(light_id)
+            snapshot = {light_id: light} if light is not None else {}
+        else:
+            snapshot = light_store.all()
+
+    def stream():
+        with subscription:
+            if last_event_id != revision:
+                yield format_sse({'type': 'snapshot', 'rev': revision, 'lights': snapshot}, revision)
+            while True:
+                event = subscription.get(timeout=SSE_KEEPALIVE)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif event['type'] == 'resync':
+                    yield format_sse(event)
+                elif event['rev'] > revision:
+                    yield format_sse(event, event['rev'])
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/lights/<light_id>', methods=['GET'])
 def get_light(light_id):
-    """Get specific light state"""
-    if light_id in lights_state:
-        return jsonify({
+    """Get specific light state (supports ETag and ?wait=&since= long-polling)"""
+    wait, since = get_long_poll_args()
+    if wait and since is not None:
+        wait_for_change(
+            lambda: light_revision(light_id) is None or light_revision(light_id) > since,
+            wait
+        )
+
+    light = light_store.get(light_id)
+    if light is not None:
+        etag = f'{light_id}-{light["rev"]}'
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
+        return versioned_response({
             'success': True,
-            'light': lights_state[light_id]
-        })
+            'light': light
+        }, etag)
     else:
         return jsonify({
             'success': False,
@@ -400,36 +1089,238 @@ def toggle_light_api(light_id):
     data = request.get_json() or {}
     state = data.get('state')
 
-    if light_id not in lights_state:
-        lights_state[light_id] = {
-            'id': light_id,
-            'name': data.get('name', 'Unknown'),
-            'location': data.get('location', 'Unknown'),
-            'state': False
-        }
+    def toggle(light):
+        if light is None:
+            light = {
+                'id': light_id,
+                'name': data.get('name', 'Unknown'),
+                'location': data.get('location', 'Unknown'),
+                'state': False
+            }
+
+        if state is not None:
+            light['state'] = state
+        else:
+            light['state'] = not light.get('state', False)
+        return light
+
+    light, _ = update_light(light_id, toggle)
+
+    return jsonify({
+        'success': True,
+        'light': light
+    })
 
-    if state is not None:
-        lights_state[light_id]['state'] = state
+# Fields owned by the server, clients cannot set them
+SERVER_FIELDS = ('id', 'rev', 'last_seen')
+
+def select_lights(lights, ids=None, where=None):
+    """Filter {light_id: light} by an id list and/or a field-equality predicate"""
+    selected = {}
+    for light_id, light in lights.items():
+        if ids is not None and light_id not in ids:
+            continue
+        if where and any(light.get(field) != value for field, value in where.items()):
+            continue
+        selected[light_id] = light
+    return selected
+
+@app.route('/api/lights/batch', methods=['POST'])
+def batch_lights():
+    """
+    Apply the same change to many lights atomically
+    Expected JSON (selectors are combined, at least one is required):
+    {
+        "ids": ["living", "kitchen"],
+        "location": "📍 Planta Baja",
+        "where": {"state": true},
+        "set": {"state": false}
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    ids = data.get('ids')
+    location = data.get('location')
+    where = data.get('where') or {}
+    updates = data.get('set')
+
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, str) for i in ids)):
+        return jsonify({'success': False, 'error': 'ids must be a list of light ids'}), 400
+    if not isinstance(where, dict):
+        return jsonify({'success': False, 'error': 'where must be an object'}), 400
+    if ids is None and location is None and not where:
+        return jsonify({'success': False, 'error': 'Select lights with ids, location or where'}), 400
+    if not isinstance(updates, dict) or not updates:
+        return jsonify({'success': False, 'error': 'Nothing to set'}), 400
+    if any(field in SERVER_FIELDS for field in updates):
+        return jsonify({'success': False, 'error': f'Cannot set {", ".join(SERVER_FIELDS)}'}), 400
+
+    for _ in range(CAS_RETRIES):
+        candidates = light_store.query(location=location) if location is not None else light_store.all()
+        selected = select_lights(candidates, ids=set(ids) if ids is not None else None, where=where)
+
+        changes, expected = {}, {}
+        for light_id, light in selected.items():
+            if any(light.get(field) != value for field, value in updates.items()):
+                changes[light_id] = dict(light, **updates)
+                expected[light_id] = light['rev']
+
+        try:
+            # One store transaction, one flush and one 'batch' event for the lot
+            applied = apply_light_changes(changes, expected=expected, batch=True)
+            break
+        except RevisionConflict:
+            continue
     else:
-        lights_state[light_id]['state'] = not lights_state[light_id].get('state', False)
+        return jsonify({'success': False, 'error': 'Too many concurrent changes, retry'}), 409
 
-    save_lights_to_file(lights_state)
+    for light_id, light, _ in applied:
+        selected[light_id] = light
 
     return jsonify({
         'success': True,
-        'light': lights_state[light_id]
+        'revision': light_store.revision,
+        'matched': len(selected),
+        'changed': len(applied),
+        'lights': selected
     })
 
+def parse_patch_path(path):
+    """Split a JSON pointer like '/living/state' into ('living', 'state')"""
+    if not isinstance(path, str) or not path.startswith('/'):
+        raise ValueError(f'Invalid path: {path}')
+    parts = [part.replace('~1', '/').replace('~0', '~') for part in path[1:].split('/')]
+    if len(parts) > 2 or not all(parts):
+        raise ValueError(f'Unsupported path: {path}')
+    return parts[0], parts[1] if len(parts) == 2 else None
+
+def apply_patch(lights, patch):
+    """
+    Apply JSON-patch style operations (add / replace / remove) to a
+    {light_id: light} map in place. Paths are /<light_id> or /<light_id>/<field>.
+    Returns the set of touched light ids.
+    """
+    touched = set()
+    for operation in patch:
+        if not isinstance(operation, dict):
+            raise ValueError('A patch operation must be an object')
+        op = operation.get('op')
+        light_id, field = parse_patch_path(operation.get('path'))
+        if field in SERVER_FIELDS:
+            raise ValueError(f'Cannot change {field}')
+        if op not in ('add', 'replace', 'remove'):
+            raise ValueError(f'Unsupported op: {op}')
+        if op in ('add', 'replace') and 'value' not in operation:
+            raise ValueError(f'Missing value for {operation["path"]}')
+
+        if field is None:
+            if op == 'remove':
+                if lights.get(light_id) is None:
+                    raise ValueError(f'Light not found: {light_id}')
+                lights[light_id] = None
+            else:
+                if not isinstance(operation['value'], dict):
+                    raise ValueError(f'A light must be an object: {light_id}')
+                light = {k: v for k, v in operation['value'].items() if k not in SERVER_FIELDS}
+                light['id'] = light_id
+                lights[light_id] = light
+        else:
+            light = lights.get(light_id)
+            if light is None:
+                raise ValueError(f'Light not found: {light_id}')
+            if op == 'remove':
+                light.pop(field, None)
+            else:
+                light[field] = operation['value']
+        touched.add(light_id)
+    return touched
+
 @app.route('/api/lights/sync', methods=['POST'])
 def sync_lights():
-    """Sync all lights state from frontend"""
-    global lights_state
-    data = request.get_json()
+    """
+    Sync lights state from frontend
+    Either the full document ({"lights": {...}, "revision": N}) or only the
+    differences as JSON-patch operations:
+    {"patch": [{"op": "replace", "path": "/living/state", "value": true}]}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Invalid data'}), 400
+
+    if 'patch' in data:
+        if not isinstance(data['patch'], list):
+            return jsonify({'success': False, 'error': 'patch must be a list'}), 400
+
+        for _ in range(CAS_RETRIES):
+            previous = light_store.all()
+            lights = copy.deepcopy(previous)
+            try:
+                touched = apply_patch(lights, data['patch'])
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+
+            changes = {light_id: lights[light_id] for light_id in touched}
+            expected = {light_id: previous[light_id]['rev'] if light_id in previous else None
+                        for light_id in touched}
+            try:
+                apply_light_changes(changes, expected=expected, batch=len(changes) > 1)
+                break
+            except RevisionConflict:
+                continue
+        else:
+            return jsonify({'success': False, 'error': 'Too many concurrent changes, retry'}), 409
+
+        return jsonify({'success': True, 'revision': light_store.revision, 'conflicts': []})
+
+    if 'lights' in data:
+        if not isinstance(data['lights'], dict):
+            return jsonify({'success': False, 'error': 'lights must be an object'}), 400
+        bad = [light_id for light_id, light in data['lights'].items() if not isinstance(light, dict)]
+        if bad:
+            return jsonify({'success': False, 'error': f'A light must be an object: {", ".join(bad)}'}), 400
+        if data.get('revision') is not None and not isinstance(data['revision'], int):
+            return jsonify({'success': False, 'error': 'revision must be an integer'}), 400
+        # 'revision' is the revision the client's copy is based on. Lights that
+        # changed on the server since then are left alone and reported back as
+        # conflicts instead of being overwritten with the client's stale copy.
+        base_revision = data.get('revision')
+        server_fields = ('rev', 'last_seen')
+
+        for _ in range(CAS_RETRIES):
+            previous = light_store.all()
+            changes, expected, conflicts = {}, {}, []
+
+            # Only lights whose content actually changed get a new revision
+            for light_id, light in data['lights'].items():
+                old = previous.get(light_id)
+                old_fields = {k: v for k, v in (old or {}).items() if k not in server_fields}
+                new_fields = {k: v for k, v in light.items() if k not in server_fields}
+                if old is None or old_fields != new_fields:
+                    if old is not None and base_revision is not None and old['rev'] > base_revision:
+                        conflicts.append(light_id)
+                        continue
+                    if old is not None and 'last_seen' in old:
+                        new_fields['last_seen'] = old['last_seen']
+                    changes[light_id] = new_fields
+                    expected[light_id] = old['rev'] if old is not None else None
+            for light_id, old in previous.items():
+                if light_id not in data['lights']:
+                    if base_revision is not None and old['rev'] > base_revision:
+                        conflicts.append(light_id)
+                        continue
+                    changes[light_id] = None
+                    expected[light_id] = old['rev']
+
+            try:
+                apply_light_changes(changes, expected=expected)
+                break
+            except RevisionConflict:
+                continue  # Changed underneath us, diff again
+        else:
+            return jsonify({'success': False, 'error': 'Too many concurrent changes, retry'}), 409
 
-    if data and 'lights' in data:
-        lights_state = data['lights']
-        save_lights_to_file(lights_state)
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'revision': light_store.revision, 'conflicts': conflicts})
 
     return jsonify({'success': False, 'error': 'Invalid data'}), 400
 
@@ -468,37 +1359,42 @@ def register_esp32_light():
 
     light_id = data['id']
 
-    # Check if light already exists
-    if light_id in lights_state:
-        # Update existing light (useful for reconnections)
-        lights_state[light_id].update({
+    outcome = {}
+
+    def register(light):
+        outcome['action'] = 'updated' if light is not None else 'created'
+        if light is not None:
+            # Update existing light (useful for reconnections)
+            light.update({
+                'name': data['name'],
+                'location': data['location'],
+                'icon': data.get('icon', '💡'),
+                'last_seen': time.time()
+                # Keep existing state
+            })
+            return light
+
+        # Create new light
+        return {
+            'id': light_id,
             'name': data['name'],
             'location': data['location'],
-            'icon': data.get('icon', '💡')
-            # Keep existing state
-        })
+            'icon': data.get('icon', '💡'),
+            'state': data.get('state', False),
+            'last_seen': time.time()
+        }
 
-        save_lights_to_file(lights_state)
+    new_light, _ = update_light(light_id, register)
 
+    # Check if light already existed
+    if outcome['action'] == 'updated':
         return jsonify({
             'success': True,
             'message': 'Light updated successfully',
-            'light': lights_state[light_id],
+            'light': new_light,
             'action': 'updated'
         })
 
-    # Create new light
-    new_light = {
-        'id': light_id,
-        'name': data['name'],
-        'location': data['location'],
-        'icon': data.get('icon', '💡'),
-        'state': data.get('state', False)
-    }
-
-    lights_state[light_id] = new_light
-    save_lights_to_file(lights_state)
-
     print(f"New ESP32 light registered: {light_id} - {data['name']}")
 
     return jsonify({
@@ -516,29 +1412,42 @@ def esp32_heartbeat(light_id):
     """
     data = request.get_json() or {}
 
-    if light_id not in lights_state:
+    light = light_store.get(light_id)
+    if light is None:
         return jsonify({
             'success': False,
             'error': 'Light not registered. Please register first.'
         }), 404
 
+    # Liveness only, no new revision and no write for an unchanged state
+    last_seen = time.time()
+    light_store.touch(light_id, last_seen)
+
     # Update state if provided
     if 'state' in data:
-        lights_state[light_id]['state'] = data['state']
-        save_lights_to_file(lights_state)
+        def report_state(current):
+            if current is None or current.get('state') == data['state']:
+                return None
+            current['state'] = data['state']
+            return current
+
+        light, _ = update_light(light_id, report_state)
+        if light is None:
+            return jsonify({
+                'success': False,
+                'error': 'Light not registered. Please register first.'
+            }), 404
+    light['last_seen'] = last_seen
 
     return jsonify({
         'success': True,
-        'light': lights_state[light_id]
+        'light': light
     })
 
 @app.route('/api/lights/<light_id>', methods=['DELETE'])
 def delete_light(light_id):
     """Delete a light (for manual cleanup or ESP32 deregistration)"""
-    if light_id in lights_state:
-        del lights_state[light_id]
-        save_lights_to_file(lights_state)
-
+    if apply_light_changes({light_id: None}):
         return jsonify({
             'success': True,
             'message': 'Light deleted successfully'
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Audio Store
+Bounded storage for the audio the assistant generates.
+Clips live as files in one directory, written atomically, with the most
+recently used ones also held in an in-memory LRU so serving a hot reply
+never touches the disk. A background sweeper keeps the directory within an
+age and size quota (oldest first, pinned clips excepted) and removes the
+temp files a crash can leave behind.
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+MAX_DISK_BYTES = 50 * 1024 * 1024  # Directory budget before the oldest clips go
+MAX_AGE = 30 * 24 * 3600  # Seconds a clip may go unused before it is removed
+MEMORY_BYTES = 8 * 1024 * 1024  # Budget of the in-memory LRU
+SWEEP_INTERVAL = 600  # Seconds between two background sweeps
+TOUCH_INTERVAL = 3600  # Refresh a clip's mtime at most this often
+TEMP_MAX_AGE = 60  # Seconds after which an unfinished temp file is a leftover
+
+
+class AudioStore:
+    """Audio files in a directory with an in-memory LRU in front"""
+
+    def __init__(self, directory, pattern=r'[\w.-]+\.mp3', max_disk_bytes=MAX_DISK_BYTES,
+                 max_age=MAX_AGE, memory_bytes=MEMORY_BYTES, sweep_interval=SWEEP_INTERVAL):
+        self.directory = directory
+        self.pattern = re.compile(pattern)
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.memory_bytes = memory_bytes
+        self.sweep_interval = sweep_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._memory = OrderedDict()  # name -> bytes, most recent last
+        self._memory_size = 0
+        self._touched = {}  # name -> last mtime refresh
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self.disk_bytes = 0
+        self.disk_files = 0
+
+    def valid_name(self, name):
+        return self.pattern.fullmatch(name) is not None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    # ----- reads -----
+
+    def get(self, name):
+        """Bytes of a clip, from memory when hot, None if unknown"""
+        if not self.valid_name(name):
+            return None
+        with self._lock:
+            data = self._memory.get(name)
+            if data is not None:
+                self._memory.move_to_end(name)
+                self.memory_hits += 1
+        if data is None:
+            try:
+                with open(self.path(name), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(name, data)
+        self._touch(name)
+        return data
+
+    def __contains__(self, name):
+        with self._lock:
+            if name in self._memory:
+                return True
+        return self.valid_name(name) and os.path.exists(self.path(name))
+
+    # ----- writes -----
+
+    def put(self, name, data):
+        """Store a clip atomically (temp file + rename) and keep it hot"""
+        if not self.valid_name(name):
+            raise ValueError(f"invalid audio file name: {name}")
+        path = self.path(name)
+        fd, tmp_path = tempfile.mkstemp(prefix='.audio_', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = None
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._remember(name, data)
+        with self._lock:
+            self._touched[name] = time.time()
+            self.writes += 1
+            self.disk_bytes += len(data) - (replaced or 0)
+            if replaced is None:
+                self.disk_files += 1
+            over_budget = self.disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self.sweep()
+
+    def pin(self, name):
+        """Never sweep this clip away"""
+        self._pinned.add(name)
+
+    def _remember(self, name, data):
+        with self._lock:
+            old = self._memory.pop(name, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[name] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+                _, old = self._memory.popitem(last=False)
+                self._memory_size -= len(old)
+
+    def _touch(self, name):
+        """Keep a clip's mtime fresh so the age quota sees it as used"""
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(name, 0) < TOUCH_INTERVAL:
+                return
+            self._touched[name] = now
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            pass
+
+    def _forget(self, name):
+        with self._lock:
+            data = self._memory.pop(name, None)
+            if data is not None:
+                self._memory_size -= len(data)
+            self._touched.pop(name, None)
+
+    # ----- quota -----
+
+    def sweep(self):
+        """
+        Remove leftover temp files, clips unused for max_age, then the oldest
+        clips until the directory is under max_disk_bytes. Returns the number
+        of files removed.
+        """
+        now = time.time()
+        clips = []
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.tmp'):
+                if now - stat.st_mtime > TEMP_MAX_AGE:
+                    removed += self._remove(entry.name)
+                continue
+            if entry.is_file() and self.valid_name(entry.name):
+                clips.append((stat.st_mtime, stat.st_size, entry.name))
+
+        clips.sort()
+        total = sum(size for _, size, _ in clips)
+        files = len(clips)
+        for mtime, size, name in clips:
+            if name in self._pinned:
+                continue
+            if now - mtime <= self.max_age and total <= self.max_disk_bytes:
+                break
+            removed += self._remove(name)
+            self._forget(name)
+            total -= size
+            files -= 1
+
+        with self._lock:
+            self.disk_bytes = total
+            self.disk_files = files
+            self.evicted += removed
+        return removed
+
+    def _remove(self, name):
+        try:
+            os.remove(self.path(name))
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    def start(self):
+        """Sweep now and then every sweep_interval seconds in a background thread"""
+        self.sweep()
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='audio-sweeper', daemon=True)
+            self._sweeper.start()
+        return self
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except OSError as e:
+                print(f"Audio sweep failed: {e}")
+
+    def close(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'disk_bytes': self.disk_bytes,
+                'disk_files': self.disk_files,
+                'memory_bytes': self._memory_size,
+                'memory_files': len(self._memory),
+                'pinned': len(self._pinned),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else None,
+                'memory_hit_ratio': round(self.memory_hits / lookups, 3) if lookups else None,
+                'writes': self.writes,
+                'evicted': self.evicted,
+            }
+
+
+def clean_directory(directory, older_than=0):
+    """
+    Delete the files in directory (not subdirectories) last modified more
+    than older_than seconds ago. Used at startup for crash leftovers.
+    """
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime >= older_than:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Capture source benchmark
+Reads a live stand-in stream (benchmarks/stream_standin.py: the test
+pattern, or --clip looped in real time) through each capture source of
+capture_source.py and analyzes one frame per --interval with the detector,
+like motion_detection.py does, for --seconds each. Reports the CPU time the
+whole reading and detection took (this process plus its ffmpeg decoder,
+the stand-in's encoder excluded) as a share of one core, the frames the
+grabber decoded per second and the frame size the detector got:
+
+  opencv      cv2.VideoCapture, every frame decoded in color at full size
+  gray        ffmpeg, full size, raw gray
+  scaled      ffmpeg, scaled to the process width, raw gray
+  scaled-fps  the same, only FRAMES_PER_INTERVAL frames per interval passed on
+  keyframes   ffmpeg decoding keyframes only (the stand-in sends one a second)
+  substream   a second stand-in at --substream-size read instead of the main stream
+
+With --direct the clip file is read directly instead (paced at its rate),
+where frame dropping and keyframes do not apply.
+
+Usage: python3 benchmarks/bench_capture_sources.py [--seconds 20] [--clip cam.mp4] [--sources opencv,scaled]
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from capture_source import FRAMES_PER_INTERVAL, CaptureSource, choose_source  # noqa: E402
+from frame_grabber import FrameGrabber  # noqa: E402
+from motion_detection import CAPTURE_INTERVAL, DETECTION_MODE, PROCESS_WIDTH, create_detector  # noqa: E402
+from stream_standin import start_stream  # noqa: E402
+
+SOURCES = ('opencv', 'gray', 'scaled', 'scaled-fps', 'keyframes', 'substream')
+
+
+def cpu_seconds():
+    """CPU time of this process and its finished children (the ffmpeg decoders)"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def make_source(name, url, args, substream=None):
+    fps = max(1, round(FRAMES_PER_INTERVAL / args.interval))
+    if name == 'opencv':
+        return CaptureSource('opencv', url)
+    if name == 'gray':
+        return CaptureSource('ffmpeg', url)
+    if name == 'scaled':
+        return CaptureSource('ffmpeg', url, args.process_width)
+    if name == 'scaled-fps':
+        return CaptureSource('ffmpeg', url, args.process_width, fps)
+    if name == 'keyframes':
+        return CaptureSource('ffmpeg', url, args.process_width, keyframes=True)
+    return CaptureSource('substream', substream, args.process_width, fps, source_width=args.width)
+
+
+def measure(source, args, pace=None):
+    """Read and analyze for args.seconds; returns the figures of one source"""
+    grabber = FrameGrabber(source.url, source.open, name=source.kind, pace=pace).start()
+    detector = create_detector(args.mode)
+    first = grabber.read(timeout=15)  # Connecting is not measured
+    if first is None:
+        grabber.stop()
+        return None
+    cpu_start, wall_start, grabbed_start = cpu_seconds(), time.monotonic(), grabber.grabbed
+    analyzed = 0
+    detect_seconds = 0.0
+    size = first.image.shape
+    next_capture = wall_start
+    while time.monotonic() - wall_start < args.seconds:
+        delay = next_capture - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_capture += args.interval
+        frame = grabber.read(timeout=5)
+        if frame is None:
+            continue
+        begin = time.perf_counter()
+        detector.set_source_width(frame.source_width)
+        detector.detect(frame.image)
+        detect_seconds += time.perf_counter() - begin
+        grabber.done(frame)
+        analyzed += 1
+        size = frame.image.shape
+    wall = time.monotonic() - wall_start
+    grabbed = grabber.grabbed - grabbed_start
+    grabber.stop()  # Waits for the decoder, so its CPU time is counted
+    cpu = cpu_seconds() - cpu_start
+    return {
+        'cpu': cpu / wall,
+        'decoded_fps': grabbed / wall,
+        'analyzed': analyzed,
+        'detect_ms': 1000 * detect_seconds / analyzed if analyzed else 0.0,
+        'size': f"{size[1]}x{size[0]}{'' if len(size) == 2 else ' BGR'}",
+        'latency_ms': 1000 * grabber.latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', default=','.join(SOURCES))
+    parser.add_argument('--seconds', type=float, default=20, help='measured per source')
+    parser.add_argument('--clip', help='video file to stream instead of the test pattern')
+    parser.add_argument('--direct', action='store_true', help='read --clip directly instead of streaming it')
+    parser.add_argument('--size', default='1280x720', help='stand-in stream size (test pattern)')
+    parser.add_argument('--substream-size', default='640x360')
+    parser.add_argument('--rate', type=int, default=25)
+    parser.add_argument('--container', default='mpegts', help="stand-in container ('matroska' also works)")
+    parser.add_argument('--interval', type=float, default=CAPTURE_INTERVAL)
+    parser.add_argument('--process-width', type=int, default=PROCESS_WIDTH)
+    parser.add_argument('--mode', default=DETECTION_MODE)
+    args = parser.parse_args()
+    cv2.setNumThreads(1)  # Like a detection worker
+    args.width = int(args.size.split('x')[0])
+    names = args.sources.split(',')
+    if args.direct:
+        if not args.clip:
+            parser.error('--direct needs --clip')
+        names = [name for name in names if name in ('opencv', 'gray', 'scaled')]
+
+    pick = choose_source('rtsp://camera', args.process_width, args.interval, 'rtsp://camera/sub',
+                         int(args.substream_size.split('x')[0]), 1.0)
+    print(f"{os.cpu_count()} CPU(s), one frame per {args.interval}s, process width {args.process_width}")
+    print(f"choose_source with a sub-stream and 1 s keyframes picks: {pick.describe()}")
+    print(f"{'source':<11} {'CPU':>6} {'decoded':>8} {'analyzed':>8} {'detect':>8} {'latency':>8}  frames")
+    for name in names:
+        processes = []
+        try:
+            if args.direct:
+                pace = cv2.VideoCapture(args.clip).get(cv2.CAP_PROP_FPS) or args.rate
+                source = make_source(name, args.clip, args)
+            else:
+                pace = None
+                duration = args.seconds + 30
+                # The sub-stream is a second, smaller stand-in (only one of them runs at a time)
+                substream = name == 'substream'
+                process, url = start_stream(size=args.substream_size if substream else args.size, rate=args.rate,
+                                            duration=duration, source=args.clip, scale=substream,
+                                            container=args.container)
+                processes.append(process)
+                source = make_source(name, url, args, url)
+            result = measure(source, args, pace)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+        if result is None:
+            print(f"{name:<11} no frames")
+            continue
+        print(f"{name:<11} {100 * result['cpu']:>5.1f}% {result['decoded_fps']:>6.1f}/s {result['analyzed']:>8} "
+              f"{result['detect_ms']:>6.2f}ms {result['latency_ms']:>6.1f}ms  {result['size']}")
+
+
+if __name__ == '__main__':
+    main()
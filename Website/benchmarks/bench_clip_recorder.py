@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Clip recorder benchmark
+Renders a synthetic scene (benchmarks/motion_scenes.py, by default a person
+walking across the room twice) into an H.264 file like a camera's stream,
+lets a ClipRecorder record it (ffmpeg plays the file in real time) and
+calls trigger() once a second while something moves, like the detector.
+Reports how long trigger() held the caller, the CPU used by the recorder
+and its ffmpeg processes (remuxing only, nothing is decoded), the size of
+the segment ring kept for the pre-roll, and the clips written: how many
+events were merged into them and how many were evicted by --quota.
+
+Usage: python3 benchmarks/bench_clip_recorder.py [--scene walk] [--seconds 60] [--size 1280x720] [--fps 10]
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from motion_clips import FFMPEG, ClipRecorder, list_clips  # noqa: E402
+from motion_scenes import SCENES, scene_frames  # noqa: E402
+
+
+def cpu_seconds():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def render(path, scene, width, height, seconds, fps):
+    """Encode the scene like a camera would (a keyframe every second); returns when it moves"""
+    encoder = subprocess.Popen(
+        [shutil.which(FFMPEG) or FFMPEG, '-hide_banner', '-loglevel', 'error', '-y',
+         '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:0',
+         '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(fps), '-pix_fmt', 'yuv420p', path],
+        stdin=subprocess.PIPE
+    )
+    moving = []
+    for t, frame, moves in scene_frames(scene, width, height, seconds, fps):
+        encoder.stdin.write(frame.tobytes())
+        moving.append((t, moves))
+    encoder.stdin.close()
+    encoder.wait()
+    return moving
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scene', default='walk', choices=SCENES)
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--quota', type=float, default=None, help='clip quota in MB (default: no eviction)')
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split('x'))
+
+    directory = tempfile.mkdtemp(prefix='motion_clips_')
+    try:
+        # Render first, so generating the scene is not measured
+        video = os.path.join(directory, 'scene.mp4')
+        moving = render(video, args.scene, width, height, args.seconds, args.fps)
+        quota = args.quota * 1e6 if args.quota is not None else 1e15
+        recorder = ClipRecorder(os.path.join(directory, 'clips'), 'bench', quota=quota,
+                                segment_dir=os.path.join(directory, 'segments'))
+        latencies = []
+        triggers = 0
+        last_trigger = None
+        ring_bytes = []
+        cpu_start = cpu_seconds()
+        base = time.time()
+        recorder.start().capture(video)
+        for t, moves in moving:
+            delay = base + t - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if moves and (last_trigger is None or t - last_trigger >= 1.0):
+                begin = time.perf_counter()
+                recorder.trigger(base + t)
+                latencies.append(time.perf_counter() - begin)
+                last_trigger = t
+                triggers += 1
+            stats = recorder.stats()
+            if stats['recording'] is None:
+                ring_bytes.append(stats['segment_bytes'])
+        time.sleep(recorder.post_roll)
+        recorder.stop(timeout=60)  # Finishes the last clip
+        wall = time.time() - base
+        cpu = cpu_seconds() - cpu_start
+
+        stats = recorder.stats()
+        latencies = sorted(1e6 * value for value in latencies) or [0]
+        clips = list_clips(recorder.directory)
+        print(f"{len(moving)} frames of '{args.scene}' at {args.size}, {args.fps} fps, "
+              f"{os.path.getsize(video) * 8 / args.seconds / 1e6:.1f} Mbit/s")
+        print(f"  trigger: p50 {statistics.median(latencies):.0f} us, max {latencies[-1]:.0f} us")
+        print(f"  CPU (recorder + ffmpeg): {100 * cpu / wall:.1f}% of one core")
+        print(f"  pre-roll ring: {statistics.median(ring_bytes or [0]) / 1e6:.1f} MB between clips (median), "
+              f"{stats['restarts']} stream restarts")
+        print(f"  {triggers} events -> {len(clips)} clips ({stats['merged']} events merged into open clips), "
+              f"{stats['evicted']} evicted, {stats['failed']} failed")
+        for clip in sorted(clips, key=lambda clip: clip['start']):
+            print(f"    {clip['file']}: {clip['start'] - base:6.1f}s - {clip['end'] - base:6.1f}s, "
+                  f"{len(clip['events'])} events, {clip['bytes'] / 1e6:.2f} MB")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Frame grabber benchmark
+Reads a live stand-in stream (benchmarks/stream_standin.py) for --seconds
+with analysis that takes --analysis seconds per sampled frame, through:
+  - the old loop: cap.read() + sleep(0.01), analysis in the same loop
+  - FrameGrabber: a grabber thread, analysis once per --interval
+and reports how many frames were analyzed, how far behind live the analyzed
+frames were (lag) and the CPU used. A slow analysis makes the old loop fall
+further and further behind; the grabber always analyzes a fresh frame.
+
+Usage: python3 benchmarks/bench_frame_grabber.py [--seconds 15] [--analysis 0.05,1.5]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from frame_grabber import FrameGrabber  # noqa: E402
+from motion_detection import MotionDetector  # noqa: E402
+from stream_standin import start_stream  # noqa: E402
+
+
+def analyze(detector, image, delay):
+    detector.detect(image)
+    time.sleep(delay)  # The rest of a slow analysis (e.g. a Raspberry Pi at full resolution)
+
+
+class LagMeter:
+    """
+    How far behind live analyzed frames are: wall clock minus stream time,
+    relative to the freshest frame seen (the stream's own startup delay)
+    """
+
+    def __init__(self):
+        self.offsets = []
+
+    def add(self, position):
+        self.offsets.append(time.monotonic() - position)
+
+    @property
+    def lags(self):
+        freshest = min(self.offsets)
+        return [offset - freshest for offset in self.offsets]
+
+
+def run_old_loop(url, seconds, interval, delay):
+    detector = MotionDetector()
+    cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+    lag = LagMeter()
+    last_capture = None
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        now = time.monotonic()
+        if last_capture is None:
+            last_capture = now
+        if now - last_capture >= interval:
+            analyze(detector, frame, delay)
+            lag.add(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+            last_capture = now
+        time.sleep(0.01)
+    cap.release()
+    return lag.lags
+
+
+def run_grabber(url, seconds, interval, delay):
+    detector = MotionDetector()
+    grabber = FrameGrabber(url, name='bench').start()
+    lag = LagMeter()
+    end = time.monotonic() + seconds
+    next_capture = time.monotonic()
+    while time.monotonic() < end:
+        pause = next_capture - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+        next_capture = max(next_capture + interval, time.monotonic())
+        frame = grabber.read(timeout=5)
+        if frame is None:
+            break
+        analyze(detector, frame.image, delay)
+        grabber.done(frame)
+        lag.add(frame.position)
+    stats = grabber.stats()
+    grabber.stop()
+    return lag.lags, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between analyzed frames')
+    parser.add_argument('--analysis', default='0.05,1.5', help='seconds each analysis takes, comma separated')
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--rate', type=int, default=25)
+    args = parser.parse_args()
+
+    print(f"{args.size} at {args.rate} fps, one analysis every {args.interval}s")
+    print(f"{'analysis':>9} {'mode':>12} {'analyzed':>9} {'lag p50':>8} {'lag max':>8} {'cpu':>6}")
+    for delay in (float(d) for d in args.analysis.split(',')):
+        for mode in ('old loop', 'FrameGrabber'):
+            process, url = start_stream(size=args.size, rate=args.rate, duration=args.seconds + 10)
+            cpu = time.process_time()
+            wall = time.perf_counter()
+            if mode == 'old loop':
+                lags = run_old_loop(url, args.seconds, args.interval, delay)
+                extra = ''
+            else:
+                lags, stats = run_grabber(url, args.seconds, args.interval, delay)
+                extra = (f"  decode {stats['decode_fps']} fps, {stats['skipped']} skipped, "
+                         f"latency {stats['latency'] * 1000:.0f} ms")
+            cpu = 100 * (time.process_time() - cpu) / (time.perf_counter() - wall)
+            process.terminate()
+            process.wait()
+            print(f"{delay:>8.2f}s {mode:>12} {len(lags):>9} {statistics.median(lags):>7.2f}s "
+                  f"{max(lags):>7.2f}s {cpu:>5.0f}%{extra}")
+
+
+if __name__ == '__main__':
+    main()
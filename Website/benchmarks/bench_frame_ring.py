@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Frame history benchmark
+Keeps the last --capacity gray frames of a stream of 1080p frames:
+  - the old way: list.append(gray.copy()) + list.pop(0)
+  - FrameRing: cvtColor straight into the next slot of a preallocated block
+and reports the time per frame, plus how fast another process can copy the
+last frames out of a shared ring while it is being written.
+
+Usage: python3 benchmarks/bench_frame_ring.py [--frames 500] [--capacity 10]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from frame_ring import FrameRing  # noqa: E402
+
+WIDTH, HEIGHT = 1920, 1080
+
+
+def list_history(capacity):
+    images = []
+
+    def add(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        images.append(gray.copy())
+        if len(images) > capacity:
+            images.pop(0)
+    return add
+
+
+def ring_history(capacity):
+    ring = FrameRing(capacity, HEIGHT, WIDTH)
+
+    def add(frame):
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=ring.next_slot())
+        ring.commit()
+    return add
+
+
+def measure(make, frames, capacity):
+    """Time per frame once the history is full"""
+    add = make(capacity)
+    for frame in frames[:capacity]:
+        add(frame)
+    start = time.perf_counter()
+    for frame in frames[capacity:]:
+        add(frame)
+    elapsed = time.perf_counter() - start
+    return elapsed / (len(frames) - capacity)
+
+
+def allocations(make, frame, capacity, samples=50):
+    """Bytes allocated per added frame, after the history is full"""
+    add = make(capacity)
+    for _ in range(capacity):
+        add(frame)
+    total = 0
+    for _ in range(samples):
+        tracemalloc.start()
+        add(frame)
+        total += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return total / samples
+
+
+def writer(name, capacity, frames, ready):
+    ring = FrameRing.create_shared(name, capacity, HEIGHT, WIDTH)
+    ready.set()
+    gray = np.zeros((HEIGHT, WIDTH), np.uint8)
+    for i in range(frames):
+        gray[:] = i % 256
+        ring.push(gray)
+        time.sleep(0.01)
+    ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--capacity', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (HEIGHT, WIDTH, 3), dtype=np.uint8) for _ in range(8)]
+    frames = [frames[i % len(frames)] for i in range(args.frames)]
+
+    print(f"{args.frames} frames of {WIDTH}x{HEIGHT}, keeping the last {args.capacity}")
+    for name, make in (('list + pop(0)', list_history), ('FrameRing', ring_history)):
+        per_frame = measure(make, frames, args.capacity)
+        allocated = allocations(make, frames[0], args.capacity)
+        print(f"  {name:>14}: {per_frame * 1e6:7.0f} us/frame, {allocated / 1e6:5.1f} MB allocated per frame")
+
+    name = f'bench_ring_{os.getpid()}'
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    process = context.Process(target=writer, args=(name, args.capacity, 300, ready))
+    process.start()
+    ready.wait()
+    reader = FrameRing.attach(name)
+    out = np.empty((args.capacity, HEIGHT, WIDTH), np.uint8)
+    copies = torn = 0
+    start = time.perf_counter()
+    while process.is_alive():
+        got, stamps = reader.copy_last(out=out)
+        copies += 1
+        torn += sum(1 for frame in got if frame.min() != frame.max())
+    elapsed = time.perf_counter() - start
+    reader.close()
+    print(f"  other process: {copies / elapsed:.0f} copies/s of the last {args.capacity} frames, "
+          f"{torn} torn frames returned")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Heartbeat persistence benchmark
+Compares ESP32 heartbeat throughput with the old synchronous full-file
+json.dump on every heartbeat against the write-behind LightsPersister.
+
+Usage: python3 benchmarks/bench_heartbeat_persistence.py [--lights 300] [--heartbeats 3000]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import FlaskServer  # noqa: E402
+
+
+def legacy_save(path):
+    """The pre-write-behind save: truncate and rewrite the whole file in place"""
+    with open(path, 'w') as f:
+        json.dump(FlaskServer.light_store.all(), f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run(mode, light_ids, heartbeats, change_ratio):
+    client = FlaskServer.app.test_client()
+    persister = FlaskServer.light_store.persister
+    original_record = persister.record
+    writes = [0]
+
+    if mode == 'before':
+        def record(light_id, light):
+            pass
+        persister.record = record
+
+    rng = random.Random(42)
+    start = time.perf_counter()
+    flushes_before = persister.flushes
+    for _ in range(heartbeats):
+        light_id = rng.choice(light_ids)
+        state = FlaskServer.light_store.get(light_id)['state']
+        if rng.random() < change_ratio:
+            state = not state
+        client.post(f'/api/lights/{light_id}/heartbeat', json={'state': state})
+        if mode == 'before':
+            # The old handler saved on every heartbeat carrying a state
+            legacy_save(FlaskServer.LIGHTS_FILE)
+            writes[0] += 1
+    elapsed = time.perf_counter() - start
+
+    persister.record = original_record
+    persister.flush()
+    if mode == 'after':
+        writes[0] = persister.flushes - flushes_before
+    return heartbeats / elapsed, writes[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lights', type=int, default=300)
+    parser.add_argument('--heartbeats', type=int, default=3000)
+    parser.add_argument('--change-ratio', type=float, default=0.1,
+                        help='fraction of heartbeats that report a new state')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    FlaskServer.LIGHTS_BACKEND = 'json'
+    FlaskServer.LIGHTS_FILE = os.path.join(directory, 'lights_state.json')
+    FlaskServer.light_store = FlaskServer.load_lights()
+
+    client = FlaskServer.app.test_client()
+    light_ids = []
+    for i in range(args.lights):
+        light_id = f'bench_light_{i:04d}'
+        client.post('/api/lights/register', json={'id': light_id, 'name': f'Luz {i}', 'location': 'Bench'})
+        light_ids.append(light_id)
+    FlaskServer.light_store.flush()
+
+    print(f"{args.lights} lights, {args.heartbeats} heartbeats, {args.change_ratio:.0%} state changes")
+    print(f"{'mode':>8} {'heartbeats/s':>13} {'file writes':>12}")
+    for mode in ('before', 'after'):
+        rate, writes = run(mode, light_ids, args.heartbeats, args.change_ratio)
+        print(f"{mode:>8} {rate:13.0f} {writes:12d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Intent matching benchmark and regression check
+1. Runs every utterance of benchmarks/intent_corpus.json through the
+   assistant's intent registry and checks the chosen intent and slots.
+2. Measures per-call matching latency as the registry grows to hundreds of
+   intents (synthetic ones added on top of the real set), next to a linear
+   substring scan like the old if/elif chain. The corpus must still match
+   correctly at every size.
+
+Usage: python3 benchmarks/bench_intents.py [--sizes 0,100,300,1000] [--rounds 200]
+Exits with status 1 if an utterance is matched wrongly.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import FlaskServer  # noqa: E402
+from intents import IntentRegistry  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_corpus.json')
+
+
+def check(registry, corpus):
+    """Return the corpus entries the registry gets wrong"""
+    failures = []
+    for entry in corpus:
+        match = registry.match(entry['text'])
+        expected_slots = entry.get('slots', {})
+        if match.name != entry['intent'] or any(match.slots.get(k) != v for k, v in expected_slots.items()):
+            failures.append((entry, match))
+    return failures
+
+
+def grow(base, size, rng):
+    """A copy of the real registry with size synthetic intents of 1-3 keywords"""
+    registry = IntentRegistry()
+    for intent in base.intents.values():
+        registry.add(intent.name, intent.keywords, intent.handler, intent.priority, intent.slot)
+    for i in range(size):
+        keywords = [
+            ' '.join(f"zz{rng.randrange(10 ** 6)}" for _ in range(rng.randint(1, 3)))
+            for _ in range(rng.randint(1, 3))
+        ]
+        registry.add(f'synthetic_{i}', keywords, response='')
+    return registry
+
+
+def linear_scan(intents, text):
+    """The old approach: substring checks, one intent after the other"""
+    text_lower = text.lower()
+    for intent in intents:
+        for keyword in intent.keywords:
+            if keyword in text_lower:
+                return intent.name
+    return None
+
+
+def per_call(function, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            function(text)
+    return (time.perf_counter() - start) / (rounds * len(texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='0,100,300,1000', help='synthetic intents added to the real ones')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(CORPUS) as f:
+        corpus = json.load(f)
+    texts = [entry['text'] for entry in corpus]
+
+    failures = check(FlaskServer.intents, corpus)
+    print(f"Corpus: {len(corpus) - len(failures)}/{len(corpus)} utterances matched correctly")
+    for entry, match in failures:
+        print(f"  FAIL: {entry['text']!r} -> {match.name} {match.slots}, expected {entry['intent']} {entry.get('slots', {})}")
+
+    rng = random.Random(0)
+    print(f"\n{'intents':>8} {'keywords':>9} {'compile':>10} {'automaton':>12} {'linear scan':>12}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        registry = grow(FlaskServer.intents, size, rng)
+        start = time.perf_counter()
+        registry.compile()
+        compile_time = time.perf_counter() - start
+        failures += check(registry, corpus)
+
+        keywords = sum(len(intent.keywords) for intent in registry.intents.values())
+        automaton = per_call(registry.match, texts, args.rounds)
+        intents = list(registry.intents.values())
+        linear = per_call(lambda text: linear_scan(intents, text), texts, args.rounds)
+        print(f"{len(registry.intents):>8} {keywords:>9} {compile_time * 1000:>8.1f}ms "
+              f"{automaton * 1e6:>10.1f}us {linear * 1e6:>10.1f}us")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
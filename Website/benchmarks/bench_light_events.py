@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Light events fan-out benchmark
+Measures the latency from a toggle (POST /api/lights/<id>/toggle through the
+Flask test client) until every subscriber of the push bus has received the
+event, with 10 / 100 / 1000 idle subscribers.
+
+Usage: python3 benchmarks/bench_light_events.py [--rounds 50]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import FlaskServer  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(subscriber_count, rounds):
+    """Return (per-delivery latencies, time until the last subscriber got each event)"""
+    client = FlaskServer.app.test_client()
+    bus = FlaskServer.light_bus
+    received = []
+    delivered = {}
+    received_lock = threading.Lock()
+    sent_at = {}
+    ready = threading.Barrier(subscriber_count + 1)
+    subscriptions = [bus.subscribe() for _ in range(subscriber_count)]
+
+    def consumer(subscription):
+        ready.wait()
+        for _ in range(rounds):
+            event = subscription.get(timeout=10)
+            now = time.perf_counter()
+            if event is None:
+                return
+            with received_lock:
+                received.append((event['rev'], now))
+                delivered[event['rev']] = delivered.get(event['rev'], 0) + 1
+
+    threads = [threading.Thread(target=consumer, args=(s,), daemon=True) for s in subscriptions]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+
+    # Let every consumer park on its condition before measuring idle CPU
+    time.sleep(0.2)
+    cpu_start = time.process_time()
+    time.sleep(1.0)
+    idle_cpu = time.process_time() - cpu_start
+
+    for _ in range(rounds):
+        before = FlaskServer.light_store.revision
+        start = time.perf_counter()
+        client.post('/api/lights/living/toggle', json={})
+        sent_at[before + 1] = start
+        # Wait for the whole fan-out before the next toggle
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            with received_lock:
+                if delivered.get(before + 1, 0) >= subscriber_count:
+                    break
+            time.sleep(0.0005)
+
+    for thread in threads:
+        thread.join(timeout=10)
+    for subscription in subscriptions:
+        subscription.close()
+
+    latencies = [(now - sent_at[rev]) * 1000 for rev, now in received if rev in sent_at]
+    last_delivery = {}
+    for rev, now in received:
+        if rev in sent_at:
+            last_delivery[rev] = max(last_delivery.get(rev, 0), (now - sent_at[rev]) * 1000)
+    return latencies, list(last_delivery.values()), idle_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    # Keep the benchmark away from the real state file
+    FlaskServer.LIGHTS_BACKEND = 'json'
+    FlaskServer.LIGHTS_FILE = os.path.join(tempfile.mkdtemp(), 'lights_state.json')
+    FlaskServer.light_store = FlaskServer.load_lights()
+
+    print(f"{'subs':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'last p50':>9} {'idle cpu s':>11}")
+    for count in args.subscribers:
+        latencies, last, idle_cpu = run(count, args.rounds)
+        if not latencies:
+            print(f"{count:>6} no events received")
+            continue
+        print(f"{count:>6} {percentile(latencies, 50):8.2f} {percentile(latencies, 99):8.2f} "
+              f"{max(latencies):8.2f} {percentile(last, 50):9.2f} {idle_cpu:11.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Metrics overhead benchmark
+Measures what metrics.py costs on the hot paths:
+  - recording: a counter increment, a histogram observation and a stage
+    timer add, per call
+  - requests: GET /api/lights/<id> on the Flask server's test client with
+    the request timing hooks and without them
+  - detection: MotionDetector on synthetic 720p frames without a timer, with
+    a metrics stage timer, and with the sampling profiler running as well
+  - scraping: rendering /metrics
+
+Usage: python3 benchmarks/bench_metrics.py [--requests 2000] [--frames 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_motion_detector import make_frames  # noqa: E402
+from metrics import STAGE_BUCKETS, Registry, SamplingProfiler  # noqa: E402
+from motion_detection import MotionDetector  # noqa: E402
+
+
+def per_call(function, calls):
+    """Nanoseconds per call of function()"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return 1e9 * (time.perf_counter() - start) / calls
+
+
+def bench_recording(calls):
+    registry = Registry()
+    counter = registry.counter('bench_total', 'Counter', ('route',)).labels('/api/lights')
+    histogram = registry.histogram('bench_seconds', 'Histogram', ('route',)).labels('/api/lights')
+    timer = registry.histogram('bench_stage_seconds', 'Stages', ('camera', 'stage'), STAGE_BUCKETS).timer('camera')
+    print(f"Recording ({calls} calls each)")
+    print(f"  counter inc          {per_call(counter.inc, calls):6.0f} ns")
+    print(f"  histogram observe    {per_call(lambda: histogram.observe(0.0042), calls):6.0f} ns")
+    print(f"  stage timer add      {per_call(lambda: timer.add('blur', 0.0004), calls):6.0f} ns")
+
+
+def bench_requests(count, block=100):
+    import FlaskServer
+    app = FlaskServer.app
+    client = app.test_client()
+    hooks = ((app.before_request_funcs.setdefault(None, []), FlaskServer.start_request_timer),
+             (app.after_request_funcs.setdefault(None, []), FlaskServer.observe_request))
+
+    def set_timing(enabled):
+        for functions, function in hooks:
+            if function in functions:
+                functions.remove(function)
+            if enabled:
+                functions.append(function)
+
+    for _ in range(50):  # Warm up
+        client.get('/api/lights/living')
+    # Short blocks taken in turns, so background threads weigh on both alike
+    blocks = {False: [], True: []}
+    for _ in range(max(1, count // block)):
+        for enabled in (False, True):
+            set_timing(enabled)
+            start = time.perf_counter()
+            for _ in range(block):
+                client.get('/api/lights/living')
+            blocks[enabled].append(1e6 * (time.perf_counter() - start) / block)
+    set_timing(True)
+    print(f"Requests (GET /api/lights/<id> x {count} each, test client, median of blocks of {block})")
+    for enabled, label in ((False, 'without timing'), (True, 'with timing')):
+        print(f"  {label:<16} {statistics.median(blocks[enabled]):7.1f} us per request")
+
+    start = time.perf_counter()
+    text = FlaskServer.metrics.render()
+    print(f"Scraping: /metrics rendered in {1000 * (time.perf_counter() - start):.2f} ms "
+          f"({text.count(chr(10))} lines)")
+
+
+def bench_detection(frames):
+    registry = Registry()
+    stages = registry.histogram('motion_stage_seconds', 'Stages', ('camera', 'stage'), STAGE_BUCKETS)
+    images = make_frames(1280, 720, frames)
+    print(f"Detection ({frames} frames at 1280x720)")
+    baseline = None
+    for label, timer, profile in (('no timer', None, False), ('stage timer', stages.timer('camera'), False),
+                                  ('timer + profiler', stages.timer('camera'), True)):
+        profiler = SamplingProfiler().start() if profile else None
+        detector = MotionDetector(timer=timer)
+        start = time.perf_counter()
+        for image in images:
+            detector.detect(image)
+        elapsed = 1000 * (time.perf_counter() - start) / frames
+        if profiler is not None:
+            profiler.stop()
+        baseline = baseline or elapsed
+        print(f"  {label:<16} {elapsed:6.2f} ms per frame ({100 * (elapsed / baseline - 1):+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+    bench_recording(args.calls)
+    bench_detection(args.frames)
+    bench_requests(args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Motion detector benchmark
+Runs synthetic frames (a noisy background with a moving blob) through the
+detection code motion_detection.py used to run inline and through
+MotionDetector, at 720p and 1080p, and reports frames per second and the
+CPU used (process CPU time / wall time, so above 100% when OpenCV runs on
+several cores). Both paths must agree on which frames show motion.
+
+Usage: python3 benchmarks/bench_motion_detector.py [--frames 200] [--threads 0]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from motion_detection import MotionDetector  # noqa: E402
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080)}
+
+
+def make_frames(width, height, count, seed=0):
+    """Frames with sensor noise and a blob that moves for a while, then stops"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        noise = rng.integers(0, 12, (height, width, 1), dtype=np.uint8)
+        frame += noise
+        if (i // 20) % 2 == 0:  # Moving for 20 frames, still for 20
+            x = width // 8 + (i % 20) * width // 30
+            cv2.rectangle(frame, (x, height // 3), (x + width // 12, height // 3 + height // 5),
+                          (230, 230, 230), -1)
+        frames.append(frame)
+    return frames
+
+
+def legacy_detect(previous_frame, current_frame):
+    """The loop body motion_detection.py ran for each sampled frame"""
+    prev_blur = cv2.GaussianBlur(previous_frame, (21, 21), 0)
+    curr_blur = cv2.GaussianBlur(current_frame, (21, 21), 0)
+    diff = cv2.absdiff(prev_blur, curr_blur)
+    _, thresh = cv2.threshold(diff, 50, 255, cv2.THRESH_BINARY)
+    thresh = cv2.erode(thresh, np.ones((5, 5), np.uint8), iterations=2)
+    thresh = cv2.dilate(thresh, np.ones((7, 7), np.uint8), iterations=2)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    significant = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < 2000 or area > 50000:
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        aspect_ratio = float(w) / h if h > 0 else 0
+        if aspect_ratio < 0.3 or aspect_ratio > 3.0:
+            continue
+        perimeter = cv2.arcLength(contour, True)
+        if perimeter > 0 and 4 * np.pi * area / (perimeter * perimeter) < 0.1:
+            continue
+        significant.append(contour)
+
+    total_area = sum(cv2.contourArea(c) for c in significant)
+    if not (1 <= len(significant) <= 5) or total_area <= 3000:
+        return False
+    height, width = current_frame.shape
+    for contour in significant:
+        x, y, w, h = cv2.boundingRect(contour)
+        if x > 30 and y > 30 and x + w < width - 30 and y + h < height - 30:
+            return True
+    return False
+
+
+def run_legacy(frames):
+    decisions = [False]
+    previous = cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY)
+    for frame in frames[1:]:
+        current = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        decisions.append(legacy_detect(previous, current.copy()))
+        previous = current
+    return decisions
+
+
+def run_detector(frames, process_width):
+    detector = MotionDetector(process_width=process_width)
+    return [detector.detect(frame).motion for frame in frames]
+
+
+def measure(function, frames):
+    wall, cpu = time.perf_counter(), time.process_time()
+    decisions = function(frames)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return len(frames) / wall, 100 * cpu / wall, decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=0, help='OpenCV threads (0 = OpenCV default)')
+    args = parser.parse_args()
+    if args.threads:
+        cv2.setNumThreads(args.threads)
+
+    print(f"{'resolution':>10} {'mode':>22} {'fps':>8} {'cpu':>7} {'motion':>7} {'agree':>6}")
+    for name, (width, height) in RESOLUTIONS.items():
+        frames = make_frames(width, height, args.frames)
+        fps, cpu, reference = measure(run_legacy, frames)
+        print(f"{name:>10} {'legacy (inline)':>22} {fps:>8.1f} {cpu:>6.0f}% {sum(reference):>7}")
+        for mode, process_width in (('MotionDetector full', None), ('MotionDetector 640px', 640)):
+            fps, cpu, decisions = measure(lambda f: run_detector(f, process_width), frames)
+            agree = sum(a == b for a, b in zip(decisions, reference)) / len(frames)
+            print(f"{name:>10} {mode:>22} {fps:>8.1f} {cpu:>6.0f}% {sum(decisions):>7} {agree:>6.0%}")
+
+
+if __name__ == '__main__':
+    main()
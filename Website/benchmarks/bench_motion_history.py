@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Motion history benchmark
+Stores --events motion events from --cameras cameras spread over --days days
+in a MotionHistory (a temporary directory) and reports the ingest rate, the
+size on disk and the latency of the queries /api/motion/events makes:
+the newest page, the newest page of one camera, a random hour and a random
+day of one camera, and walking --pages pages with the cursor. A second run
+stores --thumbnails events with a 12 KB thumbnail each.
+
+Usage: python3 benchmarks/bench_motion_history.py [--events 1000000] [--days 30] [--cameras 4]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from motion_history import MotionHistory  # noqa: E402
+
+THUMBNAIL = b'\xff\xd8\xff\xe0' + bytes(12 * 1024)  # Stands in for a 320 px JPEG
+
+
+def ingest(history, count, days, cameras, thumbnail=None):
+    """Add count events, oldest first, and wait until they are on disk"""
+    start_time = time.time() - days * 86400
+    step = days * 86400 / count
+    names = [f'camera{i + 1}' for i in range(cameras)]
+    start = time.perf_counter()
+    for i in range(count):
+        camera = names[i % cameras]
+        history.add({
+            'id': history.last_id + 1,
+            'time': start_time + i * step,
+            'camera': camera,
+            'label': camera,
+            'boxes': [[100, 120, 80, 160]],
+            'area': 12800,
+        }, thumbnail)
+    history.flush()
+    return count / (time.perf_counter() - start)
+
+
+def timed(query, repeat):
+    """Latencies in milliseconds"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query()
+        latencies.append(1000 * (time.perf_counter() - start))
+    return latencies
+
+
+def walk(history, pages, camera=None):
+    cursor = None
+    for _ in range(pages):
+        events, cursor = history.query(camera=camera, cursor=cursor)
+        if cursor is None:
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--thumbnails', type=int, default=20000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='motion_history_')
+    try:
+        history = MotionHistory(root).start()
+        rate = ingest(history, args.events, args.days, args.cameras)
+        stats = history.stats()
+        print(f"{args.events} events, {args.cameras} cameras over {args.days} days")
+        print(f"  ingest: {rate:,.0f} events/s, {stats['bytes'] / 1e6:.0f} MB on disk "
+              f"({stats['bytes'] / args.events:.0f} bytes/event), {stats['partitions']} partitions")
+
+        now = time.time()
+        rng = random.Random(0)
+
+        def random_range(length):
+            start = now - args.days * 86400 + rng.random() * (args.days * 86400 - length)
+            return start, start + length
+
+        queries = {
+            'newest page': lambda: history.query(),
+            'newest page, 1 camera': lambda: history.query(camera='camera2'),
+            'random hour, 1 camera': lambda: history.query(*random_range(3600), camera='camera3'),
+            'random day, all': lambda: history.query(*random_range(86400)),
+            f'{args.pages} pages, 1 camera': lambda: walk(history, args.pages, 'camera1'),
+        }
+        print(f"  {'query':<24} {'p50':>8} {'p99':>8}")
+        for name, query in queries.items():
+            latencies = sorted(timed(query, args.repeat))
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f"  {name:<24} {statistics.median(latencies):>6.2f}ms {p99:>6.2f}ms")
+        history.close()
+        shutil.rmtree(root)
+
+        os.makedirs(root)
+        history = MotionHistory(root).start()
+        rate = ingest(history, args.thumbnails, 1, args.cameras, THUMBNAIL)
+        stats = history.stats()
+        print(f"{args.thumbnails} events with a {len(THUMBNAIL) // 1024} KB thumbnail each")
+        print(f"  ingest: {rate:,.0f} events/s, {stats['bytes'] / 1e6:.0f} MB on disk, "
+              f"{stats['flush_ms']} ms per flush")
+        history.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Motion supervisor scaling benchmark
+Runs MotionSupervisor on 1, 2, 4 and 8 cameras, each playing a local H.264
+clip in real time (so decoding costs what a live stream would), and reports
+the CPU used by the supervisor and its detection workers, memory (RSS of
+the whole process tree), frames analyzed and grab-to-result latency.
+
+Usage: python3 benchmarks/bench_motion_supervisor.py [--streams 1,2,4,8] [--seconds 20] [--size 1280x720]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import motion_supervisor  # noqa: E402
+from voice_pipeline import ffmpeg_binary  # noqa: E402
+
+TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def make_clip(path, size, rate, seconds=10):
+    """A test pattern clip with a moving box, encoded like a camera stream"""
+    subprocess.run(
+        [ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}:duration={seconds}',
+         '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(rate), path],
+        check=True
+    )
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / TICKS  # utime + stime
+
+
+def rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run(clip, streams, seconds, workers, rate):
+    cameras = [{'name': f'cam{i}', 'url': clip, 'pace': rate, 'alert_file': os.devnull}
+               for i in range(streams)]
+    motion_supervisor.ALERT_FILE = os.devnull
+    supervisor = motion_supervisor.MotionSupervisor(cameras, workers, events_url=None, clips_dir=None, metrics_name=None).start()
+    time.sleep(3)  # Workers import OpenCV, grabbers connect
+    pids = [os.getpid()] + supervisor.pool.pids
+    before = {pid: cpu_seconds(pid) for pid in pids}
+    analyzed = {name: camera.analyzed for name, camera in supervisor.cameras.items()}
+    start = time.monotonic()
+    time.sleep(seconds)
+    elapsed = time.monotonic() - start
+    cpu = sum(cpu_seconds(pid) - before[pid] for pid in pids)
+    memory = sum(rss_mb(pid) for pid in pids)
+    stats = supervisor.stats()['cameras']
+    done = sum(camera.analyzed - analyzed[name] for name, camera in supervisor.cameras.items())
+    latency = max(s['stream']['latency'] for s in stats.values())
+    decode = sum(s['stream']['decode_fps'] for s in stats.values())
+    busy = sum(s['busy_skips'] for s in stats.values())
+    supervisor.stop()
+    return {
+        'cpu': 100 * cpu / elapsed, 'memory': memory, 'analyzed': done / elapsed,
+        'decode': decode, 'latency': latency, 'busy': busy, 'workers': supervisor.pool.size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', default='1,2,4,8')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--rate', type=int, default=25)
+    parser.add_argument('--workers', type=int, help='detection processes (default: CPU count)')
+    args = parser.parse_args()
+
+    clip = os.path.join(tempfile.mkdtemp(), 'camera.mp4')
+    make_clip(clip, args.size, args.rate)
+    print(f"{args.size} clips at {args.rate} fps, one analysis per camera per second, {os.cpu_count()} CPUs")
+    print(f"{'streams':>7} {'workers':>7} {'cpu':>6} {'cpu/stream':>10} {'rss':>8} "
+          f"{'decode fps':>10} {'analyzed/s':>10} {'latency':>8} {'busy':>5}")
+    for streams in (int(n) for n in args.streams.split(',')):
+        with contextlib.redirect_stdout(io.StringIO()):  # Motion alerts from the test pattern
+            r = run(clip, streams, args.seconds, args.workers, args.rate)
+        print(f"{streams:>7} {r['workers']:>7} {r['cpu']:>5.0f}% {r['cpu'] / streams:>9.1f}% "
+              f"{r['memory']:>6.0f}MB {r['decode']:>10.1f} {r['analyzed']:>10.2f} "
+              f"{r['latency'] * 1000:>6.0f}ms {r['busy']:>5}")
+
+
+if __name__ == '__main__':
+    main()
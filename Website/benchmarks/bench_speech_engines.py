@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Speech engine latency benchmark
+Transcribes recorded fixtures with every available engine (Google needs
+internet, Vosk needs `pip install vosk` and a model) and reports end-to-end
+latency: decode + transcription, the way /api/process_voice runs them.
+Model loading is timed separately since the server does it once at startup.
+
+Without --fixtures a tone is generated, which is enough to
+compare latency but not accuracy.
+
+Usage: python3 benchmarks/bench_speech_engines.py [--fixtures recordings/] [--vosk-model path] [--runs 5]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import speech_recognition as sr  # noqa: E402
+
+from speech_engines import GoogleEngine, VoskEngine  # noqa: E402
+from voice_pipeline import decode_stream, ffmpeg_binary, iter_stream, pcm_duration  # noqa: E402
+
+AUDIO_EXTENSIONS = ('.webm', '.ogg', '.wav', '.mp3', '.m4a', '.flac')
+
+
+def load_fixtures(directory):
+    fixtures = {}
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    fixtures[name] = f.read()
+    else:
+        tone = subprocess.run(
+            [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', 'sine=frequency=440:duration=3',
+             '-c:a', 'libopus', '-f', 'webm', 'pipe:1'],
+            stdout=subprocess.PIPE, check=True
+        ).stdout
+        fixtures['tone.webm'] = tone
+    return fixtures
+
+
+def run(engine, data):
+    start = time.perf_counter()
+    pcm = decode_stream(iter_stream(io.BytesIO(data)))
+    try:
+        transcript = engine.transcribe(pcm)
+    except sr.UnknownValueError:
+        transcript = '(not understood)'
+    except sr.RequestError as e:
+        transcript = f'(error: {e})'
+    return time.perf_counter() - start, transcript, pcm_duration(pcm)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', help='directory of recorded utterances')
+    parser.add_argument('--vosk-model', default='/home/tomas/vosk-model-small-es-0.42')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    engines = [GoogleEngine(), VoskEngine(args.vosk_model)]
+    for engine in engines:
+        start = time.perf_counter()
+        engine.load()
+        if engine.available:
+            print(f"{engine.name}: loaded in {(time.perf_counter() - start) * 1000:.0f} ms")
+        else:
+            print(f"{engine.name}: unavailable ({engine.error})")
+
+    fixtures = load_fixtures(args.fixtures)
+    for name, data in fixtures.items():
+        print(f"\n{name}")
+        for engine in engines:
+            if not engine.available:
+                continue
+            results = [run(engine, data) for _ in range(args.runs)]
+            latencies = sorted(result[0] for result in results)
+            duration = results[0][2]
+            p50 = statistics.median(latencies)
+            print(f"  {engine.name:>6}: p50 {p50 * 1000:7.1f} ms, max {latencies[-1] * 1000:7.1f} ms, "
+                  f"real-time factor {p50 / duration:.2f} | {results[0][1]}")
+
+
+if __name__ == '__main__':
+    main()
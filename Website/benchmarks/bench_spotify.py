@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Spotify command latency benchmark
+Starts a local fake Spotify Web API (search, devices, play, pause) that
+answers after --latency seconds, like the real one over the internet, and
+plays a workload of "reproduce ..." commands through:
+  - the old path: search + devices + start_playback on every command
+  - SpotifyService: cached search results and device list
+Then takes the fake API down (slow 503s) and measures how long each command
+takes to fail with and without the circuit breaker.
+
+Usage: python3 benchmarks/bench_spotify.py [--latency 0.1] [--commands 50] [--songs 10]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import spotipy  # noqa: E402
+
+from spotify_service import SpotifyService, SpotifyUnavailable  # noqa: E402
+
+
+class FakeSpotify(BaseHTTPRequestHandler):
+    latency = 0.1
+    down = False
+    requests = 0
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like api.spotify.com
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        FakeSpotify.requests += 1
+        time.sleep(self.latency)
+        if self.down:
+            status, body = 503, {'error': {'status': 503, 'message': 'Service unavailable'}}
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/v1/search':
+            query = parse_qs(url.query)['q'][0]
+            self._reply(200, {'tracks': {'items': [{
+                'uri': f'spotify:track:{abs(hash(query))}',
+                'name': query.title(),
+                'artists': [{'name': 'Artista'}],
+            }]}})
+        elif url.path == '/v1/me/player/devices':
+            self._reply(200, {'devices': [{'id': 'living-room', 'is_active': True, 'name': 'Living'}]})
+        else:
+            self._reply(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.path.startswith('/v1/me/player/'):
+            self._reply(204)
+        else:
+            self._reply(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+
+def fake_client(prefix, session=True, **options):
+    client = spotipy.Spotify(auth='fake-token', requests_session=session, **options)
+    client.prefix = prefix
+    return client
+
+
+def legacy_play(client, query):
+    """play_spotify_song before SpotifyService"""
+    results = client.search(q=query, limit=1, type='track')
+    track_uri = results['tracks']['items'][0]['uri']
+    devices = client.devices()
+    client.start_playback(device_id=devices['devices'][0]['id'], uris=[track_uri])
+
+
+def timed(function, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        try:
+            function(query)
+        except Exception:
+            pass
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies, requests):
+    print(f"  {name:>16}: p50 {statistics.median(latencies) * 1000:7.1f} ms, "
+          f"mean {statistics.mean(latencies) * 1000:7.1f} ms, {requests} API requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds the fake API takes per request')
+    parser.add_argument('--commands', type=int, default=50)
+    parser.add_argument('--songs', type=int, default=10, help='distinct songs requested')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)  # spotipy logs every 503 and retry
+
+    FakeSpotify.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSpotify)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    prefix = f'http://127.0.0.1:{server.server_port}/v1/'
+
+    rng = random.Random(0)
+    songs = [f'cancion numero {i}' for i in range(args.songs)]
+    queries = [rng.choice(songs) for _ in range(args.commands)]
+
+    legacy = fake_client(prefix)
+    service = SpotifyService(lambda session: fake_client(prefix, session, retries=0, status_retries=0))
+
+    print(f"{args.commands} commands over {args.songs} songs, API latency {args.latency * 1000:.0f} ms")
+    FakeSpotify.requests = 0
+    report('old path', timed(lambda q: legacy_play(legacy, q), queries), FakeSpotify.requests)
+    FakeSpotify.requests = 0
+    report('SpotifyService', timed(service.play, queries), FakeSpotify.requests)
+    print(f"  search cache: {service.search_hits} hits, {service.search_misses} misses")
+
+    print("\nSpotify down (503 after the API latency), 10 commands for new songs")
+    FakeSpotify.down = True
+    down_queries = [f'otra cancion {i}' for i in range(10)]
+    FakeSpotify.requests = 0
+    report('old path', timed(lambda q: legacy_play(legacy, q), down_queries), FakeSpotify.requests)
+    FakeSpotify.requests = 0
+    failures = timed(service.play, down_queries)
+    report('SpotifyService', failures, FakeSpotify.requests)
+    print(f"  circuit: {service.breaker.state}")
+    try:
+        service.play('una mas')
+    except SpotifyUnavailable as e:
+        print(f"  next command fails fast: {e}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
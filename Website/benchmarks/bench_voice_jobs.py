@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Voice job throughput benchmark
+Sends N concurrent uploads to /api/process_voice and reports throughput,
+latency percentiles and how many uploads were turned away with a 503.
+Decoding runs the real ffmpeg pipe; recognition and speech synthesis are
+replaced by stand-ins that sleep for a typical network round trip
+(--recognize-latency, --tts-latency), so the numbers do not depend on
+Google being reachable.
+
+Usage: python3 benchmarks/bench_voice_jobs.py [--concurrency 1,4,16,64] [--fixture recording.webm]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import FlaskServer  # noqa: E402
+from audio_store import AudioStore  # noqa: E402
+from speech_engines import SpeechEngine  # noqa: E402
+from tts_cache import TTSCache  # noqa: E402
+from voice_pipeline import ffmpeg_binary  # noqa: E402
+
+
+class SleepingEngine(SpeechEngine):
+    """Answers after a fixed delay, like a remote recognizer would"""
+
+    name = 'bench'
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def transcribe(self, pcm, sample_rate=16000, language='es-ES'):
+        self.calls += 1
+        time.sleep(self.latency)
+        return f"prueba {self.calls % 50}"
+
+
+def make_fixture(seconds=3):
+    return subprocess.run(
+        [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+         '-c:a', 'libopus', '-f', 'webm', 'pipe:1'],
+        stdout=subprocess.PIPE, check=True
+    ).stdout
+
+
+def upload(data, results, lock):
+    client = FlaskServer.app.test_client()
+    start = time.perf_counter()
+    response = client.post(
+        '/api/process_voice?engine=bench',
+        data={'audio': (io.BytesIO(data), 'recording.webm')}
+    )
+    elapsed = time.perf_counter() - start
+    with lock:
+        results.append((response.status_code, elapsed))
+
+
+def run(data, concurrency):
+    results, lock = [], threading.Lock()
+    threads = [threading.Thread(target=upload, args=(data, results, lock)) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,16,64')
+    parser.add_argument('--fixture', help='recorded audio file to upload instead of a generated tone')
+    parser.add_argument('--recognize-latency', type=float, default=0.8)
+    parser.add_argument('--tts-latency', type=float, default=0.3)
+    args = parser.parse_args()
+
+    if args.fixture:
+        with open(args.fixture, 'rb') as f:
+            data = f.read()
+    else:
+        data = make_fixture()
+
+    FlaskServer.speech_recognizer.engines['bench'] = SleepingEngine(args.recognize_latency)
+    FlaskServer.speech_recognizer.calibration.ttl = 0  # Every upload is its own device
+
+    def synthesize(text, lang):
+        time.sleep(args.tts_latency)
+        return text.encode('utf-8')
+    FlaskServer.tts_cache = TTSCache(AudioStore(tempfile.mkdtemp()), synthesize=synthesize)
+
+    stages = FlaskServer.voice_jobs.stats()['stages']
+    print("Stages: " + ', '.join(f"{name} {s['workers']} workers/{s['capacity']} queued" for name, s in stages.items()))
+    print(f"{'uploads':>8} {'ok':>5} {'503':>5} {'jobs/s':>8} {'p50':>8} {'p95':>8}")
+    for concurrency in (int(n) for n in args.concurrency.split(',')):
+        results, elapsed = run(data, concurrency)
+        ok = sorted(seconds for status, seconds in results if status == 200)
+        rejected = sum(1 for status, _ in results if status == 503)
+        p50 = statistics.median(ok) if ok else 0
+        p95 = ok[int(len(ok) * 0.95) - 1] if ok else 0
+        print(f"{concurrency:>8} {len(ok):>5} {rejected:>5} {len(ok) / elapsed:>8.1f} {p50:>7.2f}s {p95:>7.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Voice pipeline latency benchmark
+Breaks down per-stage time of the old temp-file pipeline (save upload, pydub
+decode, WAV export, sr.AudioFile re-read) against the in-memory ffmpeg pipe
+(decode while uploading, WAV in a BytesIO).
+
+Recognition itself is skipped unless --recognize is given (it needs network
+access to Google). Without --fixture a 5 s Opus/WebM tone is generated with
+ffmpeg.
+
+Usage: python3 benchmarks/bench_voice_pipeline.py [--fixture recording.webm] [--runs 10]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import speech_recognition as sr  # noqa: E402
+from pydub import AudioSegment  # noqa: E402
+
+from voice_pipeline import StageTimer, decode_stream, ffmpeg_binary, iter_stream, pcm_to_wav  # noqa: E402
+
+
+def make_fixture(seconds=5):
+    """Encode a tone the way a browser MediaRecorder would (Opus in WebM)"""
+    result = subprocess.run(
+        [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error',
+         '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+         '-c:a', 'libopus', '-f', 'webm', 'pipe:1'],
+        stdout=subprocess.PIPE, check=True
+    )
+    return result.stdout
+
+
+def recognize(source_file, timer, with_google):
+    recognizer = sr.Recognizer()
+    with timer.stage('load'):
+        with sr.AudioFile(source_file) as source:
+            recognizer.adjust_for_ambient_noise(source, duration=0.5)
+            audio_data = recognizer.record(source)
+    if with_google:
+        with timer.stage('recognize'):
+            try:
+                recognizer.recognize_google(audio_data, language="es-ES")
+            except (sr.UnknownValueError, sr.RequestError):
+                pass
+
+
+def run_legacy(data, directory, with_google):
+    """The old process_voice: three disk round trips"""
+    timer = StageTimer()
+    original = os.path.join(directory, 'audio_original.webm')
+    wav_path = os.path.join(directory, 'audio.wav')
+    with timer.stage('save'):
+        with open(original, 'wb') as f:
+            f.write(data)
+    with timer.stage('decode'):
+        audio = AudioSegment.from_file(original)
+        audio = audio.set_frame_rate(16000).set_channels(1)
+    with timer.stage('export'):
+        audio.export(wav_path, format='wav')
+    recognize(wav_path, timer, with_google)
+    os.remove(original)
+    os.remove(wav_path)
+    return timer.timings
+
+
+def run_streaming(data, with_google):
+    """The in-memory pipe used by process_voice now"""
+    timer = StageTimer()
+    pcm = decode_stream(iter_stream(io.BytesIO(data)), timer)
+    with timer.stage('export'):
+        wav = pcm_to_wav(pcm)
+    recognize(wav, timer, with_google)
+    return timer.timings
+
+
+def report(name, runs):
+    stages = []
+    for timings in runs:
+        for stage in timings:
+            if stage not in stages:
+                stages.append(stage)
+    totals = [sum(timings.values()) - timings.get('upload', 0) for timings in runs]
+    parts = ', '.join(
+        f"{stage} {statistics.median(t.get(stage, 0) for t in runs) * 1000:.1f}"
+        for stage in stages
+    )
+    print(f"{name:>10}: total {statistics.median(totals) * 1000:7.1f} ms | {parts} (median ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixture', help='recorded audio file to use instead of a generated tone')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--recognize', action='store_true', help='include the Google recognition round trip')
+    args = parser.parse_args()
+
+    if args.fixture:
+        with open(args.fixture, 'rb') as f:
+            data = f.read()
+    else:
+        data = make_fixture()
+    print(f"Fixture: {len(data)} bytes, {args.runs} runs")
+
+    directory = tempfile.mkdtemp()
+    try:
+        legacy = [run_legacy(data, directory, args.recognize) for _ in range(args.runs)]
+        report('temp files', legacy)
+    except Exception as e:
+        # pydub needs ffprobe next to ffmpeg to read webm from a file
+        print(f"temp files: skipped ({e})")
+    streaming = [run_streaming(data, args.recognize) for _ in range(args.runs)]
+    report('in-memory', streaming)
+    print("(in-memory 'decode' overlaps 'upload'; the total excludes upload)")
+
+
+if __name__ == '__main__':
+    main()
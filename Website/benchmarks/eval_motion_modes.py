@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Motion detection mode evaluation
+Replays clips through every detection mode ('diff', 'average', 'mog2',
+'knn'), analyzing one frame per --interval seconds like the live detector,
+and reports precision and recall of the motion decisions and the frames per
+second each mode analyzes (detection time only, decoding excluded).
+
+Without --clip the synthetic scenes of benchmarks/motion_scenes.py are used.
+A recorded clip needs its ground truth in <clip>.json (or --labels):
+
+    {"motion": [[12.0, 19.5], [33.0, 41.0]]}   # Seconds with real movement
+
+Usage: python3 benchmarks/eval_motion_modes.py [--modes diff,average,mog2,knn] [--seconds 60]
+       python3 benchmarks/eval_motion_modes.py --clip garden.mp4 --clip door.mp4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from motion_detection import create_detector  # noqa: E402
+from motion_scenes import SCENES, scene_frames  # noqa: E402
+
+MODES = ('diff', 'average', 'mog2', 'knn')
+
+
+def clip_frames(path, interval, labels=None):
+    """(time, frame, moving) for one frame per interval of a video file"""
+    if labels is None:
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            labels = json.load(f)['motion']
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    step = max(1, round(fps * interval))
+    index = 0
+    try:
+        while True:
+            if index % step:
+                if not cap.grab():
+                    return
+                index += 1
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                return
+            t = index / fps
+            yield t, frame, any(start <= t < end for start, end in labels)
+            index += 1
+    finally:
+        cap.release()
+
+
+class Score:
+    def __init__(self):
+        self.tp = self.fp = self.fn = self.tn = 0
+        self.seconds = 0.0
+        self.frames = 0
+        self.reasons = {}
+
+    def add(self, detected, moving, seconds, reason):
+        self.frames += 1
+        self.seconds += seconds
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if detected and moving:
+            self.tp += 1
+        elif detected:
+            self.fp += 1
+        elif moving:
+            self.fn += 1
+        else:
+            self.tn += 1
+
+    def merge(self, other):
+        for field in ('tp', 'fp', 'fn', 'tn', 'seconds', 'frames'):
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    @property
+    def precision(self):
+        return self.tp / (self.tp + self.fp) if self.tp + self.fp else None
+
+    @property
+    def recall(self):
+        return self.tp / (self.tp + self.fn) if self.tp + self.fn else None
+
+    @property
+    def fps(self):
+        return self.frames / self.seconds if self.seconds else 0.0
+
+
+def evaluate(mode, frames):
+    detector = create_detector(mode)
+    score = Score()
+    for _, frame, moving in frames:
+        start = time.perf_counter()
+        result = detector.detect(frame)
+        score.add(result.motion, moving, time.perf_counter() - start, result.reason)
+    return score
+
+
+def percent(value):
+    return f"{100 * value:5.1f}%" if value is not None else "    -"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--clip', action='append', default=[], help='recorded clip (repeatable)')
+    parser.add_argument('--labels', help='JSON ground truth for a single --clip')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between analyzed frames')
+    parser.add_argument('--scenes', default=','.join(SCENES))
+    parser.add_argument('--seconds', type=float, default=60, help='length of each synthetic scene')
+    parser.add_argument('--size', default='1280x720')
+    args = parser.parse_args()
+    cv2.setNumThreads(1)  # Like a detection worker
+
+    if args.clip:
+        labels = None
+        if args.labels:
+            with open(args.labels) as f:
+                labels = json.load(f)['motion']
+        sources = {os.path.basename(path): (lambda path=path: clip_frames(path, args.interval, labels))
+                   for path in args.clip}
+    else:
+        width, height = (int(v) for v in args.size.split('x'))
+        sources = {
+            scene: (lambda scene=scene: scene_frames(scene, width, height, args.seconds, 1 / args.interval))
+            for scene in args.scenes.split(',')
+        }
+
+    modes = args.modes.split(',')
+    totals = {mode: Score() for mode in modes}
+    print(f"{'source':<14} {'mode':<8} {'frames':>6} {'moving':>6} {'hits':>5} "
+          f"{'false':>5} {'missed':>6} {'fps':>7}  reasons")
+    for name, load in sources.items():
+        for mode in modes:
+            score = evaluate(mode, load())
+            totals[mode].merge(score)
+            reasons = ', '.join(f"{reason} {count}" for reason, count in sorted(score.reasons.items()))
+            print(f"{name:<14} {mode:<8} {score.frames:>6} {score.tp + score.fn:>6} {score.tp:>5} "
+                  f"{score.fp:>5} {score.fn:>6} {score.fps:>7.0f}  {reasons}")
+
+    print(f"\n{'mode':<8} {'precision':>9} {'recall':>7} {'fps':>7}")
+    for mode, score in totals.items():
+        print(f"{mode:<8} {percent(score.precision):>9} {percent(score.recall):>7} {score.fps:>7.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Motion scenes
+Synthetic camera footage with known ground truth, for evaluating and
+benchmarking the motion detector without recordings. Every scene is a
+textured room with sensor noise; scene_frames() yields (time, frame, moving)
+where moving says whether something really moved at that time.
+
+  quiet   nothing happens
+  walk    a person crosses the room, pauses out of view, crosses back
+  slow    something creeps across the room a few pixels per second
+  lights  the daylight fades, then a lamp is switched on and off
+  shake   the camera shakes in the wind now and then
+"""
+
+import cv2
+import numpy as np
+
+SCENES = ('quiet', 'walk', 'slow', 'lights', 'shake')
+NOISE = 4.0  # Standard deviation of the sensor noise
+NOISE_FRAMES = 8  # Noise patterns cycled through
+
+
+def _room(width, height, rng):
+    """A still picture with texture at several scales"""
+    small = rng.integers(50, 200, (max(2, height // 40), max(2, width // 40), 3), dtype=np.uint8)
+    room = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(12):  # Furniture
+        x, y = int(rng.integers(0, width)), int(rng.integers(height // 3, height))
+        w, h = int(rng.integers(width // 20, width // 6)), int(rng.integers(height // 20, height // 4))
+        color = tuple(int(c) for c in rng.integers(30, 220, 3))
+        cv2.rectangle(room, (x, y), (x + w, y + h), color, -1)
+    fine = rng.normal(0, 6, (height, width, 1))
+    return np.clip(room + fine, 0, 255).astype(np.uint8)
+
+
+def _person(room, cx, cy, scale, shade):
+    """A person-sized figure centered on (cx, cy)"""
+    w, h = int(45 * scale), int(160 * scale)
+    x, y = int(cx - w / 2), int(cy - h / 2)
+    cv2.rectangle(room, (x, y + h // 5), (x + w, y + h), shade, -1)
+    cv2.circle(room, (int(cx), y + h // 10), h // 10, tuple(min(255, c + 60) for c in shade), -1)
+
+
+def scene_frames(name, width=1280, height=720, seconds=60, rate=1.0, seed=0):
+    """Frames of a scene at `rate` frames per second: (time, BGR frame, moving)"""
+    if name not in SCENES:
+        raise ValueError(f"Unknown scene {name!r}, expected one of {SCENES}")
+    rng = np.random.default_rng(seed)
+    room = _room(width, height, rng)
+    noise = [rng.normal(0, NOISE, (height, width, 1)).astype(np.float32) for _ in range(NOISE_FRAMES)]
+    scale = height / 720
+    vignette = None
+    if name == 'lights':
+        yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+        lamp_x, lamp_y = width * 0.3, height * 0.4
+        vignette = np.exp(-((xx - lamp_x) ** 2 + (yy - lamp_y) ** 2) / (2 * (width / 3) ** 2))[..., None]
+
+    count = int(seconds * rate)
+    for i in range(count):
+        t = i / rate
+        frame = room.astype(np.float32)
+        moving = False
+
+        if name == 'walk':
+            # Right across in 10 s from t=10, back from t=35
+            speed = (width + 100 * scale) / 10
+            for start, direction in ((10, 1), (35, -1)):
+                if start <= t < start + 10:
+                    travelled = (t - start) * speed
+                    cx = -50 * scale + travelled if direction > 0 else width + 50 * scale - travelled
+                    person = room.copy()
+                    _person(person, cx, height * 0.6, 1.6 * scale, (70, 60, 50))
+                    frame = person.astype(np.float32)
+                    # Counts once the figure is clear of the picture edges
+                    moving = 110 * scale < cx < width - 110 * scale
+        elif name == 'slow':
+            # 6 px/s at 720p from t=5 to t=55
+            if 5 <= t < 55:
+                person = room.copy()
+                _person(person, width * 0.25 + (t - 5) * 6 * scale, height * 0.6, 1.4 * scale, (150, 120, 90))
+                frame = person.astype(np.float32)
+                moving = t >= 8  # Moved far enough to be visible from t=8
+            elif t >= 55:
+                person = room.copy()
+                _person(person, width * 0.25 + 50 * 6 * scale, height * 0.6, 1.4 * scale, (150, 120, 90))
+                frame = person.astype(np.float32)
+        elif name == 'lights':
+            gain = 1.0 - 0.4 * min(t, 30) / 30  # Dusk over 30 s
+            frame *= gain
+            if 40 <= t < 50:
+                frame += 70 * vignette  # Lamp on
+        elif name == 'shake':
+            if 10 <= t < 20 or 40 <= t < 45:
+                dx, dy = (int(v) for v in rng.integers(-6, 7, 2))
+                matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+                frame = cv2.warpAffine(frame, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+
+        frame += noise[i % NOISE_FRAMES]
+        yield t, np.clip(frame, 0, 255).astype(np.uint8), moving
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Motion detection replay
+Feeds local video files or synthetic scenes (benchmarks/motion_scenes.py:
+a person walking, slow creeping, lighting changes, camera shake) through
+the same detector motion_detection.py runs, one frame per --interval like
+the live loop (or --every-frame), as fast as possible or paced in real time
+(--realtime). Writes a JSON report per source: time per stage (decode, gray,
+blur, diff, morphology, contours), frames per second, the memory high-water
+mark and every decision with its boxes, so a false positive can be found
+again at the same second (use --start/--seconds and --save to look at it).
+
+With --baseline an earlier report is compared with this one: the run fails
+(exit code 1) when a source got more than --tolerance slower or when its
+decisions changed.
+
+Usage: python3 benchmarks/replay_motion.py [--scene walk] [--clip cam.mp4] [--mode average]
+           [--realtime] [--output report.json] [--baseline previous.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from motion_detection import CAPTURE_INTERVAL, DETECTION_MODE, PROCESS_WIDTH, create_detector  # noqa: E402
+from motion_scenes import SCENES, scene_frames  # noqa: E402
+
+STAGES = ('decode', 'gray', 'blur', 'diff', 'morphology', 'contours')
+
+
+class StageSamples:
+    """Per-frame stage durations, fed by the detector's timer hook"""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self._frame = {}
+
+    def add(self, stage, seconds):
+        self._frame[stage] = self._frame.get(stage, 0.0) + seconds
+
+    def end_frame(self):
+        for stage, seconds in self._frame.items():
+            self.samples.setdefault(stage, []).append(seconds)
+        self._frame = {}
+
+    def summary(self):
+        summary = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            values = np.array(values) * 1000
+            summary[stage] = {
+                'total_ms': round(float(values.sum()), 2),
+                'mean_ms': round(float(values.mean()), 3),
+                'p50_ms': round(float(np.percentile(values, 50)), 3),
+                'p95_ms': round(float(np.percentile(values, 95)), 3),
+                'max_ms': round(float(values.max()), 3),
+            }
+        return summary
+
+
+def clip_source(path, interval, start=0.0, seconds=None, timer=None):
+    """(time, frame) for the analyzed frames of a video file, decoding time charged to timer"""
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+    if not cap.isOpened():
+        raise OSError(f"Could not open {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    step = max(1, round(fps * interval)) if interval else 1
+    if start:
+        cap.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+    index = 0
+    try:
+        while True:
+            begin = time.perf_counter()
+            while index % step:  # Frames the live loop would not analyze are still decoded
+                if not cap.grab():
+                    return
+                index += 1
+            ok, frame = cap.read()
+            timer.add('decode', time.perf_counter() - begin)
+            t = start + index / fps
+            if not ok or (seconds is not None and t >= start + seconds):
+                return
+            yield t, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def scene_source(name, size, interval, start=0.0, seconds=60, timer=None):
+    """(time, frame) of a synthetic scene, generation time charged to timer as decode"""
+    width, height = size
+    frames = scene_frames(name, width, height, start + seconds, 1 / interval)
+    while True:
+        begin = time.perf_counter()
+        item = next(frames, None)
+        if item is None:
+            return
+        t, frame, moving = item
+        if t >= start:
+            timer.add('decode', time.perf_counter() - begin)
+            yield t, frame, moving
+
+
+def replay(name, source, args):
+    """Run one source through a fresh detector; returns its report"""
+    timer = StageSamples()
+    detector = create_detector(args.mode, process_width=args.process_width or None, timer=timer)
+    decisions = []
+    reasons = {}
+    detect_seconds = 0.0
+    first_time = None
+    wall_start = time.perf_counter()
+    for item in source(timer):
+        t, frame = item[0], item[1]
+        moving = item[2] if len(item) > 2 else None
+        if args.realtime:
+            if first_time is None:
+                first_time = t
+            delay = wall_start + (t - first_time) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        begin = time.perf_counter()
+        result = detector.detect(frame)
+        detect_seconds += time.perf_counter() - begin
+        timer.end_frame()
+        reasons[result.reason] = reasons.get(result.reason, 0) + 1
+        decision = dict(result.to_dict(), time=round(t, 3))
+        if moving is not None:
+            decision['truth'] = moving
+        decisions.append(decision)
+        if result.motion and args.save:
+            save_frame(args.save, name, t, frame, result)
+    wall = time.perf_counter() - wall_start
+
+    report = {
+        'source': name,
+        'mode': args.mode,
+        'process_width': args.process_width or None,
+        'interval': args.interval,
+        'realtime': args.realtime,
+        'analyzed': len(decisions),
+        'wall_seconds': round(wall, 3),
+        'fps': round(len(decisions) / detect_seconds, 1) if detect_seconds else None,
+        'wall_fps': round(len(decisions) / wall, 1) if wall else None,
+        'stages': timer.summary(),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'motion': sum(1 for d in decisions if d['motion']),
+        'reasons': reasons,
+    }
+    if decisions and 'truth' in decisions[0]:
+        report['truth'] = {
+            'hits': sum(1 for d in decisions if d['motion'] and d['truth']),
+            'false': sum(1 for d in decisions if d['motion'] and not d['truth']),
+            'missed': sum(1 for d in decisions if not d['motion'] and d['truth']),
+        }
+    report['decisions'] = decisions
+    return report
+
+
+def save_frame(directory, name, t, frame, result):
+    """The frame with its boxes, to look at a decision"""
+    os.makedirs(directory, exist_ok=True)
+    frame = frame.copy() if frame.ndim == 3 else cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    for x, y, w, h in result.objects:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+    for x, y, w, h in result.edge_objects:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 200, 255), 1)
+    cv2.imwrite(os.path.join(directory, f"{os.path.basename(name)}_{t:09.3f}.jpg"), frame)
+
+
+def compare(baseline, runs, tolerance):
+    """Print how the runs differ from a baseline report; returns True when one regressed"""
+    previous = {run['source']: run for run in baseline['runs']}
+    regressed = False
+    for run in runs:
+        old = previous.get(run['source'])
+        if old is None or not old.get('fps') or not run.get('fps'):
+            continue
+        change = run['fps'] / old['fps'] - 1
+        old_decisions = {d['time']: (d['motion'], d['reason']) for d in old['decisions']}
+        changed = [d['time'] for d in run['decisions']
+                   if d['time'] in old_decisions and old_decisions[d['time']] != (d['motion'], d['reason'])]
+        slower = change < -tolerance
+        regressed |= slower or bool(changed)
+        print(f"  {run['source']:<14} {old['fps']:>7.0f} -> {run['fps']:>7.0f} fps ({change:+.0%})"
+              f"{'  SLOWER' if slower else ''}{f'  {len(changed)} decisions changed' if changed else ''}",
+              file=sys.stderr)
+        for stage, stats in run['stages'].items():
+            before = old['stages'].get(stage)
+            if before and before['mean_ms']:
+                print(f"      {stage:<11} {before['mean_ms']:>7.3f} -> {stats['mean_ms']:>7.3f} ms", file=sys.stderr)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clip', action='append', default=[], help='video file to replay (repeatable)')
+    parser.add_argument('--scene', action='append', default=[], choices=SCENES,
+                        help='synthetic scene to replay (repeatable, default: all without --clip)')
+    parser.add_argument('--mode', default=DETECTION_MODE, help="'diff', 'average', 'mog2' or 'knn'")
+    parser.add_argument('--process-width', type=int, default=PROCESS_WIDTH, help='0 = full resolution')
+    parser.add_argument('--interval', type=float, default=CAPTURE_INTERVAL, help='seconds between analyzed frames')
+    parser.add_argument('--every-frame', action='store_true', help='analyze every frame of a clip')
+    parser.add_argument('--realtime', action='store_true', help='pace frames like a live stream')
+    parser.add_argument('--start', type=float, default=0.0, help='seconds into the source to start at')
+    parser.add_argument('--seconds', type=float, help='seconds to replay (scenes: default 60)')
+    parser.add_argument('--size', default='1280x720', help='size of the synthetic scenes')
+    parser.add_argument('--save', metavar='DIR', help='write the frames with motion, boxes drawn, here')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fps drop against the baseline')
+    parser.add_argument('--threads', type=int, default=1, help='OpenCV threads (detection workers use 1)')
+    args = parser.parse_args()
+    cv2.setNumThreads(args.threads)
+    if args.every_frame:
+        args.interval = 0
+
+    sources = {}
+    for path in args.clip:
+        sources[path] = lambda timer, path=path: clip_source(path, args.interval, args.start, args.seconds, timer)
+    size = tuple(int(v) for v in args.size.split('x'))
+    for scene in args.scene or ([] if args.clip else SCENES):
+        sources[scene] = lambda timer, scene=scene: scene_source(
+            scene, size, args.interval or 1 / 25, args.start, args.seconds or 60, timer
+        )
+
+    runs = []
+    for name, source in sources.items():
+        run = replay(name, source, args)
+        runs.append(run)
+        stages = ', '.join(f"{stage} {stats['mean_ms']:.2f}" for stage, stats in run['stages'].items())
+        print(f"{name}: {run['analyzed']} frames, {run['fps']} fps, {run['motion']} with motion, "
+              f"max RSS {run['max_rss_mb']} MB | ms/frame: {stages}", file=sys.stderr)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'opencv': cv2.__version__,
+        'cpus': os.cpu_count(),
+        'threads': args.threads,
+        'runs': runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Against {args.baseline}:", file=sys.stderr)
+        if compare(baseline, runs, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
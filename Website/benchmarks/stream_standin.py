@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Local camera stand-in for the motion detection benchmarks
+Starts ffmpeg producing a live H.264 test pattern in real time, served as
+MPEG-TS (or --container) over TCP on 127.0.0.1, so cv2.VideoCapture can
+read it like the RTSP cameras without any network or MediaMTX. Each stream
+accepts one client and ends after `duration` seconds.
+
+Usage: python3 benchmarks/stream_standin.py [--port 8554] [--size 1280x720] [--rate 25]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from voice_pipeline import ffmpeg_binary  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def listening(port):
+    """True once something listens on the port (Linux /proc/net/tcp, state 0A)"""
+    with open('/proc/net/tcp') as f:
+        for line in f.readlines()[1:]:
+            fields = line.split()
+            if fields[1].endswith(f':{port:04X}') and fields[3] == '0A':
+                return True
+    return False
+
+
+def start_stream(port=None, size='1280x720', rate=25, duration=60, source=None, scale=False,
+                 container='mpegts'):
+    """
+    Start a stand-in stream; returns (process, url). source is a video file to
+    loop instead of the moving test pattern, scaled to size when scale is set
+    (e.g. to stand in for a camera's sub-stream). container: 'mpegts', or
+    'matroska' for ffmpeg builds whose MPEG-TS demuxer does not work.
+    """
+    port = port or free_port()
+    if source:
+        inputs = ['-stream_loop', '-1', '-re', '-i', source]
+        if scale:
+            inputs += ['-vf', f"scale={size.replace('x', ':')}"]
+    else:
+        inputs = ['-re', '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}']
+    process = subprocess.Popen(
+        [ffmpeg_binary(), '-hide_banner', '-loglevel', 'quiet', *inputs, '-t', str(duration),
+         '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-g', str(rate),
+         '-f', container, f'tcp://127.0.0.1:{port}?listen=1'],
+        stdin=subprocess.DEVNULL
+    )
+    # Wait until ffmpeg is listening, without connecting (it serves one client)
+    deadline = time.monotonic() + 5
+    while not listening(port) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return process, f'tcp://127.0.0.1:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8554)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--rate', type=int, default=25)
+    parser.add_argument('--duration', type=int, default=3600)
+    parser.add_argument('--source', help='video file to loop instead of the test pattern')
+    parser.add_argument('--container', default='mpegts')
+    args = parser.parse_args()
+    process, url = start_stream(args.port, args.size, args.rate, args.duration, args.source,
+                                container=args.container)
+    print(f"Serving {url} (one client), Ctrl+C to stop")
+    try:
+        process.wait()
+    except KeyboardInterrupt:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Lights concurrency stress test
+Hammers toggle / heartbeat / sync from many threads (and, with the sqlite
+backend, several processes sharing one database) and then checks that no
+update was lost:
+  - the toggled light ends in the state implied by the number of toggles
+  - every successful toggle was given its own revision
+  - the store revision matches the highest revision handed out
+
+Usage: python3 benchmarks/stress_lights.py [--backend sqlite] [--processes 4] [--threads 8] [--ops 200]
+Exits with status 1 if a check fails.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import FlaskServer  # noqa: E402
+from lights_store import JsonLightStore, SqliteLightStore  # noqa: E402
+
+TOGGLE_ID = 'stress_toggle'
+HEARTBEAT_ID = 'stress_heartbeat'
+SYNC_ID = 'stress_sync'
+
+
+def open_test_store(args):
+    if args.backend == 'sqlite':
+        return SqliteLightStore(os.path.join(args.directory, 'lights_state.db'))
+    return JsonLightStore(os.path.join(args.directory, 'lights_state.json'), flush_delay=0.05)
+
+
+def worker(worker_id, ops, results, lock):
+    """Run a random mix of requests and collect what the server answered"""
+    client = FlaskServer.app.test_client()
+    rng = random.Random(worker_id)
+    toggles, toggle_revs, syncs, conflicts = 0, [], 0, 0
+
+    for i in range(ops):
+        op = rng.random()
+        if op < 0.5:
+            response = client.post(f'/api/lights/{TOGGLE_ID}/toggle', json={})
+            toggles += 1
+            toggle_revs.append(response.get_json()['light']['rev'])
+        elif op < 0.8:
+            client.post(f'/api/lights/{HEARTBEAT_ID}/heartbeat', json={'state': rng.random() < 0.5})
+        else:
+            data = client.get('/api/lights').get_json()
+            lights = data['lights']
+            lights[SYNC_ID]['name'] = f'sync {worker_id}-{i}'
+            response = client.post('/api/lights/sync', json={'lights': lights, 'revision': data['revision']})
+            syncs += 1
+            conflicts += len(response.get_json().get('conflicts', []))
+
+    with lock:
+        results.append((toggles, toggle_revs, syncs, conflicts))
+
+
+def run_process(args, process_id, queue):
+    """One worker process: its own store handle, args.threads request threads"""
+    if args.processes > 1:
+        FlaskServer.light_store = open_test_store(args)
+    results, lock = [], threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(process_id * 1000 + t, args.ops, results, lock))
+        for t in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if queue is not None:
+        queue.put(results)
+    return results
+
+
+def stress(backend='json', processes=1, threads=8, ops=200):
+    """
+    Run the request mix against a fresh store in a temporary directory.
+    Returns (failures, summary): failures lists the checks that failed.
+    """
+    if processes > 1 and backend != 'sqlite':
+        raise ValueError('several processes only share state with the sqlite backend')
+    args = argparse.Namespace(backend=backend, processes=processes, threads=threads, ops=ops,
+                              directory=tempfile.mkdtemp())
+    FlaskServer.light_store = open_test_store(args)
+    initial = {
+        TOGGLE_ID: {'id': TOGGLE_ID, 'name': 'Toggle', 'location': 'Stress', 'state': False},
+        HEARTBEAT_ID: {'id': HEARTBEAT_ID, 'name': 'Heartbeat', 'location': 'Stress', 'state': False},
+        SYNC_ID: {'id': SYNC_ID, 'name': 'Sync', 'location': 'Stress', 'state': False},
+    }
+    FlaskServer.light_store.apply(initial)
+    start_revision = FlaskServer.light_store.revision
+
+    start = time.perf_counter()
+    if processes > 1:
+        FlaskServer.light_store.close()
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [context.Process(target=run_process, args=(args, p, queue)) for p in range(processes)]
+        for process in workers:
+            process.start()
+        results = []
+        for _ in workers:
+            results.extend(queue.get())
+        for process in workers:
+            process.join()
+        FlaskServer.light_store = open_test_store(args)
+    else:
+        results = run_process(args, 0, None)
+    elapsed = time.perf_counter() - start
+
+    toggles = sum(r[0] for r in results)
+    toggle_revs = [rev for r in results for rev in r[1]]
+    store = FlaskServer.light_store
+    final = store.get(TOGGLE_ID)
+    failures = []
+    if final['state'] != (toggles % 2 == 1):
+        failures.append(f"toggle state {final['state']} after {toggles} toggles: an update was lost")
+    if len(set(toggle_revs)) != len(toggle_revs):
+        failures.append(f"{len(toggle_revs) - len(set(toggle_revs))} toggles shared a revision")
+    if toggle_revs and max(toggle_revs) > store.revision:
+        failures.append(f"revision {max(toggle_revs)} handed out but store is at {store.revision}")
+    summary = {
+        'requests': processes * threads * ops,
+        'seconds': elapsed,
+        'toggles': toggles,
+        'syncs': sum(r[2] for r in results),
+        'conflicts': sum(r[3] for r in results),
+        'revisions': (start_revision, store.revision),
+    }
+    store.close()
+    return failures, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes (sqlite backend only)')
+    parser.add_argument('--threads', type=int, default=8, help='request threads per process')
+    parser.add_argument('--ops', type=int, default=200, help='requests per thread')
+    args = parser.parse_args()
+
+    if args.processes > 1 and args.backend != 'sqlite':
+        parser.error('several processes only share state with --backend sqlite')
+    failures, summary = stress(args.backend, args.processes, args.threads, args.ops)
+
+    print(f"backend={args.backend} processes={args.processes} threads={args.threads} ops={summary['requests']}")
+    print(f"  {summary['requests'] / summary['seconds']:.0f} requests/s, {summary['toggles']} toggles, "
+          f"{summary['syncs']} syncs ({summary['conflicts']} conflicting lights skipped), "
+          f"revisions {summary['revisions'][0]} -> {summary['revisions'][1]}")
+    if failures:
+        for failure in failures:
+            print(f"  FAIL: {failure}")
+        sys.exit(1)
+    print("  OK: no lost updates")
+
+
+if __name__ == '__main__':
+    main()
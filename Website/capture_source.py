@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Capture Source
+Cheaper ways of getting frames off a camera than decoding every
+full-resolution frame with cv2.VideoCapture and converting it to gray.
+FFmpegCapture runs ffmpeg in a subprocess that scales the picture down to
+the width the detector analyzes, drops frames it would never look at and
+writes raw gray (Y plane) bytes into a pipe, so neither the BGR conversion
+nor cvtColor happen. It can also decode keyframes only, which skips most of
+the decoding when frames are analyzed less often than the camera sends a
+keyframe, and read a camera's low-resolution sub-stream instead of the main
+one. FFmpegCapture looks like a cv2.VideoCapture, so a FrameGrabber reads it
+like any other stream.
+
+choose_source() picks the cheapest source that still gives the detector
+the resolution it is configured for: the sub-stream when there is one wide
+enough, else the main stream's keyframes when they come often enough, else
+OpenCV (which is also used without ffmpeg). Decoding dominates the cost, so
+scaling alone does not beat OpenCV's grab(). Measure them with
+benchmarks/bench_capture_sources.py.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from frame_grabber import open_ffmpeg
+
+FFMPEG = "ffmpeg"  # Executable, looked up on PATH
+OPEN_TIMEOUT = 10.0  # Seconds to wait for ffmpeg to report the stream size
+DECODE_THREADS = 1  # ffmpeg decoding threads (the detection workers are single-threaded too)
+FRAMES_PER_INTERVAL = 2  # Frames passed on per analysis interval of a live stream
+LOG_LINES = 20  # Lines of ffmpeg's log kept for error messages
+
+# "Stream #0:0[0x100]: Video: h264 (High) (...), yuv420p(progressive), 1280x720 [SAR 1:1 DAR 16:9], ..."
+_STREAM_SIZE = re.compile(r'Stream #.*: Video: .*?[ ,](\d{2,5})x(\d{2,5})[ ,\[]')
+
+
+_passthrough = None
+
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG) is not None
+
+
+def passthrough_option():
+    """
+    ffmpeg arguments passing frames on as they come: -fps_mode only exists
+    since ffmpeg 5.1, older ones (as Debian and Raspberry Pi OS ship) exit
+    at once on it and take -vsync instead. Asked to ffmpeg once.
+    """
+    global _passthrough
+    if _passthrough is None:
+        try:
+            options = subprocess.run([shutil.which(FFMPEG) or FFMPEG, '-hide_banner', '-h', 'long'],
+                                     stdin=subprocess.DEVNULL, capture_output=True, timeout=10).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            options = b''
+        _passthrough = ['-fps_mode' if b'-fps_mode' in options else '-vsync', 'passthrough']
+    return _passthrough
+
+
+class FFmpegCapture:
+    """
+    A stream decoded by an ffmpeg subprocess into raw gray frames.
+    width: scale frames down to this width (never up); fps: frames per
+    second passed on (the rest are decoded but dropped before scaling);
+    keyframes: decode keyframes only; source_width: width of the full camera
+    picture when url is a sub-stream, so detections keep its coordinates.
+    """
+
+    def __init__(self, url, width=None, fps=None, keyframes=False, source_width=None,
+                 timeout=OPEN_TIMEOUT, threads=DECODE_THREADS):
+        self.url = url
+        self.width = width
+        self.fps = fps
+        self.keyframes = keyframes
+        self.size = None  # (width, height) of the frames delivered
+        self.input_size = None  # (width, height) of the stream ffmpeg decodes
+        self.source_width = source_width
+        self.frames = 0
+        self.log = deque(maxlen=LOG_LINES)
+        self._header = threading.Event()
+        self._buffer = None
+        self._started = None
+        self._process = self._start(threads)
+        threading.Thread(target=self._read_log, name='ffmpeg-log', daemon=True).start()
+        if not self._header.wait(timeout) or self.size is None:
+            print(f"ffmpeg could not open {url}: {' | '.join(self.log) or 'timed out'}")
+            self.release()
+            return
+        if self.source_width is None:
+            self.source_width = self.input_size[0]
+        self._buffer = np.empty((self.size[1], self.size[0]), np.uint8)
+        self._view = memoryview(self._buffer).cast('B')
+
+    def _start(self, threads):
+        command = [shutil.which(FFMPEG) or FFMPEG, '-hide_banner', '-nostats', '-nostdin', '-loglevel', 'info']
+        if self.url.startswith('rtsp://'):
+            command += ['-rtsp_transport', 'tcp', '-timeout', '5000000']
+        if not os.path.isfile(self.url):
+            command += ['-fflags', 'nobuffer']  # Live: no probing backlog (drops frames of files)
+        command += ['-threads', str(threads)]
+        if self.keyframes:
+            command += ['-skip_frame', 'nokey']
+        command += ['-i', self.url, '-an', '-sn', '-dn']
+        filters = []
+        if self.fps and not self.keyframes:
+            filters.append(f'fps={self.fps}')
+        if self.width:
+            filters.append(f"scale='min({self.width},iw)':-1:flags=area")
+        if filters:
+            command += ['-vf', ','.join(filters)]
+        command += passthrough_option()  # Frames as they come, never duplicated
+        command += ['-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+        return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, bufsize=0)
+
+    def _read_log(self):
+        """Read the stream sizes from ffmpeg's log, then keep the pipe drained"""
+        section = None
+        for raw in self._process.stderr:
+            line = raw.decode('utf-8', 'replace').rstrip()
+            self.log.append(line.strip())
+            if line.startswith('Input #'):
+                section = 'input'
+            elif line.startswith('Output #'):
+                section = 'output'
+            match = _STREAM_SIZE.search(line)
+            if match and not self._header.is_set():
+                size = (int(match.group(1)), int(match.group(2)))
+                if section == 'input' and self.input_size is None:
+                    self.input_size = size
+                elif section == 'output':
+                    self.size = size
+                    self._header.set()
+        self._header.set()  # ffmpeg exited
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    # ----- cv2.VideoCapture interface -----
+
+    def isOpened(self):
+        return self._buffer is not None and self._process.poll() is None
+
+    def grab(self):
+        """Read the next frame off the pipe into the buffer"""
+        if self._buffer is None:
+            return False
+        view, read = self._view, 0
+        while read < len(view):
+            count = self._process.stdout.readinto(view[read:])
+            if not count:
+                return False  # Stream ended or ffmpeg died
+            read += count
+        if self._started is None:
+            self._started = time.monotonic()
+        self.frames += 1
+        return True
+
+    def retrieve(self):
+        """A copy of the frame grabbed last, (height, width) uint8"""
+        if self._buffer is None or not self.frames:
+            return False, None
+        return True, self._buffer.copy()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0]) if self.size else 0.0
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1]) if self.size else 0.0
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps or 0)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            # Raw video has no timestamps: frame count at a fixed rate, else time since the first frame
+            if self.fps and not self.keyframes:
+                return 1000.0 * (self.frames - 1) / self.fps
+            return 1000.0 * (time.monotonic() - self._started) if self._started else 0.0
+        return 0.0
+
+    def release(self):
+        process = self._process
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        process.stdout.close()
+        self._buffer = None
+
+
+class CaptureSource:
+    """
+    How a camera is read: kind is 'substream', 'ffmpeg' or 'opencv'.
+    open(url) is the open_capture of a FrameGrabber.
+    """
+
+    def __init__(self, kind, url, width=None, fps=None, keyframes=False, source_width=None):
+        self.kind = kind
+        self.url = url
+        self.width = width
+        self.fps = fps
+        self.keyframes = keyframes
+        self.source_width = source_width
+
+    def open(self, url):
+        if self.kind == 'opencv':
+            return open_ffmpeg(url)
+        return FFmpegCapture(url, self.width, self.fps, self.keyframes, self.source_width)
+
+    def describe(self):
+        if self.kind == 'opencv':
+            return f"OpenCV, full resolution ({self.url})"
+        parts = [f"{self.width} px gray" if self.width else "gray"]
+        if self.keyframes:
+            parts.append("keyframes only")
+        elif self.fps:
+            parts.append(f"{self.fps} fps")
+        return f"{'sub-stream' if self.kind == 'substream' else 'ffmpeg'}, {', '.join(parts)} ({self.url})"
+
+
+def choose_source(url, process_width=None, interval=None, substream=None, substream_width=None,
+                  keyframe_interval=None, width=None, kind=None):
+    """
+    The cheapest CaptureSource for a detector analyzing process_width wide
+    frames every interval seconds. substream: URL of the camera's
+    low-resolution stream, substream_width its width when known (a narrower
+    one than process_width is not used); keyframe_interval: seconds between
+    the camera's keyframes, keyframes only are decoded when the detector
+    waits at least that long between frames; width: the main stream's
+    width, to keep sub-stream detections in its coordinates. kind forces
+    'substream', 'ffmpeg' or 'opencv'.
+
+    Decoding is what costs: when every frame of the main stream has to be
+    decoded anyway, OpenCV is cheaper than piping frames out of ffmpeg,
+    since its grab() leaves the frames nobody asks for unconverted.
+    """
+    keyframes = bool(keyframe_interval and interval and keyframe_interval <= interval)
+    if kind is None:
+        if not ffmpeg_available():
+            kind = 'opencv'
+        elif substream and not (process_width and substream_width and substream_width < process_width):
+            kind = 'substream'
+        elif keyframes and _live(url):
+            kind = 'ffmpeg'
+        else:
+            kind = 'opencv'
+    if kind not in ('substream', 'ffmpeg', 'opencv'):
+        raise ValueError(f"Unknown capture source: {kind}")
+    if kind == 'opencv':
+        return CaptureSource('opencv', url)
+    if kind == 'substream':
+        if not substream:
+            raise ValueError("The 'substream' capture source needs the camera's sub-stream URL")
+        url = substream
+    # A file is paced by its reader, dropping frames would make it play faster
+    keyframes = keyframes and _live(url)
+    fps = None
+    if interval and not keyframes and _live(url):
+        fps = max(1, round(FRAMES_PER_INTERVAL / interval))
+    return CaptureSource(kind, url, process_width, fps, keyframes, width if kind == 'substream' else None)
+
+
+def _live(url):
+    return not os.path.isfile(url)
@@ -1,46 +1,43 @@
 #!/usr/bin/env python3
-import requests
+from lights_client import LightsClient
+from metrics import Registry
 
 API_URL = "http://192.168.1.143:5000/api/lights"
 
+# Round trips as this script sees them (the server's side is on /metrics)
+registry = Registry()
+request_seconds = registry.histogram('lights_client_request_seconds', 'Lights API round trips', ('method',))
+
+# Shared client: keep-alive connections and an ETag cache for repeated reads
+client = LightsClient(API_URL, timer=request_seconds.timer())
+
 # Get all lights
 def get_all_lights():
-    response = requests.get(API_URL)
-    if response.ok:
-        data = response.json()
-        return data['lights']
-    return {}
+    return client.get_all_lights()
 
 # Get specific light
 def get_light(light_id):
-    response = requests.get(f"{API_URL}/{light_id}")
-    if response.ok:
-        data = response.json()
-        return data['light']
-    return None
+    return client.get_light(light_id)
 
 # Turn light ON
 def turn_on(light_id):
-    response = requests.post(
-        f"{API_URL}/{light_id}/toggle",
-        json={'state': True}
-    )
-    return response.ok
+    return client.set_state(light_id, True)
 
 # Turn light OFF
 def turn_off(light_id):
-    response = requests.post(
-        f"{API_URL}/{light_id}/toggle",
-        json={'state': False}
-    )
-    return response.ok
+    return client.set_state(light_id, False)
+
+# Turn several lights ON/OFF in one request
+def set_many(light_ids, state):
+    return client.set_many(light_ids, state)
+
+# Turn every light in a location ON/OFF in one request (e.g. '📍 Planta Baja')
+def set_location(location, state):
+    return client.set_location(location, state)
 
 # Check if light is on
 def is_light_on(light_id):
-    light = get_light(light_id)
-    if light:
-        return light.get('state', False)
-    return False
+    return client.is_light_on(light_id)
 
 # Example usage
 if __name__ == '__main__':
@@ -61,3 +58,6 @@ if __name__ == '__main__':
     # Turn off kitchen
     turn_off('kitchen')
     print("Turned off kitchen light")
+
+    for (method,), timing in request_seconds.items():
+        print(f"{method}: {timing.count} requests, {1000 * timing.sum / timing.count:.1f} ms on average")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Frame Grabber
+Reads a camera stream in its own thread so analysis never holds it up.
+The grabber pulls every frame off the stream with grab(), which keeps the
+FFmpeg buffer drained, but only converts a frame to an image (retrieve())
+when a consumer asks for one. The consumer always gets the newest frame,
+never a backlog, at whatever rate it analyzes. Lost streams are reopened
+with exponential backoff. stats() reports decode fps, skipped frames and
+frame latency.
+"""
+
+import os
+import threading
+import time
+
+import cv2
+
+# Better RTSP support: TCP transport and a 5 s socket timeout
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "rtsp_transport;tcp|timeout;5000000")
+
+BACKOFF_START = 0.5  # Seconds before the first reconnect attempt
+BACKOFF_MAX = 30  # Longest wait between reconnect attempts
+MAX_READ_FAILURES = 5  # Failed grabs in a row that count as a lost stream
+RATE_SMOOTHING = 0.1  # Weight of the newest sample in the moving averages
+
+
+def open_ffmpeg(url):
+    return cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+
+
+class Frame:
+    """An image from the stream with the time it was grabbed (time.monotonic())"""
+
+    __slots__ = ('image', 'number', 'position', 'captured_at', 'wall_time', 'source_width')
+
+    def __init__(self, image, number, position, captured_at, wall_time, source_width=None):
+        self.image = image
+        self.number = number  # Frames grabbed before this one since the grabber started, plus one
+        self.position = position  # Stream timestamp in seconds
+        self.captured_at = captured_at
+        self.wall_time = wall_time
+        self.source_width = source_width  # Camera picture width when the image was scaled down on the way
+
+    @property
+    def age(self):
+        return time.monotonic() - self.captured_at
+
+
+class FrameGrabber:
+    """
+    Keeps the newest frame of a stream. open_capture(url) returns a
+    cv2.VideoCapture-like object (one that scales frames down, like
+    capture_source.FFmpegCapture, gives the full width in source_width);
+    pace limits grabbing to that many frames per second, for sources such
+    as files that are not live.
+    """
+
+    def __init__(self, url, open_capture=open_ffmpeg, name=None, pace=None,
+                 backoff=BACKOFF_START, max_backoff=BACKOFF_MAX):
+        self.url = url
+        self.open_capture = open_capture
+        self.name = name or url
+        self.pace = pace
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+
+        self.state = 'starting'  # 'connecting', 'streaming', 'waiting' or 'stopped'
+        self._frame = None
+        self._wanted = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.grabbed = 0  # Frames pulled off the stream
+        self.delivered = 0  # Frames handed to the consumer
+        self.failures = 0  # Failed grabs and retrieves
+        self.reconnects = 0
+        self.connected_at = None
+        self.last_frame_at = None
+        self.decode_fps = 0.0
+        self.latency = 0.0  # Average seconds from grab to the end of analysis
+        self.max_latency = 0.0
+
+    # ----- thread -----
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'grabber-{self.name}', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.state = 'stopped'
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.state = 'connecting'
+            cap = self.open_capture(self.url)
+            if cap is None or not cap.isOpened():
+                print(f"[{self.name}] Cannot open stream, retrying in {self.backoff:.1f}s")
+                self._wait_backoff()
+                continue
+            self.connected_at = time.monotonic()
+            self.state = 'streaming'
+            try:
+                self._stream(cap)
+            finally:
+                cap.release()
+            if not self._stop.is_set():
+                self.reconnects += 1
+                print(f"[{self.name}] Stream lost, reconnecting in {self.backoff:.1f}s")
+                self._wait_backoff()
+
+    def _wait_backoff(self):
+        self.state = 'waiting'
+        self._stop.wait(self.backoff)
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def _stream(self, cap):
+        failures = 0
+        previous = None
+        source_width = getattr(cap, 'source_width', None)
+        while not self._stop.is_set():
+            if self.pace and previous is not None:
+                delay = previous + 1 / self.pace - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+            if not cap.grab():
+                failures += 1
+                self.failures += 1
+                if failures >= MAX_READ_FAILURES:
+                    return
+                continue
+            now = time.monotonic()
+            failures = 0
+            self.grabbed += 1
+            self.last_frame_at = now
+            self.backoff = self.initial_backoff  # The stream works again
+            if previous is not None and now > previous:
+                self.decode_fps += RATE_SMOOTHING * (1 / (now - previous) - self.decode_fps)
+            previous = now
+
+            if not self._wanted:
+                continue  # Nobody is waiting: skip the conversion to an image
+            ok, image = cap.retrieve()
+            if not ok or image is None or image.size == 0:
+                self.failures += 1
+                continue
+            with self._cond:
+                position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                self._frame = Frame(image, self.grabbed, position, now, time.time(), source_width)
+                self._wanted = False
+                self._cond.notify_all()
+
+    # ----- consumer -----
+
+    def read(self, timeout=None):
+        """Wait for the next frame grabbed from now on; None on timeout or stop"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            last = self._frame
+            self._wanted = True
+            while self._frame is last and not self._stop.is_set():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if self._frame is last:
+                return None
+            self.delivered += 1
+            return self._frame
+
+    def done(self, frame):
+        """Record that the consumer finished with frame, for the latency figures"""
+        latency = time.monotonic() - frame.captured_at
+        self.latency += RATE_SMOOTHING * (latency - self.latency) if self.latency else latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'state': self.state,
+            'decode_fps': round(self.decode_fps, 1),
+            'grabbed': self.grabbed,
+            'delivered': self.delivered,
+            'skipped': self.grabbed - self.delivered,  # Decoded but never analyzed
+            'failures': self.failures,
+            'reconnects': self.reconnects,
+            'last_frame_age': round(now - self.last_frame_at, 3) if self.last_frame_at else None,
+            'latency': round(self.latency, 4),
+            'max_latency': round(self.max_latency, 4),
+        }
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Frame Ring
+Fixed-size history of gray frames in one preallocated (capacity, H, W)
+uint8 block. Adding a frame is O(1) and allocates nothing: the caller
+writes straight into the next slot (e.g. cvtColor(..., dst=ring.next_slot()))
+and commits it. The most recent frames are available as views.
+
+A ring can live in shared memory (a memory-mapped file in /dev/shm) under a
+name, so another process (the Flask server, a clip recorder) maps it and
+reads the recent frames without them being sent anywhere. One process
+writes; readers use copy_last(), which drops frames the writer overwrote
+while they were copied.
+
+    python3 frame_ring.py motion_frames_camera1   # Show what a ring holds
+"""
+
+import argparse
+import mmap
+import os
+import time
+
+import numpy as np
+
+MAGIC = 0x46524D52  # 'FRMR'
+HEADER_FIELDS = 8  # magic, capacity, height, width, count, reserved...
+_MAGIC, _CAPACITY, _HEIGHT, _WIDTH, _COUNT = range(5)
+ALIGN = 64
+SHM_DIR = '/dev/shm'  # tmpfs: mapped files there live in RAM only
+
+
+def _layout(capacity, height, width):
+    """Byte offsets of the timestamps and frames, and the total size"""
+    header = HEADER_FIELDS * 8
+    timestamps = header
+    frames = -(-(timestamps + capacity * 8) // ALIGN) * ALIGN
+    return timestamps, frames, frames + capacity * height * width
+
+
+class FrameRing:
+    """The last `capacity` frames of shape (height, width), oldest overwritten first"""
+
+    def __init__(self, capacity, height, width, name=None, buffer=None, _mapping=None, _owner=True):
+        self.capacity = capacity
+        self.height = height
+        self.width = width
+        self.name = name
+        self.path = None
+        self._inode = None
+        self._mapping = _mapping
+        self._owner = _owner
+        timestamps, frames, size = _layout(capacity, height, width)
+        if buffer is None:
+            buffer = bytearray(size)
+        self._header = np.ndarray((HEADER_FIELDS,), np.int64, buffer, 0)
+        self.timestamps = np.ndarray((capacity,), np.float64, buffer, timestamps)
+        self.frames = np.ndarray((capacity, height, width), np.uint8, buffer, frames)
+        if _owner:
+            self._header[:] = 0
+            self._header[_MAGIC] = MAGIC
+            self._header[_CAPACITY] = capacity
+            self._header[_HEIGHT] = height
+            self._header[_WIDTH] = width
+
+    # ----- shared memory -----
+
+    @classmethod
+    def create_shared(cls, name, capacity, height, width, directory=SHM_DIR):
+        """A ring in a memory-mapped file under directory, replacing a leftover one"""
+        path = os.path.join(directory, name)
+        size = _layout(capacity, height, width)[2]
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(size)
+            mapping = mmap.mmap(f.fileno(), size)
+        ring = cls(capacity, height, width, name, mapping, mapping)
+        ring.path = path
+        os.replace(tmp_path, path)  # Readers never see a ring without its header
+        return ring
+
+    @classmethod
+    def attach(cls, name, directory=SHM_DIR):
+        """Map a ring another process created, read-only; FileNotFoundError if there is none"""
+        path = os.path.join(directory, name)
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            inode = os.fstat(f.fileno()).st_ino
+        header = np.frombuffer(mapping, np.int64, HEADER_FIELDS)
+        if header[_MAGIC] != MAGIC:
+            del header
+            mapping.close()
+            raise ValueError(f"{path} is not a frame ring")
+        capacity, height, width = (int(header[i]) for i in (_CAPACITY, _HEIGHT, _WIDTH))
+        del header
+        ring = cls(capacity, height, width, name, mapping, mapping, _owner=False)
+        ring.path = path
+        ring._inode = inode
+        return ring
+
+    def replaced(self):
+        """True when the writer went away or made a new ring under the same name"""
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return True
+
+    def close(self):
+        """Release the mapping; the creator also removes the ring"""
+        if self._mapping is None:
+            return
+        mapping, self._mapping = self._mapping, None
+        self._header = self.timestamps = self.frames = None  # Views must go before the mapping
+        mapping.close()
+        if self._owner:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    # ----- writing -----
+
+    @property
+    def count(self):
+        """Frames written since the ring was created"""
+        return int(self._header[_COUNT])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def next_slot(self):
+        """View of the slot the next frame goes into, to write into directly"""
+        return self.frames[self.count % self.capacity]
+
+    def commit(self, timestamp=None):
+        """Publish the frame written into next_slot()"""
+        count = self.count
+        self.timestamps[count % self.capacity] = time.time() if timestamp is None else timestamp
+        self._header[_COUNT] = count + 1
+
+    def push(self, frame, timestamp=None):
+        """Copy a frame into the ring"""
+        np.copyto(self.next_slot(), frame)
+        self.commit(timestamp)
+
+    # ----- reading -----
+
+    def latest(self, back=0):
+        """View of the newest frame (back=1 the one before...), None if not written yet"""
+        count = self.count
+        if back >= min(count, self.capacity):
+            return None
+        return self.frames[(count - 1 - back) % self.capacity]
+
+    def last(self, n=None):
+        """Views of the last n frames, oldest first (in the writer's process)"""
+        count = self.count
+        n = min(n or self.capacity, count, self.capacity)
+        return [self.frames[i % self.capacity] for i in range(count - n, count)]
+
+    def copy_last(self, n=None, out=None):
+        """
+        Copy the last n frames (oldest first) into out, safe against a writer
+        in another process. Returns (frames, timestamps) for the frames that
+        were not overwritten during the copy.
+        """
+        before = self.count
+        n = min(n or self.capacity, before, self.capacity)
+        if out is None:
+            out = np.empty((n, self.height, self.width), np.uint8)
+        first = before - n
+        slots = np.arange(first, before) % self.capacity
+        start = slots[0] if n else 0
+        if n and start + n <= self.capacity:
+            out[:n] = self.frames[start:start + n]  # One contiguous block
+        else:
+            np.take(self.frames, slots, axis=0, out=out[:n])
+        stamps = self.timestamps[slots].copy()
+        after = self.count
+        # The writer was overwriting slot `after` while we copied: frames up to
+        # after - capacity may be torn
+        valid = max(0, (after - self.capacity + 1) - first)
+        return out[valid:n], stamps[valid:]
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'capacity': self.capacity,
+            'shape': [self.height, self.width],
+            'count': self.count,
+            'bytes': self.frames.nbytes,
+            'newest': float(self.timestamps[(self.count - 1) % self.capacity]) if self.count else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('name', help='shared memory name of the ring')
+    args = parser.parse_args()
+    ring = FrameRing.attach(args.name)
+    try:
+        stats = ring.stats()
+        print(f"{stats['name']}: {stats['capacity']} x {stats['shape'][1]}x{stats['shape'][0]}, "
+              f"{stats['count']} frames written")
+        frames, stamps = ring.copy_last()
+        for frame, stamp in zip(frames, stamps):
+            age = time.time() - stamp
+            print(f"  {time.strftime('%H:%M:%S', time.localtime(stamp))} ({age:.1f}s ago) mean {frame.mean():.1f}")
+    finally:
+        ring.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Intents
+Declarative intent registry for the voice assistant.
+Handlers register with a decorator and the keywords that trigger them:
+
+    @intents.intent('pause_music', ['pausa', 'para la música'], priority=10)
+    def pause(match):
+        ...
+
+All keywords are compiled into one Aho-Corasick automaton over word tokens,
+so a command is matched in a single pass whatever the number of intents.
+That pass costs more than scanning the assistant's few intents for
+substrings (about 12 us against 1.5 us, see benchmarks/bench_intents.py);
+the automaton only gets ahead at around a thousand intents. It is kept for
+the whole-word and priority rules below, not for speed.
+Matching works on whole words with accents folded ("ahora" no longer
+matches "hora", "cancion" matches "canción"). When several intents match,
+the highest priority wins, then the longest keyword, then the earliest one.
+An intent with a slot captures the text after its last keyword, e.g. the
+song name in "reproduce la canción de Despacito".
+"""
+
+import re
+import threading
+import unicodedata
+from collections import deque
+
+WORD = re.compile(r'\w+')
+SLOT_FILLER = ('de', 'del', 'la')  # Leading words dropped from slot values
+SLOT_SUFFIXES = ('por favor',)  # Trailing courtesy dropped from slot values
+SLOT_TRAILING = ' ?¿!¡.,;:'
+
+
+def fold(word):
+    """Lowercase a word and strip its accents"""
+    decomposed = unicodedata.normalize('NFD', word.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Return [(folded word, start, end)] for every word in text"""
+    return [(fold(match.group()), match.start(), match.end()) for match in WORD.finditer(text)]
+
+
+class Intent:
+    def __init__(self, name, keywords, handler, priority=0, slot=None):
+        self.name = name
+        self.keywords = list(keywords)
+        self.handler = handler
+        self.priority = priority
+        self.slot = slot
+
+
+class Match:
+    """The intent picked for a command, with its slot values"""
+
+    def __init__(self, intent, keyword, text, slots):
+        self.intent = intent
+        self.keyword = keyword
+        self.text = text
+        self.slots = slots
+
+    @property
+    def name(self):
+        return self.intent.name if self.intent else None
+
+    def __repr__(self):
+        return f"Match({self.name!r}, keyword={self.keyword!r}, slots={self.slots!r})"
+
+
+class _Node:
+    __slots__ = ('children', 'fail', 'outputs')
+
+    def __init__(self):
+        self.children = {}
+        self.fail = None
+        self.outputs = []  # (intent, keyword, number of tokens)
+
+
+class IntentRegistry:
+    """Intents and their keywords, compiled lazily into a token automaton"""
+
+    def __init__(self):
+        self.intents = {}
+        self._fallback = None
+        self._root = None
+        self._lock = threading.Lock()
+
+    # ----- registration -----
+
+    def add(self, name, keywords, handler=None, priority=0, slot=None, response=None):
+        """Register an intent; response is a shortcut for a handler returning fixed text"""
+        if handler is None:
+            if response is None:
+                raise ValueError(f"intent '{name}' needs a handler or a response")
+            handler = lambda match: response  # noqa: E731
+        if name in self.intents:
+            raise ValueError(f"intent '{name}' is already registered")
+        if not keywords:
+            raise ValueError(f"intent '{name}' has no keywords")
+        self.intents[name] = Intent(name, keywords, handler, priority, slot)
+        self._root = None  # Recompiled on the next match
+        return handler
+
+    def intent(self, name, keywords, priority=0, slot=None):
+        """Decorator form of add()"""
+        def register(handler):
+            self.add(name, keywords, handler, priority, slot)
+            return handler
+        return register
+
+    def fallback(self, handler):
+        """Decorator for the handler called when no intent matches"""
+        self._fallback = handler
+        return handler
+
+    # ----- compilation -----
+
+    def compile(self):
+        """Build the Aho-Corasick automaton over the keyword tokens"""
+        root = _Node()
+        for intent in self.intents.values():
+            for keyword in intent.keywords:
+                tokens = [token for token, _, _ in tokenize(keyword)]
+                if not tokens:
+                    continue
+                node = root
+                for token in tokens:
+                    node = node.children.setdefault(token, _Node())
+                node.outputs.append((intent, keyword, len(tokens)))
+
+        # Breadth-first: a node's failure link points at the longest proper
+        # suffix of its token path that is also in the trie
+        root.fail = root
+        queue = deque()
+        for child in root.children.values():
+            child.fail = root
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for token, child in node.children.items():
+                fail = node.fail
+                while fail is not root and token not in fail.children:
+                    fail = fail.fail
+                child.fail = fail.children.get(token, root)
+                child.outputs = child.outputs + child.fail.outputs
+                queue.append(child)
+
+        self._root = root
+        return root
+
+    def _automaton(self):
+        root = self._root
+        if root is None:
+            with self._lock:
+                root = self._root or self.compile()
+        return root
+
+    # ----- matching -----
+
+    def hits(self, text):
+        """All keyword occurrences in text: [(intent, keyword, first token, last token)]"""
+        root = self._automaton()
+        tokens = tokenize(text)
+        found = []
+        node = root
+        for position, (token, _, _) in enumerate(tokens):
+            while node is not root and token not in node.children:
+                node = node.fail
+            node = node.children.get(token, root)
+            for intent, keyword, length in node.outputs:
+                found.append((intent, keyword, position - length + 1, position))
+        return found, tokens
+
+    def match(self, text):
+        """Return the best Match for text, or a Match with no intent"""
+        found, tokens = self.hits(text)
+        if not found:
+            return Match(None, None, text, {})
+
+        intent, keyword, start, _ = max(
+            found, key=lambda hit: (hit[0].priority, hit[3] - hit[2], -hit[2])
+        )
+        slots = {}
+        if intent.slot:
+            # The slot is whatever follows the intent's last keyword
+            last = max(hit[3] for hit in found if hit[0] is intent)
+            slots[intent.slot] = self._slot_value(text, tokens, last)
+        return Match(intent, keyword, text, slots)
+
+    def _slot_value(self, text, tokens, last):
+        rest = tokens[last + 1:]
+        while rest and rest[0][0] in SLOT_FILLER:
+            rest = rest[1:]
+        if not rest:
+            return ''
+        value = text[rest[0][1]:].strip(SLOT_TRAILING)
+        for suffix in SLOT_SUFFIXES:
+            if fold(value).endswith(' ' + suffix):
+                value = value[:-len(suffix)].strip(SLOT_TRAILING)
+        return value
+
+    def dispatch(self, text):
+        """Match text and return what the chosen handler (or the fallback) returns"""
+        match = self.match(text)
+        if match.intent is not None:
+            return match.intent.handler(match)
+        if self._fallback is not None:
+            return self._fallback(match)
+        return None
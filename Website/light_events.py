@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Light Events
+In-process publish/subscribe bus for light state changes.
+Every subscriber owns a small bounded queue, so an idle subscriber is just a
+thread parked on a condition variable and costs no CPU. Publishers never
+block: a subscriber that falls behind loses its backlog and receives a single
+'resync' event telling it to fetch a fresh snapshot.
+"""
+
+import json
+import threading
+from collections import deque
+
+DEFAULT_QUEUE_SIZE = 64  # Events buffered per subscriber before it must resync
+
+
+class Subscription:
+    """A single subscriber's bounded event queue"""
+
+    def __init__(self, bus, max_queue=DEFAULT_QUEUE_SIZE, light_id=None):
+        self.bus = bus
+        self.max_queue = max_queue
+        self.light_id = light_id  # Only deliver events for this light (None = all)
+        self.queue = deque()
+        self.overflowed = False
+        self.closed = False
+        self.dropped = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def push(self, event):
+        """Queue an event for this subscriber (called by the publisher)"""
+        if self.light_id is not None and not self._wants(event):
+            return
+        with self._cond:
+            if self.closed:
+                return
+            if len(self.queue) >= self.max_queue:
+                # Slow consumer: throw the backlog away instead of blocking
+                # the publisher, the client will be told to resync
+                self.dropped += len(self.queue)
+                self.queue.clear()
+                self.overflowed = True
+            self.queue.append(event)
+            self._cond.notify()
+
+    def _wants(self, event):
+        if 'light_id' in event:
+            return event['light_id'] == self.light_id
+        if event.get('type') == 'batch':
+            return self.light_id in event['lights'] or self.light_id in event['deleted']
+        return True
+
+    def get(self, timeout=None):
+        """Return the next event, or None on timeout or close"""
+        with self._cond:
+            if self.overflowed:
+                self.overflowed = False
+                self.queue.clear()
+                return {'type': 'resync'}
+            if not self.queue and not self.closed:
+                self._cond.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                self.queue.clear()
+                return {'type': 'resync'}
+            if self.queue:
+                return self.queue.popleft()
+            return None
+
+    def close(self):
+        """Detach from the bus and wake a blocked get()"""
+        self.bus.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventBus:
+    """Fan-out of events to all current subscribers"""
+
+    def __init__(self, max_queue=DEFAULT_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, light_id=None, max_queue=None):
+        """Create a new subscription, use it as a context manager to auto-close"""
+        subscription = Subscription(self, max_queue or self.max_queue, light_id)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        """Deliver an event to every subscriber without blocking"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+        return len(subscribers)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def format_sse(event, event_id=None):
+    """Encode an event as a Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event.get('type', 'message')}")
+    lines.append(f"data: {json.dumps(event, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Lights Client
+Client library for the lights API.
+  - LightsClient: keep-alive connection pool (requests.Session), ETag read
+    cache revalidated with If-None-Match, optional background watcher that
+    keeps the cache coherent from /api/lights/events, batched reads/writes
+  - AsyncLightsClient: asyncio variant on aiohttp for driving hundreds of
+    lights concurrently (pip install aiohttp)
+"""
+
+import asyncio
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_API_URL = "http://192.168.1.143:5000/api/lights"
+
+
+def light_etag(light):
+    """The ETag the server sends for this light revision"""
+    return f'"{light["id"]}-{light.get("rev", 0)}"'
+
+
+class LightCache:
+    """Lights seen by a client, tagged with the ETag they were served with"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lights = {}  # light_id -> (etag, light)
+        self._all_etag = None
+        self.hits = 0
+        self.misses = 0
+        self.live = False  # True while a watcher keeps the cache up to date
+
+    def get(self, light_id):
+        with self._lock:
+            return self._lights.get(light_id, (None, None))
+
+    def put(self, light, etag=None):
+        """Cache a light unless a newer revision is already cached"""
+        with self._lock:
+            _, cached = self._lights.get(light['id'], (None, None))
+            if cached is not None and cached.get('rev', 0) > light.get('rev', 0):
+                return
+            self._lights[light['id']] = (etag or light_etag(light), light)
+
+    def remove(self, light_id):
+        with self._lock:
+            self._lights.pop(light_id, None)
+
+    def replace_all(self, lights, etag=None):
+        with self._lock:
+            self._lights = {light_id: (light_etag(light), light) for light_id, light in lights.items()}
+            self._all_etag = etag
+
+    def all(self):
+        with self._lock:
+            return {light_id: light for light_id, (_, light) in self._lights.items()}
+
+    @property
+    def all_etag(self):
+        return self._all_etag
+
+    def invalidate(self):
+        with self._lock:
+            self._lights = {}
+            self._all_etag = None
+
+
+class LightsClient:
+    """
+    Pooled, caching client for the lights API
+    timer: optional object with add(stage, seconds) given the time of every
+    response, by HTTP method (e.g. a metrics.Histogram timer)
+    """
+
+    def __init__(self, api_url=DEFAULT_API_URL, timeout=5, pool_size=16, cache=True, timer=None):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cache = LightCache() if cache else None
+        if timer is not None:
+            # Time to the response headers; the event stream's body is not counted
+            self.session.hooks['response'].append(
+                lambda response, **kwargs: timer.add(response.request.method, response.elapsed.total_seconds())
+            )
+        self._watcher = None
+        self._stop_watching = threading.Event()
+
+    # ----- reads -----
+
+    def get_all_lights(self):
+        """Return {light_id: light}, revalidating the cached copy with the server"""
+        if self.cache is not None and self.cache.live:
+            self.cache.hits += 1
+            return self.cache.all()
+
+        headers = {}
+        if self.cache is not None and self.cache.all_etag:
+            headers['If-None-Match'] = self.cache.all_etag
+        response = self.session.get(self.api_url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            self.cache.hits += 1
+            return self.cache.all()
+        if not response.ok:
+            return {}
+        lights = response.json()['lights']
+        if self.cache is not None:
+            self.cache.misses += 1
+            self.cache.replace_all(lights, response.headers.get('ETag'))
+        return lights
+
+    def get_light(self, light_id):
+        """Return one light (None if unknown), answered from cache when still valid"""
+        etag, cached = self.cache.get(light_id) if self.cache is not None else (None, None)
+        if cached is not None and self.cache.live:
+            self.cache.hits += 1
+            return cached
+
+        headers = {'If-None-Match': etag} if etag else {}
+        response = self.session.get(f"{self.api_url}/{light_id}", headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached is not None:
+            self.cache.hits += 1
+            return cached
+        if not response.ok:
+            if response.status_code == 404 and self.cache is not None:
+                self.cache.remove(light_id)
+            return None
+        light = response.json()['light']
+        if self.cache is not None:
+            self.cache.misses += 1
+            self.cache.put(light, response.headers.get('ETag'))
+        return light
+
+    def get_many(self, light_ids):
+        """Read several lights with a single request"""
+        lights = self.get_all_lights()
+        return {light_id: lights.get(light_id) for light_id in light_ids}
+
+    def get_location(self, location):
+        """Return {light_id: light} for every light in a location"""
+        response = self.session.get(self.api_url, params={'location': location}, timeout=self.timeout)
+        if response.ok:
+            return response.json()['lights']
+        return {}
+
+    def is_light_on(self, light_id):
+        light = self.get_light(light_id)
+        if light:
+            return light.get('state', False)
+        return False
+
+    # ----- writes -----
+
+    def set_state(self, light_id, state):
+        """Turn a light on/off, return True on success"""
+        return self._toggle(light_id, {'state': state})
+
+    def toggle(self, light_id):
+        return self._toggle(light_id, {})
+
+    def _toggle(self, light_id, body):
+        response = self.session.post(f"{self.api_url}/{light_id}/toggle", json=body, timeout=self.timeout)
+        if response.ok and self.cache is not None:
+            self.cache.put(response.json()['light'])
+        return response.ok
+
+    def set_many(self, light_ids, state):
+        """Turn several lights ON/OFF in one request"""
+        return self._batch({'ids': list(light_ids), 'set': {'state': state}})
+
+    def set_location(self, location, state):
+        """Turn every light in a location ON/OFF in one request"""
+        return self._batch({'location': location, 'set': {'state': state}})
+
+    def _batch(self, body):
+        response = self.session.post(f"{self.api_url}/batch", json=body, timeout=self.timeout)
+        if response.ok and self.cache is not None:
+            for light in response.json()['lights'].values():
+                self.cache.put(light)
+        return response.ok
+
+    def batch(self):
+        """
+        Collect writes and send them as one JSON-patch request on exit:
+            with client.batch() as batch:
+                batch.set_state('living', True)
+                batch.set_state('garden', False)
+        """
+        return WriteBatch(self)
+
+    def patch(self, operations):
+        """Send JSON-patch style operations to /sync, return True on success"""
+        if not operations:
+            return True
+        response = self.session.post(f"{self.api_url}/sync", json={'patch': operations}, timeout=self.timeout)
+        if response.ok and self.cache is not None and not self.cache.live:
+            self.cache.invalidate()  # The response carries no lights, refetch on next read
+        return response.ok
+
+    # ----- change stream -----
+
+    def watch(self):
+        """Keep the cache coherent from the server's event stream in a background thread"""
+        if self.cache is None:
+            raise ValueError("watch() needs a client created with cache=True")
+        if self._watcher is None:
+            self._stop_watching.clear()
+            self._watcher = threading.Thread(target=self._watch_loop, name='lights-client-watch', daemon=True)
+            self._watcher.start()
+        return self
+
+    def close(self):
+        self._stop_watching.set()
+        if self.cache is not None:
+            self.cache.live = False
+        self.session.close()
+
+    def _watch_loop(self):
+        backoff = 1
+        while not self._stop_watching.is_set():
+            try:
+                with self.session.get(f"{self.api_url}/events", stream=True, timeout=(self.timeout, 60)) as response:
+                    response.raise_for_status()
+                    backoff = 1
+                    for event in iter_sse(response):
+                        if self._stop_watching.is_set():
+                            return
+                        self._apply_event(event)
+            except Exception as e:
+                print(f"Lights watch error: {e}")
+            self.cache.live = False
+            self._stop_watching.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _apply_event(self, event):
+        kind = event.get('type')
+        if kind == 'snapshot':
+            self.cache.replace_all(event['lights'])
+            self.cache.live = True
+        elif kind == 'light':
+            self.cache.put(event['light'])
+        elif kind == 'deleted':
+            self.cache.remove(event['light_id'])
+        elif kind == 'batch':
+            for light in event['lights'].values():
+                self.cache.put(light)
+            for light_id in event['deleted']:
+                self.cache.remove(light_id)
+        elif kind == 'resync':
+            # Fell behind: drop the stream, the reconnect brings a new snapshot
+            self.cache.live = False
+            raise ConnectionError("event stream overflowed, resyncing")
+
+
+class WriteBatch:
+    """Writes queued by LightsClient.batch(), flushed as a single request"""
+
+    def __init__(self, client):
+        self.client = client
+        self.operations = []
+
+    def set_state(self, light_id, state):
+        self.operations.append({'op': 'replace', 'path': f'/{light_id}/state', 'value': state})
+
+    def delete(self, light_id):
+        self.operations.append({'op': 'remove', 'path': f'/{light_id}'})
+
+    def flush(self):
+        operations, self.operations = self.operations, []
+        return self.client.patch(operations)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.flush()
+
+
+def iter_sse(response):
+    """Yield decoded events from a text/event-stream response"""
+    data = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == '':
+            if data:
+                yield json.loads('\n'.join(data))
+            data = []
+        elif line.startswith('data:'):
+            data.append(line[5:].lstrip())
+
+
+class AsyncLightsClient:
+    """asyncio client sharing one aiohttp connection pool, with an ETag cache"""
+
+    def __init__(self, api_url=DEFAULT_API_URL, timeout=5, max_connections=100):
+        if aiohttp is None:
+            raise ImportError("AsyncLightsClient needs aiohttp: pip install aiohttp")
+        self.api_url = api_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self.cache = LightCache()
+        self._session = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=self.timeout
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_all_lights(self):
+        headers = {'If-None-Match': self.cache.all_etag} if self.cache.all_etag else {}
+        async with self._session.get(self.api_url, headers=headers) as response:
+            if response.status == 304:
+                self.cache.hits += 1
+                return self.cache.all()
+            if response.status != 200:
+                return {}
+            lights = (await response.json())['lights']
+            self.cache.misses += 1
+            self.cache.replace_all(lights, response.headers.get('ETag'))
+            return lights
+
+    async def get_light(self, light_id):
+        etag, cached = self.cache.get(light_id)
+        headers = {'If-None-Match': etag} if etag else {}
+        async with self._session.get(f"{self.api_url}/{light_id}", headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                self.cache.hits += 1
+                return cached
+            if response.status != 200:
+                return None
+            light = (await response.json())['light']
+            self.cache.misses += 1
+            self.cache.put(light, response.headers.get('ETag'))
+            return light
+
+    async def get_many(self, light_ids):
+        """Read several lights concurrently"""
+        lights = await asyncio.gather(*(self.get_light(light_id) for light_id in light_ids))
+        return dict(zip(light_ids, lights))
+
+    async def is_light_on(self, light_id):
+        light = await self.get_light(light_id)
+        return bool(light and light.get('state', False))
+
+    async def set_state(self, light_id, state):
+        async with self._session.post(f"{self.api_url}/{light_id}/toggle", json={'state': state}) as response:
+            if response.status == 200:
+                self.cache.put((await response.json())['light'])
+            return response.status == 200
+
+    async def set_states(self, states):
+        """Apply {light_id: state} with one concurrent request per light"""
+        results = await asyncio.gather(*(self.set_state(light_id, state) for light_id, state in states.items()))
+        return dict(zip(states, results))
+
+    async def set_many(self, light_ids, state):
+        """Turn several lights ON/OFF in one batch request"""
+        return await self._batch({'ids': list(light_ids), 'set': {'state': state}})
+
+    async def set_location(self, location, state):
+        """Turn every light in a location ON/OFF in one batch request"""
+        return await self._batch({'location': location, 'set': {'state': state}})
+
+    async def _batch(self, body):
+        async with self._session.post(f"{self.api_url}/batch", json=body) as response:
+            if response.status == 200:
+                for light in (await response.json())['lights'].values():
+                    self.cache.put(light)
+            return response.status == 200
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Lights Persistence
+Write-behind storage for the lights state file.
+Changes are recorded in memory and flushed by a background thread after a
+short coalescing window, so a burst of requests costs a single write and a
+request never waits on the disk. Snapshots are written atomically (temp file
++ rename), and an optional append-only journal keeps each flush O(changes)
+until it is compacted back into the snapshot. Journal entries are numbered
+and the snapshot records the last one it contains (under META_KEY), so a
+crash between writing the snapshot and truncating the journal does not
+replay older entries over it.
+"""
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+META_KEY = '_meta'  # Snapshot key holding the journal sequence and revision, not a light
+
+
+def atomic_write_json(path, data, fsync=True, indent=2):
+    """Write JSON to path through a temp file + rename so readers never see a partial file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_snapshot(path, journal_path=None):
+    """
+    Load the snapshot at path and replay the journal on top of it
+    Returns (lights, meta); meta['journal'] is the last journal entry applied
+    and meta['revision'] the highest revision saved, deletions included.
+    Raises FileNotFoundError when neither file exists.
+    """
+    data = {}
+    found = False
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f) or {}
+        found = True
+    except FileNotFoundError:
+        pass
+    meta = data.pop(META_KEY, None) or {}
+    meta.setdefault('journal', 0)
+    meta.setdefault('revision', 0)
+
+    if journal_path:
+        try:
+            with open(journal_path, 'r') as f:
+                found = True
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Torn last line after a crash, ignore the rest
+                    seq = entry.get('seq')
+                    if seq is not None:
+                        if seq <= meta['journal']:
+                            continue  # Already in the snapshot
+                        meta['journal'] = seq
+                    meta['revision'] = max(meta['revision'], entry.get('rev') or 0)
+                    if entry.get('light') is None:
+                        data.pop(entry['id'], None)
+                    else:
+                        data[entry['id']] = entry['light']
+        except FileNotFoundError:
+            pass
+
+    if not found:
+        raise FileNotFoundError(path)
+    return data, meta
+
+
+class LightsPersister:
+    """
+    Dirty-tracking, coalescing writer for the lights state
+    snapshot_fn must return a consistent copy of the whole state dict.
+    sequence is the last journal entry already on disk (load_snapshot's
+    meta['journal']).
+    timer: optional object with add(stage, seconds), given the duration of
+    every write as 'lights_journal' or 'lights_snapshot'.
+    """
+
+    def __init__(self, path, snapshot_fn, flush_delay=1.0, journal=False,
+                 compact_every=500, fsync=True, timer=None, sequence=0):
+        self.path = path
+        self.snapshot_fn = snapshot_fn
+        self.flush_delay = flush_delay
+        self.journal_path = path + '.journal' if journal else None
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.timer = timer
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._dirty = False
+        self._pending = []  # Journal entries not yet on disk
+        self._journal_entries = 0
+        self._sequence = sequence  # Number of the last journal entry recorded
+        self._stopped = False
+        self._thread = None
+
+        self.flushes = 0
+        self.skipped = 0
+        self.last_flush_duration = 0.0
+
+    def start(self):
+        """Start the background flusher and flush once more at interpreter exit"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='lights-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def record(self, light_id, light, revision=None):
+        """Record that a light changed (light=None means it was deleted) at revision"""
+        with self._lock:
+            self._dirty = True
+            if self.journal_path:
+                self._sequence += 1
+                entry = {'seq': self._sequence, 'id': light_id, 'light': light}
+                if revision is not None:
+                    entry['rev'] = revision
+                self._pending.append(entry)
+        self._wakeup.set()
+
+    def mark_dirty(self):
+        """Request a full snapshot write without a journal entry"""
+        with self._lock:
+            self._dirty = True
+            self._journal_entries = self.compact_every  # Force compaction
+        self._wakeup.set()
+
+    def flush(self):
+        """Write pending changes now, return False if there was nothing to write"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    self.skipped += 1
+                    return False
+                self._dirty = False
+                pending, self._pending = self._pending, []
+
+            start = time.perf_counter()
+            journal = self.journal_path and self._journal_entries + len(pending) < self.compact_every
+            try:
+                if journal:
+                    self._append_journal(pending)
+                else:
+                    self.compact()
+            except Exception as e:
+                print(f"Error saving lights: {e}")
+                with self._lock:
+                    self._dirty = True
+                    self._pending = pending + self._pending
+                return False
+            self.last_flush_duration = time.perf_counter() - start
+            self.flushes += 1
+            if self.timer is not None:
+                self.timer.add('lights_journal' if journal else 'lights_snapshot', self.last_flush_duration)
+            return True
+
+    def compact(self):
+        """Write a fresh snapshot and truncate the journal"""
+        with self._lock:
+            sequence = self._sequence  # Before the snapshot: replaying a newer entry it holds is harmless
+        data = self.snapshot_fn()
+        data[META_KEY] = dict(data.get(META_KEY) or {}, journal=sequence)
+        atomic_write_json(self.path, data, fsync=self.fsync)
+        if self.journal_path:
+            with open(self.journal_path, 'w'):
+                pass
+        self._journal_entries = 0
+
+    def close(self):
+        """Stop the flusher and write anything still pending"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _append_journal(self, entries):
+        with open(self.journal_path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._journal_entries += len(entries)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            if self._stopped:
+                break
+            # Coalesce: let the burst that woke us finish before writing
+            time.sleep(self.flush_delay)
+            self._wakeup.clear()
+            self.flush()
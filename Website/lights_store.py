@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Lights Store
+Repository interface for the light registry with two backends:
+  - JsonLightStore: the original lights_state.json file, kept in memory and
+    written behind by LightsPersister
+  - SqliteLightStore: an SQLite database in WAL mode with indexes on
+    location, state and last_seen
+
+Every change goes through apply(), which assigns each changed light the next
+global revision and can check expected revisions first (compare-and-swap),
+so concurrent read-modify-write cycles never silently lose an update. Only
+the SQLite backend is safe to share between several worker processes.
+Run this file directly to migrate a lights_state.json into an SQLite database:
+
+    python3 lights_store.py migrate lights_state.json lights_state.db
+"""
+
+import argparse
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from lights_persistence import META_KEY, LightsPersister, load_snapshot
+
+# Columns with their own SQL column, every other field goes to 'extra'
+LIGHT_COLUMNS = ('id', 'name', 'location', 'icon', 'state', 'rev', 'last_seen')
+
+MAX_TOMBSTONES = 1000  # Deletions remembered for changes_since()
+
+
+class RevisionConflict(Exception):
+    """A light changed between reading it and writing it back"""
+
+    def __init__(self, light_id, expected, actual):
+        super().__init__(f"Light {light_id} is at revision {actual}, expected {expected}")
+        self.light_id = light_id
+        self.expected = expected
+        self.actual = actual
+
+
+class StripedLocks:
+    """Fixed pool of locks picked by key hash, one lock per light without a lock per light"""
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def get(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class LightStore:
+    """Interface shared by all light registry backends"""
+
+    def get(self, light_id):
+        """Return a copy of the light, or None"""
+        raise NotImplementedError
+
+    def all(self):
+        """Return {light_id: light} for every light"""
+        raise NotImplementedError
+
+    def query(self, location=None, state=None):
+        """Return {light_id: light} filtered by location and/or state"""
+        raise NotImplementedError
+
+    def stale(self, older_than):
+        """Return lights whose last_seen is older than older_than seconds ago (or never seen)"""
+        raise NotImplementedError
+
+    def apply(self, changes, expected=None):
+        """
+        Apply {light_id: light or None} atomically (None deletes the light)
+        expected maps light ids to the revision they must still have (None =
+        must not exist); on mismatch nothing is written and RevisionConflict
+        is raised. Returns [(light_id, light or None, rev)] in the order applied.
+        """
+        raise NotImplementedError
+
+    def changes_since(self, revision):
+        """Return [(light_id, light or None, rev)] for every change after revision"""
+        raise NotImplementedError
+
+    def touch(self, light_id, timestamp=None):
+        """Update last_seen without creating a new revision"""
+        raise NotImplementedError
+
+    @property
+    def revision(self):
+        """Latest revision handed out by apply()"""
+        raise NotImplementedError
+
+    def __contains__(self, light_id):
+        return self.get(light_id) is not None
+
+    def __len__(self):
+        return len(self.all())
+
+    def flush(self):
+        """Make pending changes durable"""
+
+    def close(self):
+        self.flush()
+
+
+class JsonLightStore(LightStore):
+    """The lights_state.json file, held in memory and persisted write-behind"""
+
+    def __init__(self, path, flush_delay=1.0, journal=False, compact_every=500, timer=None):
+        self.path = path
+        self._lock = threading.RLock()
+        journal_path = path + '.journal' if journal else None
+        meta = {}
+        try:
+            self._lights, meta = load_snapshot(path, journal_path)
+        except FileNotFoundError:
+            self._lights = {}
+        except Exception as e:
+            print(f"Error loading lights: {e}")
+            self._lights = {}
+        for light in self._lights.values():
+            light.setdefault('rev', 0)
+        # Saved with the snapshot: the lights alone lose the revisions of deleted ones
+        self._revision = max([light['rev'] for light in self._lights.values()] + [meta.get('revision', 0)])
+        self._tombstones = []  # (light_id, rev) of recent deletions
+
+        self.persister = LightsPersister(
+            path,
+            self._persisted,
+            flush_delay=flush_delay,
+            journal=journal,
+            compact_every=compact_every,
+            timer=timer,
+            sequence=meta.get('journal', 0)
+        ).start()
+
+    def _snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._lights)
+
+    def _persisted(self):
+        with self._lock:
+            data = copy.deepcopy(self._lights)
+            data[META_KEY] = {'revision': self._revision}
+            return data
+
+    def get(self, light_id):
+        with self._lock:
+            light = self._lights.get(light_id)
+            return copy.deepcopy(light) if light is not None else None
+
+    def all(self):
+        return self._snapshot()
+
+    def query(self, location=None, state=None):
+        with self._lock:
+            return {
+                light_id: copy.deepcopy(light)
+                for light_id, light in self._lights.items()
+                if (location is None or light.get('location') == location)
+                and (state is None or bool(light.get('state')) == state)
+            }
+
+    def stale(self, older_than):
+        cutoff = time.time() - older_than
+        with self._lock:
+            return {
+                light_id: copy.deepcopy(light)
+                for light_id, light in self._lights.items()
+                if light.get('last_seen', 0) < cutoff
+            }
+
+    def apply(self, changes, expected=None):
+        applied = []
+        with self._lock:
+            for light_id, rev in (expected or {}).items():
+                current = self._lights.get(light_id)
+                actual = current['rev'] if current is not None else None
+                if actual != rev:
+                    raise RevisionConflict(light_id, rev, actual)
+
+            for light_id, light in changes.items():
+                if light is None:
+                    if light_id not in self._lights:
+                        continue
+                    del self._lights[light_id]
+                    self._revision += 1
+                    self._tombstones.append((light_id, self._revision))
+                    del self._tombstones[:-MAX_TOMBSTONES]
+                    self.persister.record(light_id, None, self._revision)
+                else:
+                    self._revision += 1
+                    light = copy.deepcopy(light)
+                    light['id'] = light_id
+                    light['rev'] = self._revision
+                    self._lights[light_id] = light
+                    self.persister.record(light_id, copy.deepcopy(light), self._revision)
+                applied.append((light_id, copy.deepcopy(light), self._revision))
+        return applied
+
+    def changes_since(self, revision):
+        with self._lock:
+            changes = [(light_id, copy.deepcopy(light), light['rev'])
+                       for light_id, light in self._lights.items() if light['rev'] > revision]
+            changes += [(light_id, None, rev) for light_id, rev in self._tombstones if rev > revision]
+        return sorted(changes, key=lambda change: change[2])
+
+    def touch(self, light_id, timestamp=None):
+        # Kept in memory only, it rides along with the next real flush
+        with self._lock:
+            if light_id in self._lights:
+                self._lights[light_id]['last_seen'] = timestamp or time.time()
+
+    @property
+    def revision(self):
+        return self._revision
+
+    def flush(self):
+        self.persister.flush()
+
+    def close(self):
+        self.persister.close()
+
+
+class SqliteLightStore(LightStore):
+    """Light registry in an SQLite database (WAL mode, one connection per thread)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS lights (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            location TEXT,
+            icon TEXT,
+            state INTEGER NOT NULL DEFAULT 0,
+            rev INTEGER NOT NULL DEFAULT 0,
+            last_seen REAL,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS lights_location ON lights(location);
+        CREATE INDEX IF NOT EXISTS lights_state ON lights(state);
+        CREATE INDEX IF NOT EXISTS lights_last_seen ON lights(last_seen);
+        CREATE INDEX IF NOT EXISTS lights_rev ON lights(rev);
+        CREATE TABLE IF NOT EXISTS deleted_lights (
+            rev INTEGER PRIMARY KEY,
+            id TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0);
+    """
+
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode, transactions are opened explicitly in apply()
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_light(row):
+        light = json.loads(row['extra']) if row['extra'] else {}
+        light.update({
+            'id': row['id'],
+            'name': row['name'],
+            'location': row['location'],
+            'icon': row['icon'],
+            'state': bool(row['state']),
+            'rev': row['rev']
+        })
+        if row['last_seen'] is not None:
+            light['last_seen'] = row['last_seen']
+        return light
+
+    def _select(self, where='', params=()):
+        rows = self._conn().execute(f'SELECT * FROM lights {where} ORDER BY rowid', params)
+        return {row['id']: self._row_to_light(row) for row in rows}
+
+    def get(self, light_id):
+        row = self._conn().execute('SELECT * FROM lights WHERE id = ?', (light_id,)).fetchone()
+        return self._row_to_light(row) if row is not None else None
+
+    def all(self):
+        return self._select()
+
+    def query(self, location=None, state=None):
+        clauses, params = [], []
+        if location is not None:
+            clauses.append('location = ?')
+            params.append(location)
+        if state is not None:
+            clauses.append('state = ?')
+            params.append(int(bool(state)))
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return self._select(where, params)
+
+    def stale(self, older_than):
+        cutoff = time.time() - older_than
+        return self._select('WHERE last_seen IS NULL OR last_seen < ?', (cutoff,))
+
+    def apply(self, changes, expected=None):
+        conn = self._conn()
+        applied = []
+        # IMMEDIATE takes the write lock up front, so the revision checks and
+        # the writes are atomic across every process sharing the database
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for light_id, rev in (expected or {}).items():
+                row = conn.execute('SELECT rev FROM lights WHERE id = ?', (light_id,)).fetchone()
+                actual = row['rev'] if row is not None else None
+                if actual != rev:
+                    raise RevisionConflict(light_id, rev, actual)
+
+            revision = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+            for light_id, light in changes.items():
+                if light is None:
+                    if conn.execute('DELETE FROM lights WHERE id = ?', (light_id,)).rowcount == 0:
+                        continue
+                    revision += 1
+                    conn.execute('INSERT INTO deleted_lights (rev, id) VALUES (?, ?)', (revision, light_id))
+                    conn.execute('DELETE FROM deleted_lights WHERE rev <= ?', (revision - MAX_TOMBSTONES,))
+                    applied.append((light_id, None, revision))
+                    continue
+                revision += 1
+                light = copy.deepcopy(light)
+                light['id'] = light_id
+                light['rev'] = revision
+                extra = {k: v for k, v in light.items() if k not in LIGHT_COLUMNS}
+                conn.execute(
+                    'INSERT OR REPLACE INTO lights (id, name, location, icon, state, rev, last_seen, extra) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (light_id, light.get('name'), light.get('location'), light.get('icon'),
+                     int(bool(light.get('state'))), revision, light.get('last_seen'),
+                     json.dumps(extra) if extra else None)
+                )
+                applied.append((light_id, light, revision))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'revision'", (revision,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return applied
+
+    def changes_since(self, revision):
+        conn = self._conn()
+        changes = [(row['id'], self._row_to_light(row), row['rev'])
+                   for row in conn.execute('SELECT * FROM lights WHERE rev > ?', (revision,))]
+        changes += [(row['id'], None, row['rev'])
+                    for row in conn.execute('SELECT * FROM deleted_lights WHERE rev > ?', (revision,))]
+        return sorted(changes, key=lambda change: change[2])
+
+    def touch(self, light_id, timestamp=None):
+        self._conn().execute('UPDATE lights SET last_seen = ? WHERE id = ?',
+                             (timestamp or time.time(), light_id))
+
+    @property
+    def revision(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM lights').fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_store(backend, json_path, sqlite_path, **json_options):
+    """Create the configured light store ('json' or 'sqlite')"""
+    if backend == 'sqlite':
+        return SqliteLightStore(sqlite_path)
+    if backend == 'json':
+        return JsonLightStore(json_path, **json_options)
+    raise ValueError(f"Unknown lights backend: {backend}")
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path):
+    """One-shot import of a lights_state.json (and its journal) into SQLite"""
+    journal_path = json_path + '.journal'
+    lights, _ = load_snapshot(json_path, journal_path if os.path.exists(journal_path) else None)
+    store = SqliteLightStore(sqlite_path)
+    existing = store.all()
+    changes = {light_id: light for light_id, light in lights.items() if light_id not in existing}
+    store.apply(changes)
+    skipped = len(lights) - len(changes)
+    store.close()
+    return len(changes), skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Light registry tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='import lights_state.json into an SQLite database')
+    migrate.add_argument('json_path')
+    migrate.add_argument('sqlite_path')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        try:
+            imported, skipped = migrate_json_to_sqlite(args.json_path, args.sqlite_path)
+        except FileNotFoundError:
+            print(f"ERROR: {args.json_path} not found")
+            raise SystemExit(1)
+        print(f"Imported {imported} lights into {args.sqlite_path} ({skipped} already present)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+Metrics
+Counters, gauges and histograms rendered in the Prometheus text format, for
+the server's /metrics endpoint. Recording a value is a dict lookup and an
+add under the metric's own lock (a bisect more for histograms), so it can
+sit on the request and detection paths. Histograms with a stage label plug
+into the timer hooks the code already has (anything calling
+timer.add(stage, seconds): the motion detector, the voice jobs, the
+persisters) through Histogram.timer(). Numbers that objects already count,
+like cache hits in their stats(), are not counted twice: a collector reads
+them when /metrics is scraped.
+
+Other processes (the motion detectors) have their own Registry and a
+MetricsPusher that writes it to PUSH_DIR (in /dev/shm) every PUSH_INTERVAL
+seconds; the server adds those files to its /metrics with a 'process' label
+and ignores files not refreshed for PUSH_STALE_AFTER seconds.
+
+Setting PROFILE_ENV (SMART_HOUSE_PROFILE=<milliseconds>) starts a sampling
+profiler in the process, which counts the stacks of every thread at that
+interval in the folded format flamegraph.pl and speedscope read: on
+/metrics/profile for the server, in the pushed file for the detectors.
+
+    python3 metrics.py            # what the detectors pushed last
+"""
+
+import bisect
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+from lights_persistence import atomic_write_json
+
+# Seconds; request and flush times, and the per-stage times of a frame
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+PUSH_DIR = "/dev/shm/smart_house_metrics"  # Where other processes leave their metrics for the server
+PUSH_INTERVAL = 10.0  # Seconds between pushes
+PUSH_STALE_AFTER = 60.0  # Pushed metrics older than this belong to a process that is gone
+
+PROFILE_ENV = "SMART_HOUSE_PROFILE"  # Sampling interval in milliseconds, unset = no profiler
+PROFILE_INTERVAL = 10.0  # Milliseconds, when the variable is set but not a number ("1" is 1 ms)
+PROFILE_DEPTH = 40  # Innermost frames kept per stack
+MAX_STACKS = 5000  # Distinct stacks counted, the rest are counted as '[other]'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def family(name, kind, help, samples):
+    """
+    A metric family as collectors return it: kind is 'counter', 'gauge' or
+    'histogram', samples are (labels dict, value) or, to write histogram
+    series, (suffix, labels dict, value)
+    """
+    return {
+        'name': name,
+        'type': kind,
+        'help': help,
+        'samples': [sample if len(sample) == 3 else ('', sample[0], sample[1]) for sample in samples],
+    }
+
+
+class _Value:
+    """One labelled series of a counter or gauge"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Buckets:
+    """One labelled series of a histogram"""
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)  # The last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.sum += value
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def cumulative(self):
+        """[(upper bound, observations <= it)], ending with +Inf, and the sum"""
+        with self._lock:
+            counts, total = list(self._counts), self.sum
+        cumulative, running = [], 0
+        for bound, count in zip(self._bounds + (math.inf,), counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative, total
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _new(self):
+        return _Value()
+
+    def labels(self, *values):
+        """The series for these label values (strings; keep it to skip the lookup on a hot path)"""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                series = self._series.setdefault(values, self._new())
+        return series
+
+    def items(self):
+        """[(label values, series)]"""
+        with self._lock:
+            return list(self._series.items())
+
+    def _samples(self, values, series):
+        return [('', dict(zip(self.labelnames, values)), series.value)]
+
+    def family(self):
+        samples = []
+        for values, series in self.items():
+            samples.extend(self._samples(values, series))
+        return family(self.name, self.kind, self.help, samples)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1.0):
+        self.labels().dec(amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def timer(self, *labels):
+        """
+        The timer interface (add(stage, seconds)) on this histogram: labels
+        are the leading label values, the stage is the last one
+        """
+        return _StageTimer(self, labels)
+
+    def _samples(self, values, series):
+        labels = dict(zip(self.labelnames, values))
+        cumulative, total = series.cumulative()
+        samples = [('_bucket', dict(labels, le=_format_value(bound)), count) for bound, count in cumulative]
+        samples.append(('_sum', labels, total))
+        samples.append(('_count', labels, cumulative[-1][1]))
+        return samples
+
+
+class _StageTimer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self._stages = {}
+
+    def add(self, stage, seconds):
+        series = self._stages.get(stage)
+        if series is None:
+            series = self._stages[stage] = self.histogram.labels(*self.labels, stage)
+        series.observe(seconds)
+
+
+class StageTimes(dict):
+    """Seconds per stage through the timer interface, for sending them elsewhere as a plain dict"""
+
+    def add(self, stage, seconds):
+        self[stage] = self.get(stage, 0.0) + seconds
+
+
+class Registry:
+    """The metrics of a process, plus collectors read at scrape time"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self.collector_errors = 0
+
+    def _get(self, cls, name, help, labels, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **options)
+            elif type(metric) is not cls or metric.labelnames != tuple(labels):
+                raise ValueError(f"{name} is already registered as a different metric")
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def collect(self, collector):
+        """Add a function returning families (see family()) when scraped; usable as a decorator"""
+        self._collectors.append(collector)
+        return collector
+
+    def families(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        families = [metric.family() for metric in metrics]
+        for collector in list(self._collectors):
+            try:
+                families.extend(collector())
+            except Exception as e:
+                self.collector_errors += 1
+                print(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+        return families
+
+    def render(self):
+        return render(self.families())
+
+
+def render(families):
+    """Families in the Prometheus text format; families of the same name are merged"""
+    merged = {}
+    for item in families:
+        existing = merged.get(item['name'])
+        if existing is None:
+            merged[item['name']] = dict(item, samples=list(item['samples']))
+        else:
+            existing['samples'].extend(item['samples'])
+    lines = []
+    for item in merged.values():
+        if not item['samples']:
+            continue
+        lines.append(f"# HELP {item['name']} {_escape(item['help'], quote=False)}")
+        lines.append(f"# TYPE {item['name']} {item['type']}")
+        for suffix, labels, value in item['samples']:
+            if labels:
+                pairs = ','.join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+                lines.append(f"{item['name']}{suffix}{{{pairs}}} {_format_value(value)}")
+            else:
+                lines.append(f"{item['name']}{suffix} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(text, quote=True):
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    value = float(value)
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+# ----- other processes -----
+
+class MetricsPusher:
+    """Writes a registry (and the profiler's stacks) to <directory>/<name>.json every interval"""
+
+    def __init__(self, registry, name, directory=PUSH_DIR, interval=PUSH_INTERVAL, profiler=None):
+        self.registry = registry
+        self.name = name
+        self.path = os.path.join(directory, f"{name}.json")
+        self.interval = interval
+        self.profiler = profiler
+        self.pushes = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'metrics-{self.name}', daemon=True)
+            self._thread.start()
+        return self
+
+    def push(self):
+        data = {
+            'process': self.name,
+            'pid': os.getpid(),
+            'time': time.time(),
+            'families': self.registry.families(),
+        }
+        if self.profiler is not None:
+            data['profile'] = self.profiler.folded()
+        try:
+            atomic_write_json(self.path, data, fsync=False, indent=None)
+            self.pushes += 1
+        except OSError as e:
+            self.errors += 1
+            if self.errors == 1:
+                print(f"  ⚠️  Warning: Could not push metrics to {self.path}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.push()
+
+    def stop(self):
+        """Stop pushing and remove the file, the process's metrics end with it"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _read_pushed(directory, stale_after):
+    now = time.time()
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    pushed = []
+    for filename in names:
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            if now - os.path.getmtime(path) > stale_after:
+                continue
+            with open(path) as f:
+                pushed.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Removed or replaced while reading
+    return pushed
+
+
+def read_pushed(directory=PUSH_DIR, stale_after=PUSH_STALE_AFTER):
+    """The families other processes pushed, each sample labelled with its process"""
+    families = []
+    for data in _read_pushed(directory, stale_after):
+        process = data['process']
+        for item in data['families']:
+            families.append(family(item['name'], item['type'], item['help'], [
+                (suffix, dict(labels, process=process), value) for suffix, labels, value in item['samples']
+            ]))
+        families.append(family('metrics_push_timestamp_seconds', 'gauge', 'When a process last pushed its metrics',
+                               [({'process': process}, data['time'])]))
+    return families
+
+
+def read_pushed_profile(process, directory=PUSH_DIR, stale_after=PUSH_STALE_AFTER):
+    """The folded stacks a process pushed, None if it does not profile"""
+    for data in _read_pushed(directory, stale_after):
+        if data['process'] == process:
+            return data.get('profile')
+    return None
+
+
+# ----- sampling profiler -----
+
+class SamplingProfiler:
+    """Counts the stacks of all threads every interval seconds, from a thread of its own"""
+
+    def __init__(self, interval=PROFILE_INTERVAL / 1000, depth=PROFILE_DEPTH, max_stacks=MAX_STACKS):
+        self.interval = interval
+        self.depth = depth
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                calls = []
+                while frame is not None and len(calls) < self.depth:
+                    code = frame.f_code
+                    calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                calls.append(names.get(ident, 'thread'))
+                stack = ';'.join(reversed(calls))
+                with self._lock:
+                    if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                        stack = '[other]'
+                    self._stacks[stack] = self._stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        """'thread;outer;...;inner count' lines, most sampled first"""
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: -item[1])
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def stats(self):
+        with self._lock:
+            stacks = len(self._stacks)
+        return {'interval_ms': self.interval * 1000, 'samples': self.samples, 'stacks': stacks}
+
+
+def profiler_from_env(environ=os.environ):
+    """A started SamplingProfiler when PROFILE_ENV is set, else None"""
+    value = environ.get(PROFILE_ENV, '').strip()
+    if not value or value.lower() in ('0', 'false', 'off', 'no'):
+        return None
+    try:
+        interval = float(value)
+    except ValueError:
+        interval = PROFILE_INTERVAL
+    print(f"Sampling profiler on, every {interval:g} ms")
+    return SamplingProfiler(interval / 1000).start()
+
+
+def main():
+    print(render(read_pushed()), end='')
+
+
+if __name__ == '__main__':
+    main()
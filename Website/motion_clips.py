@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Motion Clips
+Records a video clip around every motion event instead of only a
+timestamp, without decoding the camera a second time. ClipRecorder runs an
+ffmpeg subprocess that copies the camera's encoded video (-c copy) into
+short segment files, a ring covering the last PRE_ROLL seconds that is kept
+under /dev/shm (SEGMENT_DIR). When motion is detected the segments from
+before the event are kept, and so are the ones that follow, until POST_ROLL
+seconds after the last event; events that come while a clip is open extend
+it (up to MAX_CLIP seconds) instead of starting another. The clip is then
+the segments concatenated into an MP4, again without re-encoding. Segments
+start at the camera's keyframes, so a clip starts at the keyframe before
+its pre-roll. trigger() only queues the event, detection never waits.
+
+Every clip is <camera>_<start>.mp4 in the clips directory, with a .json
+file describing it (start, end, event times). The oldest clips are deleted
+when the directory grows beyond its quota. The Flask server lists and
+serves them (/api/motion/clips) for the camaras page.
+"""
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+DEFAULT_CLIPS_DIR = "/home/tomas/motion_clips"
+PRE_ROLL = 5.0  # Seconds recorded before the event
+POST_ROLL = 10.0  # Seconds recorded after the last event of a clip
+MAX_CLIP = 300.0  # Longest clip in seconds; later events start the next one
+SEGMENT_SECONDS = 2  # Length of the segments the stream is cut into (at the next keyframe)
+SEGMENT_DIR = "/dev/shm/motion_segments"  # Segment ring, in memory (falls back to the clips directory)
+CLIP_QUOTA = 5 * 1024 * 1024 * 1024  # Bytes, the oldest clips are deleted beyond it
+TRIGGER_DELAY = 3.0  # Seconds an event may arrive after its frame, kept on top of the pre-roll
+POLL_INTERVAL = 0.5  # Seconds between looks at the segment ring
+RESTART_BACKOFF = 1.0  # Seconds before restarting ffmpeg after the stream was lost (doubles)
+MAX_BACKOFF = 30.0
+LOG_LINES = 20  # Lines of ffmpeg's log kept for error messages
+FFMPEG = "ffmpeg"
+
+CLIP_SUFFIX = '.mp4'
+INFO_SUFFIX = '.json'
+PART_SUFFIX = '.part'
+SEGMENT_SUFFIX = '.mkv'
+
+
+def clip_name(camera, start):
+    """<camera>_<date>_<time>_<milliseconds>, so clips starting in the same second do not collide"""
+    return f"{camera}_{datetime.fromtimestamp(start).strftime('%Y%m%d_%H%M%S')}_{int(start * 1000) % 1000:03d}"
+
+
+def list_clips(directory=DEFAULT_CLIPS_DIR, camera=None, limit=None):
+    """Finished clips, newest first: their .json descriptions"""
+    clips = []
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return []
+    for entry in entries:
+        if not entry.name.endswith(INFO_SUFFIX):
+            continue
+        try:
+            with open(entry.path) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if camera is None or info.get('camera') == camera:
+            clips.append(info)
+    clips.sort(key=lambda info: info.get('start', 0), reverse=True)
+    return clips[:limit] if limit else clips
+
+
+def clip_path(directory, filename):
+    """Path of a finished clip file, None if there is no such clip"""
+    if os.path.basename(filename) != filename or not filename.endswith(CLIP_SUFFIX):
+        return None
+    path = os.path.join(directory, filename)
+    return path if os.path.isfile(path) else None
+
+
+def enforce_quota(directory, quota):
+    """Delete the oldest clips until the directory holds at most quota bytes; returns how many"""
+    clips = []
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.name.endswith(CLIP_SUFFIX):
+            stat = entry.stat()
+            clips.append((stat.st_mtime, entry.path, stat.st_size))
+            total += stat.st_size
+    clips.sort()
+    deleted = 0
+    for _, path, size in clips:
+        if total <= quota:
+            break
+        for name in (path, path[:-len(CLIP_SUFFIX)] + INFO_SUFFIX):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+        total -= size
+        deleted += 1
+    return deleted
+
+
+
+class _Segmenter:
+    """
+    ffmpeg copying a stream into <wall time>.mkv segments of about
+    SEGMENT_SECONDS. It is restarted, with backoff, when the stream ends.
+    """
+
+    def __init__(self, url, directory, camera, seconds=SEGMENT_SECONDS):
+        self.url = url
+        self.directory = directory
+        self.camera = camera
+        self.seconds = seconds
+        self.log = deque(maxlen=LOG_LINES)
+        self.restarts = 0
+        self._process = None
+        self._log_reader = None
+        self._backoff = RESTART_BACKOFF
+        self._retry_at = 0.0
+        self._started_at = 0.0
+
+    def _command(self):
+        command = [shutil.which(FFMPEG) or FFMPEG, '-hide_banner', '-nostats', '-nostdin', '-loglevel', 'error']
+        if self.url.startswith('rtsp://'):
+            command += ['-rtsp_transport', 'tcp', '-timeout', '5000000']
+        if os.path.isfile(self.url):
+            command += ['-re']  # A file is played at its own speed, like a camera
+        command += ['-i', self.url, '-map', '0:v:0', '-c', 'copy',
+                    '-f', 'segment', '-segment_time', str(self.seconds), '-segment_format', 'matroska',
+                    '-reset_timestamps', '1', '-strftime', '1',
+                    os.path.join(self.directory, '%s' + SEGMENT_SUFFIX)]
+        return command
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def check(self):
+        """Start ffmpeg, or restart it when it exited and its backoff passed"""
+        if self.running:
+            return
+        now = time.monotonic()
+        if self._process is not None:
+            self._process.wait()
+            self._log_reader.join(1)
+            code = self._process.returncode
+            reason = ' | '.join(self.log) or ('ended' if code == 0 else f'exit code {code}')
+            print(f"[{self.camera}] Clip stream lost ({reason}), restarting in {self._backoff:.0f}s")
+            self._process = None
+            self.restarts += 1
+            if now - self._started_at > MAX_BACKOFF:
+                self._backoff = RESTART_BACKOFF  # It ran for a while: not a failing start
+            self._retry_at = now + self._backoff
+            self._backoff = min(self._backoff * 2, MAX_BACKOFF)
+        if now < self._retry_at:
+            return
+        self.log.clear()
+        try:
+            self._process = subprocess.Popen(self._command(), stdin=subprocess.DEVNULL,
+                                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            self._started_at = now
+            self._log_reader = threading.Thread(target=self._read_log, args=(self._process,),
+                                                name=f'clip-ffmpeg-{self.camera}', daemon=True)
+            self._log_reader.start()
+        except OSError as e:
+            print(f"[{self.camera}] Cannot start ffmpeg: {e}")
+            self._retry_at = now + MAX_BACKOFF
+
+    def _read_log(self, process):
+        """Keep ffmpeg's error log drained, its last lines explain why it stopped"""
+        for raw in process.stderr:
+            self.log.append(raw.decode('utf-8', 'replace').strip())
+
+    def segments(self):
+        """[start, end, path, bytes] of the segments, oldest first; end is None for the one being written"""
+        segments = []
+        for entry in os.scandir(self.directory):
+            name = entry.name
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                segments.append([int(name[:-len(SEGMENT_SUFFIX)]), stat.st_mtime, entry.path, stat.st_size])
+        segments.sort()
+        if segments and self.running:
+            segments[-1][1] = None
+        return segments
+
+    def stop(self, timeout=5):
+        """Let ffmpeg close the segment it is writing"""
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.send_signal(signal.SIGINT)
+            try:
+                self._process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._log_reader.join(1)
+        self._process = None
+
+
+class _Clip:
+    """A clip waiting for its post-roll: the events it covers, from start to end"""
+
+    def __init__(self, directory, camera, label, start, end):
+        self.camera = camera
+        self.label = label
+        self.start = start
+        self.end = end
+        self.events = []
+        name = clip_name(camera, start)
+        self.name, number = name, 1
+        while os.path.exists(os.path.join(directory, self.name + CLIP_SUFFIX)):
+            number += 1
+            self.name = f"{name}_{number}"
+        self.path = os.path.join(directory, self.name + CLIP_SUFFIX)
+        self.part = self.path + PART_SUFFIX
+
+    def finish(self, segments):
+        """Concatenate the (finished) segments overlapping the clip; returns its description, None if it failed"""
+        parts = [(start, end, path) for start, end, path, _ in segments
+                 if end is not None and end > self.start and start < self.end]
+        if not parts:
+            print(f"[{self.camera}] Clip {self.name} failed: no video from the camera")
+            return None
+        listing = self.part + '.txt'
+        try:
+            with open(listing, 'w') as f:
+                for _, _, path in parts:
+                    f.write(f"file '{path}'\n")
+            result = subprocess.run(
+                [shutil.which(FFMPEG) or FFMPEG, '-hide_banner', '-loglevel', 'error', '-nostdin',
+                 '-f', 'concat', '-safe', '0', '-i', listing, '-c', 'copy',
+                 '-movflags', '+faststart', '-f', 'mp4', '-y', self.part],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+        finally:
+            os.remove(listing)
+        if result.returncode != 0:
+            print(f"[{self.camera}] Clip {self.name} failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+            try:
+                os.remove(self.part)
+            except FileNotFoundError:
+                pass
+            return None
+        os.replace(self.part, self.path)
+        info = {
+            'file': os.path.basename(self.path),
+            'camera': self.camera,
+            'label': self.label,
+            'start': round(parts[0][0], 3),
+            'end': round(parts[-1][1], 3),
+            'events': [round(t, 3) for t in self.events],
+            'bytes': os.path.getsize(self.path),
+        }
+        info_path = self.path[:-len(CLIP_SUFFIX)] + INFO_SUFFIX
+        with open(info_path + PART_SUFFIX, 'w') as f:
+            json.dump(info, f)
+        os.replace(info_path + PART_SUFFIX, info_path)
+        return info
+
+
+class ClipRecorder:
+    """
+    Pre/post-roll clips of one camera. Point it at the camera's stream with
+    capture() and call trigger() on motion; it returns at once.
+    """
+
+    def __init__(self, directory=DEFAULT_CLIPS_DIR, camera='camera', label=None, pre_roll=PRE_ROLL,
+                 post_roll=POST_ROLL, max_length=MAX_CLIP, quota=CLIP_QUOTA,
+                 segment_seconds=SEGMENT_SECONDS, segment_dir=SEGMENT_DIR):
+        if shutil.which(FFMPEG) is None:
+            raise RuntimeError("Recording clips needs ffmpeg")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.camera = camera
+        self.label = label or camera
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.max_length = max_length
+        self.quota = quota
+        self.segment_seconds = segment_seconds
+        if not (segment_dir and os.path.isdir(os.path.dirname(os.path.abspath(segment_dir)))):
+            segment_dir = os.path.join(directory, '.segments')
+        self.segment_dir = os.path.join(segment_dir, camera)
+
+        self._triggers = deque()
+        self._clip = None
+        self._pending = None  # Event that did not fit in the open clip
+        self._segmenter = None
+        self._segments = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.clips = 0
+        self.merged = 0  # Events that extended an open clip
+        self.failed = 0
+        self.evicted = 0
+        self.last_clip = None
+        self._remove_parts()
+
+    def _remove_parts(self):
+        """Clips left half-written by a crash cannot be played, nor resumed from old segments"""
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(self.camera + '_') and PART_SUFFIX in entry.name:
+                os.remove(entry.path)
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+
+    # ----- detection side -----
+
+    def capture(self, url):
+        """Record url, the camera's main stream, as it is encoded (no decoding)"""
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._segmenter = _Segmenter(url, self.segment_dir, self.camera, self.segment_seconds)
+        with self._cond:
+            self._cond.notify()
+        return self
+
+    def trigger(self, timestamp=None):
+        """Motion at timestamp (a wall time like the frames')"""
+        with self._cond:
+            self._triggers.append(time.time() if timestamp is None else timestamp)
+            self._cond.notify()
+
+    # ----- thread -----
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f'clips-{self.camera}', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        """Finish the open clip with the video recorded so far and stop"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                with self._cond:
+                    if not self._triggers:
+                        self._cond.wait(POLL_INTERVAL)
+                    triggers = sorted(self._triggers)
+                    self._triggers.clear()
+                if self._segmenter is not None:
+                    self._segmenter.check()
+                    self._segments = self._segmenter.segments()
+                for timestamp in triggers:
+                    self._on_trigger(timestamp)
+                if self._clip is not None and self._ready(self._clip):
+                    self._finish()
+                self._prune()
+        finally:
+            if self._segmenter is not None:
+                self._segmenter.stop()
+                self._segments = self._segmenter.segments()
+            if self._clip is not None:
+                self._finish(reopen=False)
+            shutil.rmtree(self.segment_dir, ignore_errors=True)
+
+    def _ready(self, clip):
+        """The segments up to the clip's end are written, or the stream stopped delivering them"""
+        if any(end is not None and end >= clip.end for _, end, _, _ in self._segments):
+            return True
+        return time.time() > clip.end + self.post_roll
+
+    def _prune(self):
+        """Delete the finished segments no clip can need any more"""
+        keep_after = time.time() - self.pre_roll - TRIGGER_DELAY
+        if self._clip is not None:
+            keep_after = min(keep_after, self._clip.start)
+        remaining = []
+        for segment in self._segments:
+            end = segment[1]
+            if end is not None and end < keep_after:
+                try:
+                    os.remove(segment[2])
+                except FileNotFoundError:
+                    pass
+            else:
+                remaining.append(segment)
+        self._segments = remaining
+
+    def _on_trigger(self, timestamp):
+        clip = self._clip
+        if clip is None:
+            self._open(timestamp)
+            return
+        limit = clip.start + self.max_length
+        clip.events.append(timestamp)
+        self.merged += 1
+        clip.end = min(max(clip.end, timestamp + self.post_roll), limit)
+        if timestamp + self.post_roll > limit:
+            self._pending = timestamp  # Continues in the next clip
+
+    def _open(self, timestamp, after=None):
+        """Start a clip for an event, from the pre-roll before it"""
+        start = timestamp - self.pre_roll
+        if after is not None:
+            start = max(start, after)
+        clip = _Clip(self.directory, self.camera, self.label, start,
+                     min(timestamp + self.post_roll, start + self.max_length))
+        clip.events.append(timestamp)
+        self._clip = clip
+
+    def _finish(self, reopen=True):
+        clip, self._clip = self._clip, None
+        try:
+            info = clip.finish(self._segments)
+        except OSError as e:
+            print(f"[{self.camera}] Clip {clip.name} failed: {e}")
+            info = None
+        if info is None:
+            self.failed += 1
+        else:
+            self.clips += 1
+            self.last_clip = info
+            self.evicted += enforce_quota(self.directory, self.quota)
+        pending, self._pending = self._pending, None
+        if reopen and pending is not None:
+            self._open(pending, after=info['end'] if info else clip.end)
+
+    def stats(self):
+        clip = self._clip
+        segments = list(self._segments)
+        segmenter = self._segmenter
+        return {
+            'recording': clip.name if clip is not None else None,
+            'streaming': segmenter.running if segmenter is not None else False,
+            'restarts': segmenter.restarts if segmenter is not None else 0,
+            'segments': len(segments),
+            'segment_bytes': sum(size for _, _, _, size in segments),
+            'clips': self.clips,
+            'merged': self.merged,
+            'failed': self.failed,
+            'evicted': self.evicted,
+            'last_clip': self.last_clip['file'] if self.last_clip else None,
+        }
@@ -1,196 +1,650 @@
+#!/usr/bin/env python3
+"""
+Motion Detection
+Watches the camera stream and raises an alert when something moves.
+MotionDetector holds the detection logic so it can be imported and driven
+by other code (benchmarks, other cameras): frames are converted to gray and
+downscaled to PROCESS_WIDTH before blurring, every frame is blurred once and
+kept for the next comparison, all intermediate images are written into
+preallocated buffers, and the moving regions are filtered with vectorized
+connected-component statistics instead of a Python loop over contours.
+Regions of interest restrict detection to parts of the picture.
+BackgroundDetector is the alternative mode (DETECTION_MODE): it compares
+each frame with a background model learned over the previous frames (a
+running average with per-pixel adaptive thresholds, or OpenCV's MOG2/KNN
+subtractors), so slow movement adds up and lighting drift is learned.
+Run this file directly to watch STREAM_URL; the stream is read by a
+FrameGrabber thread from the cheapest capture source for PROCESS_WIDTH
+(capture_source.py) and analyzed once every CAPTURE_INTERVAL, and motion
+is published as events to the Flask server (see motion_events.py) and,
+when CLIPS_DIR is set, recorded as a clip with pre- and post-roll (see
+motion_clips.py). Frame
+and stage timings and the stream figures are pushed to the server's
+/metrics (see metrics.py).
+"""
+
 import cv2
 import numpy as np
 import time
 from datetime import datetime
-import os
+
+from capture_source import choose_source
+from frame_grabber import FrameGrabber
+from frame_ring import FrameRing
+from metrics import STAGE_BUCKETS, MetricsPusher, Registry, family, profiler_from_env
+from motion_clips import ClipRecorder
+from motion_events import DEFAULT_EVENTS_URL, MotionPublisher, motion_event
 
 # Configuration
 STREAM_URL = "rtsp://192.168.1.143:8554/mystream"
 # MediaMTX converts WebRTC to RTSP automatically on port 8554
 
-MAX_IMAGES = 10  # Maximum number of images to keep in list
-CAPTURE_INTERVAL = 1.0  # Seconds between captures
-
-# Alert file for website notifications
-ALERT_FILE = "/var/www/html/motion_alert.txt"
-
-# Initialize video capture using FFmpeg
-print(f"Connecting to stream: {STREAM_URL}")
-
-# Use FFmpeg environment variable for better RTSP support
-os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp|timeout;5000000"
-
-cap = cv2.VideoCapture(STREAM_URL, cv2.CAP_FFMPEG)
+# How frames are read (see capture_source.py): the cheapest source for PROCESS_WIDTH
+CAPTURE_SOURCE = None  # None = cheapest, or 'substream', 'ffmpeg' (scaled gray), 'opencv' (full decode)
+SUBSTREAM_URL = None  # The camera's low-resolution stream, if it has one
+SUBSTREAM_WIDTH = None  # Its width, when known (not used when narrower than PROCESS_WIDTH)
+STREAM_WIDTH = None  # The main stream's width, keeps sub-stream detections in its pixels
+KEYFRAME_INTERVAL = None  # Seconds between the camera's keyframes; keyframes only are decoded when <= CAPTURE_INTERVAL
 
-if not cap.isOpened():
-    print("ERROR: Cannot open video stream")
-    print("Make sure:")
-    print("  1. Stream is active (check in VLC)")
-    print("  2. FFmpeg is installed: sudo apt install ffmpeg")
-    print("  3. URL is correct:", STREAM_URL)
-    exit(1)
-
-print("Stream opened successfully!")
-print(f"Capturing {MAX_IMAGES} images with {CAPTURE_INTERVAL}s interval")
-print("Images will be stored in RAM only (no disk writes)\n")
+MAX_IMAGES = 10  # Gray frames kept in the frame ring
+FRAME_RING_NAME = "motion_frames"  # Shared under /dev/shm for other processes (None = private)
+CAPTURE_INTERVAL = 1.0  # Seconds between captures
+READ_TIMEOUT = 5.0  # Seconds to wait for a frame before warning
+STATS_EVERY = 60  # Print stream statistics every this many captures
 
-# List to store images in RAM
-images = []
+# Motion events are published to the Flask server, which pushes them to the web pages
+CAMERA_NAME = "camera"  # Camera name in the events
+CAMERA_LABEL = "Cámara Principal"
+EVENTS_URL = DEFAULT_EVENTS_URL  # None = do not publish
 
-last_capture_time = time.time()
-frame_count = 0
+# Clips from a few seconds before to a few seconds after motion (see motion_clips.py)
+CLIPS_DIR = None  # Where clips are recorded, e.g. "/home/tomas/motion_clips" (None = do not record)
 
-while True:
-    # Read frame from stream
-    ret, frame = cap.read()
+# Frame and stage timings for the server's /metrics, pushed under this process name (None = off)
+METRICS_NAME = "motion_detection"
 
-    if not ret or frame is None or frame.size == 0:
-        print("Warning: Cannot read frame or corrupted frame. Reconnecting...")
-        time.sleep(2)
-        cap.release()
-        cap = cv2.VideoCapture(STREAM_URL, cv2.CAP_FFMPEG)
-        continue
+# Timestamp file for scripts that still read it (the web pages use the events)
+ALERT_FILE = "/var/www/html/motion_alert.txt"
 
-    current_time = time.time()
-
-    # Capture frame at intervals
-    if current_time - last_capture_time >= CAPTURE_INTERVAL:
-        # Convert to grayscale (black and white) for efficiency
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # Add grayscale frame to list
-        images.append(gray_frame.copy())  # .copy() to ensure independent copy
-        frame_count += 1
-
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}] Captured image {frame_count} | List size: {len(images)}")
-
-        # Keep only last MAX_IMAGES frames
-        if len(images) > MAX_IMAGES:
-            images.pop(0)  # Remove oldest image
-            print(f"  → Removed oldest image (keeping last {MAX_IMAGES})")
-
-        # MOTION DETECTION - Robust localized movement detection
-        if len(images) >= 2:
-            # Get last two frames
-            previous_frame = images[-2]
-            current_frame = images[-1]
-
-            # Apply stronger Gaussian blur to reduce camera noise
-            prev_blur = cv2.GaussianBlur(previous_frame, (21, 21), 0)
-            curr_blur = cv2.GaussianBlur(current_frame, (21, 21), 0)
-
-            # Calculate absolute difference
-            diff = cv2.absdiff(prev_blur, curr_blur)
-
-            # Use higher threshold to ignore subtle changes
-            threshold_value = 50  # Increased from 30 (higher = less sensitive)
-            _, thresh = cv2.threshold(diff, threshold_value, 255, cv2.THRESH_BINARY)
-
-            # Aggressive noise reduction
-            # Erosion removes small specks
-            kernel_erode = np.ones((5,5), np.uint8)  # Larger kernel
-            thresh = cv2.erode(thresh, kernel_erode, iterations=2)  # More iterations
-
-            # Dilation connects nearby regions
-            kernel_dilate = np.ones((7,7), np.uint8)
-            thresh = cv2.dilate(thresh, kernel_dilate, iterations=2)
-
-            # Find contours (connected regions of motion)
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            # Much stricter filtering
-            MIN_CONTOUR_AREA = 2000  # Increased from 500 - ignore small objects
-            MAX_CONTOUR_AREA = 50000  # Ignore if object is too large (likely noise/lighting)
-            MIN_ASPECT_RATIO = 0.3  # Width/height ratio (filters out thin lines)
-            MAX_ASPECT_RATIO = 3.0  # Filters out very wide/tall shapes
-
-            significant_contours = []
-            for contour in contours:
-                area = cv2.contourArea(contour)
-
-                if area < MIN_CONTOUR_AREA or area > MAX_CONTOUR_AREA:
-                    continue
-
-                # Check aspect ratio (real objects have reasonable proportions)
-                x, y, w, h = cv2.boundingRect(contour)
-                aspect_ratio = float(w) / h if h > 0 else 0
-
-                if aspect_ratio < MIN_ASPECT_RATIO or aspect_ratio > MAX_ASPECT_RATIO:
-                    continue
-
-                # Check if contour is solid enough (not just edges)
-                perimeter = cv2.arcLength(contour, True)
-                if perimeter > 0:
-                    circularity = 4 * np.pi * area / (perimeter * perimeter)
-                    if circularity < 0.1:  # Too irregular = noise
-                        continue
-
-                significant_contours.append(contour)
-
-            # Calculate total motion area
-            total_motion_area = sum(cv2.contourArea(c) for c in significant_contours)
-
-            # Strict motion detection
-            motion_detected = False
-
-            # Require:
-            # 1. At least 1 significant object
-            # 2. Not too many objects (camera shake)
-            # 3. Substantial total area
-            # 4. Objects not too close to edges (often false positives)
-
-            if 1 <= len(significant_contours) <= 5:  # Between 1-5 objects
-                if total_motion_area > 3000:  # Substantial area
-
-                    # Check if objects are in central area (not edges)
-                    height, width = current_frame.shape
-                    edge_margin = 30  # pixels from edge
-
-                    valid_objects = []
-                    for contour in significant_contours:
-                        x, y, w, h = cv2.boundingRect(contour)
-                        # Check if not too close to edges
-                        if (x > edge_margin and
-                            y > edge_margin and
-                            x + w < width - edge_margin and
-                            y + h < height - edge_margin):
-                            valid_objects.append((x, y, w, h))
-
-                    if len(valid_objects) > 0:
-                        motion_detected = True
-
-                        print(f"  🚨 MOTION! {len(valid_objects)} object(s) detected")
-                        print(f"     Total area: {total_motion_area} pixels")
-                        for i, (x, y, w, h) in enumerate(valid_objects[:3]):
-                            print(f"     Object {i+1}: position ({x},{y}), size {w}x{h}")
-
-                        try:
-                            with open(ALERT_FILE, "w") as f:
-                                f.write(f"{time.time()}\n")
-                                print(f"     ✓ Alert written to {ALERT_FILE}")
-                        except Exception as e:
-                            print(f"     ⚠️  Warning: Could not write alert file: {e}")
-                        # YOUR CUSTOM ACTIONS HERE:
-                        # - Save frame: cv2.imwrite(f"/tmp/motion_{timestamp}.jpg", current_frame)
-                        # - Send notification via API
-                        # - Trigger external alarm
-                        # - Run AI analysis
-                        # - etc.
-                    else:
-                        print(f"  ⚠️  Edge motion ignored ({len(significant_contours)} objects)")
+# Detection settings, sizes and areas in pixels of the full-resolution frame
+PROCESS_WIDTH = 640  # Frames are downscaled to this width before analysis (None = full size)
+BLUR_SIZE = 21  # Gaussian blur kernel to reduce camera noise
+THRESHOLD = 50  # Pixel difference that counts as change (higher = less sensitive)
+ERODE_SIZE = 5  # Erosion removes small specks
+DILATE_SIZE = 7  # Dilation connects nearby regions
+MORPH_ITERATIONS = 2
+MIN_OBJECT_AREA = 2000  # Ignore small objects
+MAX_OBJECT_AREA = 50000  # Ignore if object is too large (likely noise/lighting)
+MIN_ASPECT_RATIO = 0.3  # Width/height ratio (filters out thin lines)
+MAX_ASPECT_RATIO = 3.0  # Filters out very wide/tall shapes
+MIN_FILL_RATIO = 0.2  # Share of its bounding box an object covers (too irregular = noise)
+MAX_OBJECTS = 5  # More objects than this is camera shake
+MIN_TOTAL_AREA = 3000  # Total moving area needed for an alert
+EDGE_MARGIN = 30  # Objects touching this border are often false positives
+
+# Detection mode: 'diff' compares each frame with the previous one, 'average',
+# 'mog2' and 'knn' compare it with a background model (BackgroundDetector)
+DETECTION_MODE = 'diff'
+BACKGROUND_ALPHA = 0.05  # How fast the running average learns (share of each new frame)
+SENSITIVITY = 3.0  # 'average': a pixel changes when it is this many standard deviations off
+MIN_THRESHOLD = 15  # 'average': pixel difference that never counts as change, however still the pixel
+BACKGROUND_HISTORY = 100  # 'mog2' / 'knn': frames the model remembers
+MOG2_VAR_THRESHOLD = 16  # 'mog2': squared distance (in standard deviations) for foreground
+KNN_DIST2_THRESHOLD = 400  # 'knn': squared distance to the nearest samples for foreground
+BACKGROUND_WARMUP = 3  # Frames learned before the model reports anything
+MAX_FOREGROUND = 0.4  # Share of the picture changing at once that counts as a lighting change
+
+
+def _odd(size):
+    """Kernel size rounded to the nearest odd number, at least 1"""
+    size = max(1, int(round(size)))
+    return size if size % 2 else size + 1
+
+
+class MotionResult:
+    """Outcome of one comparison; boxes are (x, y, w, h) in full-resolution pixels"""
+
+    def __init__(self, motion=False, reason='no_motion', objects=(), edge_objects=(), total_area=0):
+        self.motion = motion
+        # 'motion', 'edge', 'too_many', 'no_motion', 'first_frame', 'learning' or 'lighting'
+        self.reason = reason
+        self.objects = list(objects)
+        self.edge_objects = list(edge_objects)
+        self.total_area = total_area
+
+    def __bool__(self):
+        return self.motion
+
+    def to_dict(self):
+        return {
+            'motion': self.motion,
+            'reason': self.reason,
+            'objects': [list(box) for box in self.objects],
+            'total_area': self.total_area,
+        }
+
+
+class MotionDetector:
+    """
+    Compares each frame with the previous one.
+    regions: optional list of areas to watch, each a rectangle (x, y, w, h)
+    or a polygon [(x, y), ...] in full-resolution pixels; mask: optional
+    uint8 image of the frame size, non-zero where motion counts. Everything
+    outside them is ignored. timer: optional object with add(stage, seconds)
+    (e.g. voice_pipeline.StageTimer, metrics.Histogram.timer()) charged
+    with the time of every stage: gray, blur, diff (the background model in
+    BackgroundDetector), morphology and contours. source_width: width of the camera picture when
+    frames arrive already scaled down (a sub-stream, FFmpeg scaling), so
+    sizes, regions and boxes stay in the full picture's pixels.
+    """
+
+    def __init__(self, process_width=PROCESS_WIDTH, blur_size=BLUR_SIZE, threshold=THRESHOLD,
+                 erode_size=ERODE_SIZE, dilate_size=DILATE_SIZE, iterations=MORPH_ITERATIONS,
+                 min_area=MIN_OBJECT_AREA, max_area=MAX_OBJECT_AREA,
+                 min_aspect=MIN_ASPECT_RATIO, max_aspect=MAX_ASPECT_RATIO,
+                 min_fill=MIN_FILL_RATIO, max_objects=MAX_OBJECTS, min_total_area=MIN_TOTAL_AREA,
+                 edge_margin=EDGE_MARGIN, regions=None, mask=None, timer=None, source_width=None):
+        self.process_width = process_width
+        self.blur_size = blur_size
+        self.threshold = threshold
+        self.erode_size = erode_size
+        self.dilate_size = dilate_size
+        self.iterations = iterations
+        self.min_area = min_area
+        self.max_area = max_area
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.min_fill = min_fill
+        self.max_objects = max_objects
+        self.min_total_area = min_total_area
+        self.edge_margin = edge_margin
+        self.regions = regions
+        self.mask = mask
+        self.timer = timer
+        self.source_width = source_width
+        self.frame_shape = None  # (height, width) the buffers were made for
+        self.gray = None
+
+    # ----- buffers -----
+
+    def _allocate(self, height, width):
+        """Buffers and kernels for frames of this size, made once"""
+        self.frame_shape = (height, width)
+        if self.process_width and width > self.process_width:
+            self.scale = self.process_width / width
+        else:
+            self.scale = 1.0
+        self.size = (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale))))
+        small_shape = (self.size[1], self.size[0])
+        # Analyzed pixels per full-picture pixel, including any scaling before the frame got here
+        self.full_scale = self.scale
+        if self.source_width and self.source_width > width:
+            self.full_scale = self.scale * width / self.source_width
+
+        self._gray = np.empty((height, width), np.uint8)
+        self._small = np.empty(small_shape, np.uint8) if self.scale != 1.0 else None
+        self._blurred = [np.empty(small_shape, np.uint8), np.empty(small_shape, np.uint8)]
+        self._current = 0
+        self._has_previous = False
+        self._diff = np.empty(small_shape, np.uint8)
+        self._eroded = np.empty(small_shape, np.uint8)
+        self._dilated = np.empty(small_shape, np.uint8)
+
+        # Kernels and limits scaled down with the frame so sensitivity stays the same
+        blur = _odd(self.blur_size * self.full_scale)
+        self._blur_kernel = (blur, blur)
+        self._erode_kernel = np.ones((_odd(self.erode_size * self.full_scale),) * 2, np.uint8)
+        self._dilate_kernel = np.ones((_odd(self.dilate_size * self.full_scale),) * 2, np.uint8)
+        area_scale = self.full_scale * self.full_scale
+        self._min_area = self.min_area * area_scale
+        self._max_area = self.max_area * area_scale
+        self._min_total_area = self.min_total_area * area_scale
+        self._edge_margin = self.edge_margin * self.full_scale
+        self._mask = self._build_mask(height, width)
+
+    def _build_mask(self, height, width):
+        if self.mask is None and not self.regions:
+            return None
+        if self.mask is not None:
+            full = np.where(self.mask > 0, 255, 0).astype(np.uint8)
+        else:
+            full_width = max(width, self.source_width or 0)
+            full = np.zeros((int(round(height * full_width / width)), full_width), np.uint8)
+        for region in self.regions or ():
+            if len(region) == 4 and np.isscalar(region[0]):
+                x, y, w, h = region
+                full[int(y):int(y + h), int(x):int(x + w)] = 255
             else:
-                if len(significant_contours) > 5:
-                    print(f"  ⚠️  Too many objects ({len(significant_contours)}) - likely noise")
-                else:
-                    print(f"  ✓ No motion")
-
-        last_capture_time = current_time
-
-    # Small delay to reduce CPU usage
-    time.sleep(0.01)
-
-# Cleanup (this won't run unless you Ctrl+C, but good practice)
-cap.release()
-print("\nCapture stopped.")
-print(f"Final list contains {len(images)} images")
+                cv2.fillPoly(full, [np.asarray(region, np.int32)], 255)
+        if full.shape[::-1] == self.size:
+            return full
+        return cv2.resize(full, self.size, interpolation=cv2.INTER_NEAREST)
+
+    def set_source_width(self, width):
+        """The camera picture's width changed (the source was switched); buffers are made again"""
+        if width != self.source_width:
+            self.source_width = width
+            self.frame_shape = None
+
+    def set_regions(self, regions=None, mask=None):
+        """Change the watched areas; takes effect on the next frame"""
+        self.regions = regions
+        self.mask = mask
+        if self.frame_shape is not None:
+            self._mask = self._build_mask(*self.frame_shape)
+
+    def reset(self):
+        """Forget the previous frame, e.g. after the stream reconnected"""
+        self._has_previous = False
+
+    # ----- detection -----
+
+    def _clock(self):
+        return time.perf_counter() if self.timer is not None else None
+
+    def _lap(self, stage, start):
+        """Charge the time since start to a stage of the timer; returns the new start"""
+        if start is None:
+            return None
+        now = time.perf_counter()
+        self.timer.add(stage, now - start)
+        return now
+
+    def prepare(self, frame, gray=None):
+        """
+        Gray, downscale and blur a frame into the current slot; returns the
+        blurred image. gray: optional (H, W) uint8 array to write the
+        full-resolution gray frame into, e.g. a FrameRing slot.
+        """
+        start = self._clock()
+        height, width = frame.shape[:2]
+        if self.frame_shape != (height, width):
+            self._allocate(height, width)
+        if frame.ndim == 2:
+            if gray is not None:
+                np.copyto(gray, frame)
+            else:
+                gray = frame  # Already gray (e.g. the Y plane of the stream)
+        else:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray if gray is None else gray)
+        self.gray = gray  # Full-resolution gray frame, overwritten by the next one
+        if self._small is not None:
+            gray = cv2.resize(gray, self.size, dst=self._small, interpolation=cv2.INTER_AREA)
+        start = self._lap('gray', start)
+        blurred = self._blurred[self._current]
+        cv2.GaussianBlur(gray, self._blur_kernel, 0, dst=blurred)
+        self._lap('blur', start)
+        return blurred
+
+    def detect(self, frame, gray=None):
+        """Compare frame with the previous one passed in; returns a MotionResult"""
+        current = self.prepare(frame, gray)
+        previous = self._blurred[1 - self._current]
+        had_previous = self._has_previous
+        self._current = 1 - self._current  # current becomes the previous frame
+        self._has_previous = True
+        if not had_previous:
+            return MotionResult(reason='first_frame')
+        return self.compare(previous, current)
+
+    def compare(self, previous, current):
+        """Motion between two prepared (blurred) images"""
+        start = self._clock()
+        cv2.absdiff(previous, current, dst=self._diff)
+        cv2.threshold(self._diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self._diff)
+        self._lap('diff', start)
+        return self.find_objects(self._diff)
+
+    def find_objects(self, changed):
+        """Mask, clean up and analyze a binary image of the changed pixels (modified in place)"""
+        start = self._clock()
+        if self._mask is not None:
+            cv2.bitwise_and(changed, self._mask, dst=changed)
+        cv2.erode(changed, self._erode_kernel, dst=self._eroded, iterations=self.iterations)
+        cv2.dilate(self._eroded, self._dilate_kernel, dst=self._dilated, iterations=self.iterations)
+        start = self._lap('morphology', start)
+        result = self.analyze(self._dilated)
+        self._lap('contours', start)
+        return result
+
+    def analyze(self, binary):
+        """Filter the connected regions of a binary motion image"""
+        count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        stats = stats[1:]  # Label 0 is the background
+        if not len(stats):
+            return MotionResult()
+
+        x, y, w, h, area = stats.T
+        aspect = w / h
+        keep = ((area >= self._min_area) & (area <= self._max_area) &
+                (aspect >= self.min_aspect) & (aspect <= self.max_aspect) &
+                (area >= self.min_fill * w * h))
+        objects = stats[keep]
+        if not len(objects):
+            return MotionResult()
+
+        total_area = int(objects[:, 4].sum())
+        full_area = int(round(total_area / (self.full_scale * self.full_scale)))
+        if len(objects) > self.max_objects:
+            return MotionResult(reason='too_many', objects=self._boxes(objects), total_area=full_area)
+        if total_area <= self._min_total_area:
+            return MotionResult(total_area=full_area)
+
+        height, width = binary.shape
+        margin = self._edge_margin
+        x, y, w, h = objects[:, 0], objects[:, 1], objects[:, 2], objects[:, 3]
+        inside = (x > margin) & (y > margin) & (x + w < width - margin) & (y + h < height - margin)
+        central = self._boxes(objects[inside])
+        edge = self._boxes(objects[~inside])
+        if not central:
+            return MotionResult(reason='edge', edge_objects=edge, total_area=full_area)
+        return MotionResult(True, 'motion', central, edge, full_area)
+
+    def _boxes(self, stats):
+        """Component boxes back in full-resolution coordinates"""
+        if not len(stats):
+            return []
+        boxes = np.rint(stats[:, :4] / self.full_scale).astype(int)
+        return [tuple(box) for box in boxes.tolist()]
+
+
+class BackgroundDetector(MotionDetector):
+    """
+    Compares each frame with a background model instead of the previous frame.
+    mode: 'average' keeps a running average and variance of every pixel
+    (cv2.accumulateWeighted) and flags pixels more than `sensitivity`
+    standard deviations off, after removing the global brightness shift;
+    'mog2' and 'knn' use OpenCV's background subtractors (shadows ignored).
+    When more than max_foreground of the picture changes at once the result
+    is 'lighting' and the model is reseeded. Other settings as MotionDetector.
+    """
+
+    MODES = ('average', 'mog2', 'knn')
+
+    def __init__(self, mode='average', alpha=BACKGROUND_ALPHA, sensitivity=SENSITIVITY,
+                 min_threshold=MIN_THRESHOLD, history=BACKGROUND_HISTORY,
+                 var_threshold=MOG2_VAR_THRESHOLD, dist2_threshold=KNN_DIST2_THRESHOLD,
+                 warmup=BACKGROUND_WARMUP, max_foreground=MAX_FOREGROUND, **settings):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown background mode {mode!r}, expected one of {self.MODES}")
+        super().__init__(**settings)
+        self.mode = mode
+        self.alpha = alpha
+        self.sensitivity = sensitivity
+        self.min_threshold = min_threshold
+        self.history = history
+        self.var_threshold = var_threshold
+        self.dist2_threshold = dist2_threshold
+        self.warmup = warmup
+        self.max_foreground = max_foreground
+        self._model = None
+        self._learned = 0
+
+    def _allocate(self, height, width):
+        super()._allocate(height, width)
+        small_shape = (self.size[1], self.size[0])
+        if self.mode == 'average':
+            self._frame = np.empty(small_shape, np.float32)
+            self._background = np.empty(small_shape, np.float32)
+            self._variance = np.empty(small_shape, np.float32)
+            self._delta = np.empty(small_shape, np.float32)
+            self._square = np.empty(small_shape, np.float32)
+            self._limit = np.empty(small_shape, np.float32)
+        self.reset()
+
+    def reset(self):
+        """Forget the background, e.g. after the stream reconnected"""
+        self._model = None
+        self._learned = 0
+
+    def _new_model(self, current):
+        if self.mode == 'mog2':
+            return cv2.createBackgroundSubtractorMOG2(self.history, self.var_threshold, detectShadows=True)
+        if self.mode == 'knn':
+            return cv2.createBackgroundSubtractorKNN(self.history, self.dist2_threshold, detectShadows=True)
+        np.copyto(self._background, current)
+        self._variance[:] = self.min_threshold ** 2 / 4  # Noise is learned from here
+        return 'average'
+
+    def detect(self, frame, gray=None):
+        """Compare frame with the background and learn it; returns a MotionResult"""
+        current = self.prepare(frame, gray)
+        if self._model is None:
+            self._model = self._new_model(current)
+            if self.mode == 'average':
+                self._learned = 1
+                return MotionResult(reason='first_frame')
+
+        start = self._clock()
+        if self.mode == 'average':
+            self._subtract_average(current)
+        else:
+            self._model.apply(current, self._diff)
+            # Shadows are marked 127, only keep real foreground (255)
+            cv2.threshold(self._diff, 200, 255, cv2.THRESH_BINARY, dst=self._diff)
+        self._learned += 1
+        lighting = cv2.countNonZero(self._diff) > self.max_foreground * self._diff.size
+        self._lap('diff', start)
+        if self._learned <= self.warmup:
+            return MotionResult(reason='learning')
+        if lighting:
+            if self.mode == 'average':
+                np.copyto(self._background, current)  # Start over from the new lighting
+            return MotionResult(reason='lighting')
+        return self.find_objects(self._diff)
+
+    def _subtract_average(self, current):
+        """Flag pixels far from the running average, then learn the frame"""
+        np.copyto(self._frame, current)
+        cv2.subtract(self._frame, self._background, dst=self._delta)
+        # A global brightness change (auto exposure, clouds) moves every pixel alike
+        shift = cv2.mean(self._delta, self._mask)[0]
+        cv2.subtract(self._delta, shift, dst=self._delta)
+        cv2.multiply(self._delta, self._delta, dst=self._square)
+        cv2.multiply(self._variance, self.sensitivity ** 2, dst=self._limit)
+        cv2.max(self._limit, float(self.min_threshold ** 2), dst=self._limit)
+        cv2.compare(self._square, self._limit, cv2.CMP_GT, dst=self._diff)
+        # Noise is learned from the background only, the picture from everything
+        cv2.bitwise_not(self._diff, dst=self._dilated)
+        cv2.accumulateWeighted(self._square, self._variance, self.alpha, mask=self._dilated)
+        cv2.accumulateWeighted(self._frame, self._background, self.alpha)
+
+
+def create_detector(mode=DETECTION_MODE, **settings):
+    """A MotionDetector ('diff') or a BackgroundDetector for the other modes"""
+    if mode == 'diff':
+        return MotionDetector(**settings)
+    return BackgroundDetector(mode, **settings)
+
+
+def frame_ring_for(ring, shape, name=None, capacity=MAX_IMAGES):
+    """The ring to keep frames of this shape in, made again when the resolution changes"""
+    if ring is not None:
+        if (ring.height, ring.width) == tuple(shape):
+            return ring
+        ring.close()
+    if name:
+        try:
+            return FrameRing.create_shared(name, capacity, *shape)
+        except OSError as e:
+            print(f"  ⚠️  Warning: Could not share frames as {name}: {e}")
+    return FrameRing(capacity, *shape)
+
+
+class DetectorMetrics:
+    """
+    The detector's metrics, labelled by camera (motion_supervisor.py exports
+    the same ones): frame and stage timings, frames with motion, and the
+    figures of each camera's grabber, read when the registry is collected.
+    The analyzed frame rate is the rate of motion_frame_seconds_count.
+    """
+
+    def __init__(self, registry):
+        self.frames = registry.histogram(
+            'motion_frame_seconds', 'Time to analyze a frame', ('camera',), buckets=STAGE_BUCKETS
+        )
+        self.stages = registry.histogram(
+            'motion_stage_seconds', 'Time per detection stage of a frame', ('camera', 'stage'), buckets=STAGE_BUCKETS
+        )
+        self.motion = registry.counter('motion_detections_total', 'Analyzed frames with motion', ('camera',))
+        self._grabbers = {}
+        registry.collect(self._collect)
+
+    def watch(self, camera, get_grabber):
+        """Export the stream figures of get_grabber(), the camera's current grabber"""
+        self._grabbers[camera] = get_grabber
+
+    def _collect(self):
+        streams = {}
+        for camera, get_grabber in list(self._grabbers.items()):
+            grabber = get_grabber()
+            if grabber is not None:
+                streams[camera] = grabber.stats()
+
+        def samples(key):
+            return [({'camera': camera}, stats[key]) for camera, stats in streams.items()]
+
+        return [
+            family('motion_decode_fps', 'gauge', 'Frames per second decoded from the stream', samples('decode_fps')),
+            family('motion_frames_skipped_total', 'counter', 'Frames decoded but never analyzed', samples('skipped')),
+            family('motion_frame_latency_seconds', 'gauge', 'Time from decoding a frame to the end of its analysis',
+                   samples('latency')),
+            family('motion_stream_reconnects_total', 'counter', 'Reconnections to the stream', samples('reconnects')),
+        ]
+
+
+def write_alert(path=ALERT_FILE):
+    try:
+        with open(path, "w") as f:
+            f.write(f"{time.time()}\n")
+            print(f"     ✓ Alert written to {path}")
+    except Exception as e:
+        print(f"     ⚠️  Warning: Could not write alert file: {e}")
+
+
+def report(result):
+    if result.motion:
+        print(f"  🚨 MOTION! {len(result.objects)} object(s) detected")
+        print(f"     Total area: {result.total_area} pixels")
+        for i, (x, y, w, h) in enumerate(result.objects[:3]):
+            print(f"     Object {i+1}: position ({x},{y}), size {w}x{h}")
+    elif result.reason == 'edge':
+        print(f"  ⚠️  Edge motion ignored ({len(result.edge_objects)} objects)")
+    elif result.reason == 'too_many':
+        print(f"  ⚠️  Too many objects ({len(result.objects)}) - likely noise")
+    elif result.reason == 'lighting':
+        print("  ⚠️  Lighting change ignored")
+    elif result.reason == 'no_motion':
+        print(f"  ✓ No motion")
+
+
+def main():
+    source = choose_source(STREAM_URL, PROCESS_WIDTH, CAPTURE_INTERVAL, SUBSTREAM_URL, SUBSTREAM_WIDTH,
+                           KEYFRAME_INTERVAL, STREAM_WIDTH, CAPTURE_SOURCE)
+    print(f"Connecting to stream: {source.describe()}")
+    grabber = FrameGrabber(source.url, open_capture=source.open, name='camera').start()
+
+    print(f"Capturing {MAX_IMAGES} images with {CAPTURE_INTERVAL}s interval")
+    print("Images will be stored in RAM only (no disk writes)\n")
+
+    registry = Registry()
+    detector_metrics = DetectorMetrics(registry)
+    detector_metrics.watch(CAMERA_NAME, lambda: grabber)
+    frame_seconds = detector_metrics.frames.labels(CAMERA_NAME)
+    pusher = None
+    if METRICS_NAME:
+        try:
+            pusher = MetricsPusher(registry, METRICS_NAME, profiler=profiler_from_env()).start()
+        except OSError as e:
+            print(f"  ⚠️  Warning: Metrics are not pushed: {e}")
+
+    detector = create_detector(DETECTION_MODE, timer=detector_metrics.stages.timer(CAMERA_NAME))
+    publisher = MotionPublisher(EVENTS_URL).start() if EVENTS_URL else None
+    recorder = None
+    if CLIPS_DIR:
+        try:
+            # The main stream as the camera encodes it, whatever source the detector reads
+            recorder = ClipRecorder(CLIPS_DIR, CAMERA_NAME, CAMERA_LABEL).start().capture(STREAM_URL)
+        except (OSError, RuntimeError) as e:
+            print(f"  ⚠️  Warning: Clips are not recorded: {e}")
+
+    # The last MAX_IMAGES gray frames, written in place by the detector
+    images = None
+
+    frame_count = 0
+    reconnects = 0
+    warned = False
+    next_capture = time.monotonic()
+
+    try:
+        while True:
+            # Wait for the next capture, the grabber keeps the stream drained meanwhile
+            delay = next_capture - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_capture = max(next_capture + CAPTURE_INTERVAL, time.monotonic())
+
+            frame = grabber.read(timeout=READ_TIMEOUT)
+            if frame is None:
+                print(f"Warning: No frame from stream ({grabber.state})")
+                if not warned:
+                    print("Make sure:")
+                    print("  1. Stream is active (check in VLC)")
+                    print("  2. FFmpeg is installed: sudo apt install ffmpeg")
+                    print("  3. URL is correct:", source.url)
+                    warned = True
+                continue
+            if grabber.reconnects != reconnects:
+                reconnects = grabber.reconnects
+                detector.reset()  # Do not compare across a reconnect
+            detector.set_source_width(frame.source_width)
+
+            images = frame_ring_for(images, frame.image.shape[:2], FRAME_RING_NAME)
+            start = time.perf_counter()
+            result = detector.detect(frame.image, gray=images.next_slot())
+            frame_seconds.observe(time.perf_counter() - start)
+            images.commit(frame.wall_time)
+            grabber.done(frame)
+            frame_count += 1
+
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"[{timestamp}] Captured image {frame_count} | Frames kept: {len(images)}")
+
+            report(result)
+            if result.motion:
+                detector_metrics.motion.labels(CAMERA_NAME).inc()
+                if publisher is not None:
+                    # The frame's thumbnail is stored with the event in the server's history
+                    publisher.publish(motion_event(CAMERA_NAME, result, frame.wall_time, CAMERA_LABEL), frame.image)
+                if recorder is not None:
+                    recorder.trigger(frame.wall_time)
+                write_alert()
+                # YOUR CUSTOM ACTIONS HERE:
+                # - Send notification via API
+                # - Trigger external alarm
+                # - Run AI analysis
+                # - etc.
+
+            if frame_count % STATS_EVERY == 0:
+                stats = grabber.stats()
+                print(f"  Stream: {stats['decode_fps']} fps decoded, {stats['skipped']} frames skipped, "
+                      f"latency {stats['latency'] * 1000:.0f} ms (max {stats['max_latency'] * 1000:.0f} ms), "
+                      f"{stats['reconnects']} reconnects")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if recorder is not None:
+            recorder.stop()  # Finishes the clip being recorded
+        grabber.stop()
+        if publisher is not None:
+            publisher.stop()
+        if pusher is not None:
+            pusher.stop()
+        print("\nCapture stopped.")
+        if images is not None:
+            print(f"Final ring contains {len(images)} images")
+            images.close()
+
+
+if __name__ == '__main__':
+    main()
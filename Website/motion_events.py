@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Motion Events
+Structured motion alerts instead of a timestamp overwritten in a file.
+  - motion_event(): the event a detector publishes (time, camera, boxes, area)
+  - MotionPublisher: detector side, posts events to the Flask server from a
+    background thread so detection never waits on the network; events are
+    batched while the server is unreachable and sent when it is back
+  - MotionEventLog: server side, keeps the recent events in an in-memory
+    ring (what /api/motion/latest and the SSE stream are served from) and
+    hands every event to the on-disk MotionHistory (motion_history.py)
+A published event can carry a snapshot of the frame: it is shrunk to
+THUMBNAIL_WIDTH when published and encoded on the publisher thread.
+"""
+
+import base64
+import threading
+import time
+from collections import deque
+
+import requests
+
+try:
+    import cv2  # Only needed for thumbnails
+except ImportError:
+    cv2 = None
+
+DEFAULT_EVENTS_URL = "http://127.0.0.1:5000/api/motion/events"
+PUBLISH_QUEUE_SIZE = 256  # Events kept while the server is unreachable, oldest dropped first
+PUBLISH_TIMEOUT = 2.0  # Seconds per POST
+RETRY_START = 0.5  # First retry delay, doubled up to RETRY_MAX
+RETRY_MAX = 30.0
+RING_SIZE = 500  # Recent events the server keeps in memory
+THUMBNAIL_WIDTH = 320  # Pixels, snapshots are never enlarged
+THUMBNAIL_FORMAT = '.jpg'  # '.jpg' or '.webp'
+THUMBNAIL_QUALITY = 70
+
+
+def make_thumbnail(image, width=THUMBNAIL_WIDTH):
+    """A small copy of a frame to encode later (None without OpenCV)"""
+    if cv2 is None or image is None:
+        return None
+    height, full_width = image.shape[:2]
+    if full_width <= width:
+        return image.copy()
+    return cv2.resize(image, (width, max(1, round(height * width / full_width))), interpolation=cv2.INTER_AREA)
+
+
+def encode_thumbnail(thumbnail, image_format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY):
+    """JPEG/WebP bytes of a thumbnail, None if it could not be encoded"""
+    flag = cv2.IMWRITE_WEBP_QUALITY if image_format == '.webp' else cv2.IMWRITE_JPEG_QUALITY
+    ok, data = cv2.imencode(image_format, thumbnail, [flag, quality])
+    return data.tobytes() if ok else None
+
+
+def motion_event(camera, result, timestamp=None, label=None):
+    """The event published for a MotionResult with motion"""
+    return {
+        'type': 'motion',
+        'time': time.time() if timestamp is None else timestamp,
+        'camera': camera,
+        'label': label or camera,
+        'boxes': [list(box) for box in result.objects],
+        'area': result.total_area,
+    }
+
+
+class MotionPublisher:
+    """Sends motion events to the server without ever blocking the detector"""
+
+    def __init__(self, url=DEFAULT_EVENTS_URL, max_queue=PUBLISH_QUEUE_SIZE, timeout=PUBLISH_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._queue = deque(maxlen=max_queue)
+        self._cond = threading.Condition(threading.Lock())
+        self._session = requests.Session()
+        self._thread = None
+        self._stop = False
+
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failures = 0
+        self.last_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='motion-publisher', daemon=True)
+        self._thread.start()
+        return self
+
+    def publish(self, event, image=None):
+        """Queue an event for the server, with a snapshot of the frame if given"""
+        thumbnail = make_thumbnail(image)
+        if thumbnail is not None:
+            event = dict(event, _thumbnail=thumbnail)  # Encoded on the publisher thread
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(event)
+            self.published += 1
+            self._cond.notify()
+
+    def _run(self):
+        delay = RETRY_START
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                batch = list(self._queue)
+                published = self.published
+            for event in batch:
+                self._encode(event)
+            try:
+                response = self._session.post(self.url, json={'events': batch}, timeout=self.timeout)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self.failures += 1
+                if self.last_error is None:
+                    print(f"  ⚠️  Warning: Could not publish motion events to {self.url}: {e}")
+                self.last_error = str(e)
+                with self._cond:
+                    if self._stop:
+                        return
+                    self._cond.wait(delay)
+                delay = min(delay * 2, RETRY_MAX)
+                continue
+            delay = RETRY_START
+            self.last_error = None
+            with self._cond:
+                # Events published during the POST stay queued, whatever of
+                # the batch they pushed out for space is gone already
+                for _ in range(max(0, len(self._queue) - (self.published - published))):
+                    self._queue.popleft()
+                self.sent += len(batch)
+
+    def _encode(self, event):
+        """Replace a queued event's snapshot by its base64 JPEG/WebP (in place, once)"""
+        thumbnail = event.pop('_thumbnail', None)
+        if thumbnail is not None:
+            data = encode_thumbnail(thumbnail)
+            if data is not None:
+                event['thumbnail'] = base64.b64encode(data).decode('ascii')
+
+    def stop(self, timeout=2.0):
+        """Send what is queued (within timeout) and stop"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._session.close()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            'url': self.url,
+            'published': self.published,
+            'sent': self.sent,
+            'queued': queued,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'last_error': self.last_error,
+        }
+
+
+class MotionEventLog:
+    """Recent motion events in memory, every event also stored in a MotionHistory"""
+
+    def __init__(self, history=None, size=RING_SIZE, bus=None):
+        self.history = history  # Where events are kept for good (motion_history.py)
+        self.bus = bus  # EventBus the stored events are published on
+        self._events = deque(maxlen=size)
+        self._latest = {}  # camera -> newest event
+        self._lock = threading.Lock()
+        self._add_lock = threading.Lock()  # Orders add(), which may wait for the history
+        self.last_id = 0
+        self.received = 0
+        if history is not None:
+            for event in history.recent(size):
+                self._remember(event)
+            self.last_id = max(self.last_id, history.last_id)
+
+    def _remember(self, event):
+        self._events.append(event)
+        self._latest[event.get('camera')] = event
+        self.last_id = max(self.last_id, event.get('id', 0))
+
+    def add(self, event, thumbnail=None):
+        """Store an event from a detector and its encoded thumbnail; returns it with its id"""
+        event = dict(event, type='motion', id=0)
+        event.setdefault('time', time.time())
+        with self._add_lock:
+            event['id'] = self.last_id + 1
+            if self.history is not None:
+                # Only queued, written by the history thread. Readers do not
+                # wait here when a slow disk makes it hold the producer back.
+                self.history.add(event, thumbnail)
+            with self._lock:
+                self._remember(event)
+                self.received += 1
+        if self.bus is not None:
+            self.bus.publish(event)
+        return event
+
+    def latest(self, camera=None):
+        """Newest event (of one camera), None if there was none"""
+        with self._lock:
+            if camera is not None:
+                return self._latest.get(camera)
+            return self._events[-1] if self._events else None
+
+    def recent(self, limit=None, camera=None):
+        """Recent events, newest first"""
+        with self._lock:
+            events = [e for e in reversed(self._events) if camera is None or e.get('camera') == camera]
+        return events[:limit] if limit else events
+
+    def since(self, event_id):
+        """Events still in memory after event_id, oldest first"""
+        with self._lock:
+            return [e for e in self._events if e['id'] > event_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'kept': len(self._events),
+                'received': self.received,
+                'last_id': self.last_id,
+                'cameras': {camera: event['time'] for camera, event in self._latest.items()},
+                'history': self.history.stats() if self.history is not None else None,
+            }
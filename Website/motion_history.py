@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Motion History
+Every motion event with its thumbnail, kept on disk and queryable by time
+range and camera. Events are appended to one partition per day:
+
+    <root>/2026-10-17/events.db       SQLite, indexed on (camera, time) and time
+    <root>/2026-10-17/thumbs/<id>.jpg
+
+add() only queues the event; a writer thread inserts the queued events in
+one transaction per partition and writes their thumbnails, so the request
+(or detector) that produced an event never waits on the disk. Queries walk
+the partitions newest first and page with an opaque cursor. When the whole
+history grows beyond the quota, the oldest days are deleted.
+
+    python3 motion_history.py /home/tomas/motion_history   # Show what is stored
+"""
+
+import argparse
+import atexit
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+PARTITION_FORMAT = '%Y-%m-%d'
+PARTITION_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+DATABASE = 'events.db'
+THUMBNAILS = 'thumbs'
+THUMBNAIL_TYPES = {'.jpg': 'image/jpeg', '.webp': 'image/webp'}
+DEFAULT_QUOTA = 2 * 1024 * 1024 * 1024  # Bytes of events and thumbnails kept
+FLUSH_DELAY = 0.5  # Seconds to gather events before writing them
+MAX_PENDING = 10000  # Queued events before add() waits for the writer
+PAGE_SIZE = 50
+MAX_TIME = 253402214400  # 9999-12-31 UTC: later days do not fit PARTITION_FORMAT
+
+
+def valid_time(timestamp):
+    """True for an event time (unix seconds) a partition can be named after"""
+    return (isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool)
+            and math.isfinite(timestamp) and 0 <= timestamp < MAX_TIME)
+
+
+def partition_of(timestamp):
+    """Name of the partition (local day) an event time falls in"""
+    return time.strftime(PARTITION_FORMAT, time.localtime(timestamp))
+
+
+def thumbnail_type(data):
+    """File extension of an encoded thumbnail, None if it is not JPEG or WebP"""
+    if data[:3] == b'\xff\xd8\xff':
+        return '.jpg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+def _directory_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+class MotionHistory:
+    """Time-partitioned, append-only event store with a disk quota"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            time REAL NOT NULL,
+            camera TEXT NOT NULL,
+            label TEXT,
+            boxes TEXT NOT NULL,
+            area INTEGER NOT NULL,
+            thumbnail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS events_camera_time ON events(camera, time);
+        CREATE INDEX IF NOT EXISTS events_time ON events(time);
+    """
+
+    def __init__(self, root, quota=DEFAULT_QUOTA, flush_delay=FLUSH_DELAY, max_pending=MAX_PENDING, timer=None):
+        self.root = root
+        self.quota = quota
+        self.flush_delay = flush_delay
+        self.max_pending = max_pending
+        self.timer = timer  # Optional add(stage, seconds), given every batch write as 'motion_history'
+        os.makedirs(root, exist_ok=True)
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = []  # (partition, event, thumbnail bytes)
+        self._writing = False
+        self._stop = False
+        self._thread = None
+        self._writers = {}  # partition -> connection, used by the writer thread only
+        self._sizes = {partition: _directory_size(self._path(partition)) for partition in self.partitions()}
+        self._db_sizes = {partition: self._database_size(partition) for partition in self._sizes}
+        self.last_id = self._find_last_id()
+
+        self.written = 0
+        self.thumbnails = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.evicted = []  # Partitions deleted for the quota
+        self.errors = 0
+
+    def _path(self, partition, *parts):
+        return os.path.join(self.root, partition, *parts)
+
+    def partitions(self):
+        """Partition names, oldest first"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if PARTITION_PATTERN.match(name))
+
+    def _find_last_id(self):
+        """Highest event id stored (a late event can land in an older day)"""
+        last_id = 0
+        for partition in self.partitions():
+            try:
+                with self._reader(partition) as conn:
+                    row = conn.execute('SELECT MAX(id) FROM events').fetchone()
+            except sqlite3.Error:
+                continue
+            last_id = max(last_id, row[0] or 0)
+        return last_id
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='motion-history', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    # ----- writing -----
+
+    def add(self, event, thumbnail=None):
+        """
+        Queue an event (with an 'id') and its encoded JPEG/WebP thumbnail.
+        Sets event['thumbnail'] to the path the thumbnail will be served
+        from, relative to the root.
+        """
+        partition = partition_of(event['time'])
+        extension = thumbnail_type(thumbnail) if thumbnail else None
+        if extension:
+            event['thumbnail'] = f"{partition}/{event['id']}{extension}"
+        else:
+            thumbnail = None
+        with self._cond:
+            while len(self._pending) >= self.max_pending and not self._stop:
+                self._cond.wait()  # The disk is behind: slow the producer down
+            self._pending.append((partition, event, thumbnail))
+            self.last_id = max(self.last_id, event['id'])
+            self._cond.notify_all()
+        return event
+
+    def _run(self):
+        try:
+            while self._write_next():
+                pass
+        finally:
+            for conn in self._writers.values():
+                conn.close()
+            self._writers.clear()
+
+    def _write_next(self):
+        """Write the next batch; False once stopped with nothing left"""
+        with self._cond:
+            while not self._pending and not self._stop:
+                self._cond.wait()
+            if not self._pending:
+                return False
+            deadline = time.monotonic() + self.flush_delay  # Coalesce a burst into one transaction
+            while not self._stop and len(self._pending) < self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending = self._pending, []
+            self._writing = True
+            self._cond.notify_all()
+        try:
+            self._write(batch)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error saving motion events: {e}")
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+        return True
+
+    def _writer(self, partition):
+        conn = self._writers.get(partition)
+        if conn is None:
+            os.makedirs(self._path(partition, THUMBNAILS), exist_ok=True)
+            conn = sqlite3.connect(self._path(partition, DATABASE), isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.SCHEMA)
+            self._writers[partition] = conn
+            self._sizes.setdefault(partition, 0)
+        return conn
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        by_partition = {}
+        for partition, event, thumbnail in batch:
+            by_partition.setdefault(partition, []).append((event, thumbnail))
+        for partition, items in sorted(by_partition.items()):
+            conn = self._writer(partition)
+            conn.execute('BEGIN')
+            conn.executemany(
+                'INSERT OR IGNORE INTO events (id, time, camera, label, boxes, area, thumbnail) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(e['id'], e['time'], e['camera'], e.get('label'), json.dumps(e.get('boxes', [])),
+                  e.get('area', 0), e.get('thumbnail')) for e, _ in items]
+            )
+            conn.execute('COMMIT')
+            added = 0
+            for event, thumbnail in items:
+                if thumbnail is None:
+                    continue
+                filename = os.path.basename(event['thumbnail'])
+                with open(self._path(partition, THUMBNAILS, filename), 'wb') as f:
+                    f.write(thumbnail)
+                added += len(thumbnail)
+                self.thumbnails += 1
+            database = self._database_size(partition)
+            self._sizes[partition] += added + database - self._db_sizes.get(partition, 0)
+            self._db_sizes[partition] = database
+            self.written += len(items)
+        self._close_writers(before=max(by_partition))
+        self._enforce_quota()
+        seconds = time.perf_counter() - start
+        self.flushes += 1
+        self.flush_seconds += seconds
+        if self.timer is not None:
+            self.timer.add('motion_history', seconds)
+
+    def _close_writers(self, before):
+        """Close the connections of past days: their files would stay open for as long as the server runs"""
+        for partition in [p for p in self._writers if p < before]:
+            self._writers.pop(partition).close()  # Checkpoints and removes the -wal and -shm files
+            database = self._database_size(partition)
+            self._sizes[partition] += database - self._db_sizes.get(partition, 0)
+            self._db_sizes[partition] = database
+
+    def _database_size(self, partition):
+        size = 0
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                size += os.path.getsize(self._path(partition, DATABASE + suffix))
+            except OSError:
+                pass
+        return size
+
+    def _enforce_quota(self):
+        """Delete the oldest days while the history is over its quota (the current day stays)"""
+        while sum(self._sizes.values()) > self.quota and len(self._sizes) > 1:
+            oldest = min(self._sizes)
+            conn = self._writers.pop(oldest, None)
+            if conn is not None:
+                conn.close()
+            shutil.rmtree(self._path(oldest), ignore_errors=True)
+            del self._sizes[oldest]
+            self._db_sizes.pop(oldest, None)
+            self.evicted.append(oldest)
+            print(f"Motion history over quota: removed {oldest}")
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is on disk"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._writing:
+                if self._thread is None or not self._thread.is_alive():
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    # ----- reading -----
+
+    def _reader(self, partition):
+        path = self._path(partition, DATABASE)
+        if not os.path.exists(path):
+            raise sqlite3.OperationalError(f'{path} does not exist')
+        return _ReadConnection(path)
+
+    @staticmethod
+    def _row_to_event(row):
+        event = {
+            'id': row[0],
+            'time': row[1],
+            'camera': row[2],
+            'label': row[3],
+            'boxes': json.loads(row[4]),
+            'area': row[5],
+        }
+        if row[6]:
+            event['thumbnail'] = row[6]
+        return event
+
+    def query(self, start=None, end=None, camera=None, limit=PAGE_SIZE, cursor=None):
+        """
+        Events with start <= time < end (of one camera), newest first.
+        Returns (events, cursor of the next page or None); pass the cursor
+        back with the same filters to continue.
+        """
+        before_time, before_id = end, None
+        if cursor:
+            before_time, before_id = cursor.split(':')
+            before_time, before_id = float(before_time), int(before_id)
+        first = partition_of(start) if start is not None else None
+        last = partition_of(before_time) if before_time is not None else None
+
+        clauses, params = [], []
+        if camera is not None:
+            clauses.append('camera = ?')
+            params.append(camera)
+        if start is not None:
+            clauses.append('time >= ?')
+            params.append(start)
+        if before_id is not None:
+            clauses.append('(time < ? OR (time = ? AND id < ?))')
+            params.extend((before_time, before_time, before_id))
+        elif before_time is not None:
+            clauses.append('time < ?')
+            params.append(before_time)
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+        events = []
+        for partition in reversed(self.partitions()):
+            if last is not None and partition > last:
+                continue
+            if first is not None and partition < first:
+                break
+            try:
+                with self._reader(partition) as conn:
+                    rows = conn.execute(
+                        f'SELECT id, time, camera, label, boxes, area, thumbnail FROM events {where} '
+                        f'ORDER BY time DESC, id DESC LIMIT ?',
+                        params + [limit - len(events)]
+                    ).fetchall()
+            except sqlite3.Error:
+                continue  # Removed for the quota meanwhile, or not written yet
+            events.extend(self._row_to_event(row) for row in rows)
+            if len(events) >= limit:
+                break
+        next_cursor = None
+        if len(events) >= limit:
+            next_cursor = f"{events[-1]['time']!r}:{events[-1]['id']}"
+        return events, next_cursor
+
+    def recent(self, limit=PAGE_SIZE):
+        """The newest events on disk, oldest first"""
+        return list(reversed(self.query(limit=limit)[0]))
+
+    def thumbnail_path(self, name):
+        """File of a thumbnail path from an event, None if it does not exist"""
+        partition, _, filename = name.partition('/')
+        stem, extension = os.path.splitext(filename)
+        if not PARTITION_PATTERN.match(partition) or not stem.isdigit() or extension not in THUMBNAIL_TYPES:
+            return None
+        path = self._path(partition, THUMBNAILS, filename)
+        return path if os.path.isfile(path) else None
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'root': self.root,
+            'partitions': len(self._sizes),
+            'bytes': sum(self._sizes.values()),
+            'quota': self.quota,
+            'pending': pending,
+            'written': self.written,
+            'thumbnails': self.thumbnails,
+            'last_id': self.last_id,
+            'evicted': len(self.evicted),
+            'flush_ms': round(1000 * self.flush_seconds / self.flushes, 2) if self.flushes else None,
+            'errors': self.errors,
+        }
+
+
+class _ReadConnection:
+    """Read-only connection to one partition, closed at the end of the with block"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=5)
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='history directory')
+    parser.add_argument('--camera')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+    history = MotionHistory(args.root)
+    stats = history.stats()
+    print(f"{stats['partitions']} day(s), {stats['bytes'] / 1e6:.1f} MB, last id {stats['last_id']}")
+    events, _ = history.query(camera=args.camera, limit=args.limit)
+    for event in events:
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['time']))
+        print(f"  #{event['id']} {when} {event['label']}: {len(event['boxes'])} object(s), "
+              f"area {event['area']}{' 🖼' if 'thumbnail' in event else ''}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Motion Supervisor
+Runs motion detection for every camera in one process tree instead of one
+motion_detection.py per camera. Each camera gets a FrameGrabber thread and
+a sampler that hands one frame per interval to a shared pool of detection
+processes, sized to the CPU count. A camera always goes to the same worker
+so its detector keeps the previous frame (or its background model);
+workers run OpenCV single-threaded so the pool does not oversubscribe the CPU. Stalled
+grabbers and dead or hung workers are restarted. Motion is published as events to
+the Flask server (see motion_events.py), and every camera also has its own
+alert file next to the shared ALERT_FILE, and with a clips directory,
+clips around the motion are recorded per camera (motion_clips.py). The last frames of every camera are
+kept in a shared FrameRing (CAMERA_RING_NAME) other processes can read.
+Per-camera frame and stage timings (measured in the workers) and stream
+figures are pushed to the server's /metrics (metrics.py).
+
+Cameras come from CAMERAS or a JSON file with the same structure; a URL can
+also be a local video file (looped in real time), for testing:
+
+    python3 motion_supervisor.py
+    python3 motion_supervisor.py --config cameras.json
+    python3 motion_supervisor.py --camera test=/tmp/clip.mp4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from capture_source import choose_source
+from frame_grabber import FrameGrabber
+from motion_clips import ClipRecorder
+from metrics import MetricsPusher, Registry, StageTimes, family, profiler_from_env
+from motion_detection import (ALERT_FILE, CAPTURE_INTERVAL, CLIPS_DIR, EVENTS_URL, PROCESS_WIDTH, DetectorMetrics,
+                              create_detector, frame_ring_for, write_alert)
+from motion_events import MotionPublisher, motion_event
+
+CAMERAS = [
+    {'name': 'camera1', 'label': 'Cámara Principal', 'url': 'rtsp://192.168.1.143:8554/mystream'},
+    {'name': 'camera2', 'label': 'Cámara 2', 'url': 'http://192.168.1.193:8890/video'},
+]
+# Optional per camera: 'interval' (seconds between analyzed frames), 'alert_file',
+# 'pace' (fps for file sources), 'detector' (create_detector settings, e.g. mode, regions)
+# and how frames are read (capture_source.choose_source): 'source' ('substream', 'ffmpeg'
+# or 'opencv', default the cheapest), 'substream' (URL of the low-resolution stream),
+# 'substream_width', 'width' (of the main stream) and 'keyframe_interval' (seconds),
+# 'record' (False = no clips of this camera)
+
+CAMERA_ALERT_FILE = "/var/www/html/motion_alert_{name}.txt"
+CAMERA_RING_NAME = "motion_frames_{name}"  # Recent gray frames per camera, under /dev/shm
+READ_TIMEOUT = 5.0  # Seconds to wait for a frame before counting a miss
+STALL_AFTER = 30  # Restart a grabber that delivered nothing for this long
+HUNG_AFTER = 30.0  # Restart a worker that kept a camera's frame this many seconds...
+HUNG_INTERVALS = 10  # ...or this many of the camera's intervals, whichever is longer
+HEALTH_INTERVAL = 2.0  # Seconds between health checks
+STATS_INTERVAL = 60  # Seconds between printed statistics
+FILE_PACE = 25  # Frames per second a local video file is played at
+METRICS_NAME = "motion_supervisor"  # Process name of the metrics pushed to the server (None = off)
+
+
+def _detection_worker(inbox, outbox, settings):
+    """
+    Pool process: one detector per camera it is assigned, writing the
+    gray frames into that camera's shared FrameRing; the stage timings of
+    each frame go back with its result
+    """
+    cv2.setNumThreads(1)
+    detectors = {}
+    rings = {}
+    timings = StageTimes()
+    try:
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            camera, number, captured_at, wall_time, image, source_width = item
+            detector = detectors.get(camera)
+            if detector is None:
+                detector = detectors[camera] = create_detector(timer=timings, **settings.get(camera, {}))
+            timings.clear()
+            start = time.perf_counter()
+            try:
+                detector.set_source_width(source_width)
+                ring = rings[camera] = frame_ring_for(
+                    rings.get(camera), image.shape[:2], CAMERA_RING_NAME.format(name=camera)
+                )
+                result = detector.detect(image, gray=ring.next_slot())
+                ring.commit(wall_time)
+            except Exception as e:
+                outbox.put((camera, number, captured_at, None, str(e), None))
+                continue
+            outbox.put((camera, number, captured_at, result, time.perf_counter() - start, dict(timings)))
+    finally:
+        for ring in rings.values():
+            ring.close()
+
+
+class DetectionPool:
+    """Worker processes, each serving a fixed share of the cameras"""
+
+    def __init__(self, settings, workers=None):
+        self.settings = settings  # camera name -> create_detector keyword arguments
+        self.size = max(1, min(workers or os.cpu_count() or 1, len(settings) or 1))
+        self._assignment = {camera: index % self.size for index, camera in enumerate(sorted(settings))}
+        self._context = multiprocessing.get_context('spawn')  # No fork of a process with threads
+        self.results = self._context.Queue()
+        self._workers = [None] * self.size
+        self._inboxes = [None] * self.size
+        self.restarts = 0
+        self.hung = 0  # Restarts of workers that stopped answering without dying
+
+    def start(self):
+        for index in range(self.size):
+            self._start_worker(index)
+        return self
+
+    def _start_worker(self, index):
+        old_process = self._workers[index]
+        if old_process is not None and old_process.is_alive():
+            old_process.kill()  # Hung: it would never read its inbox again
+            old_process.join(1)
+        old = self._inboxes[index]
+        if old is not None:
+            old.cancel_join_thread()  # Frames queued for a dead worker are dropped
+            old.close()
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=_detection_worker, args=(inbox, self.results, self.settings),
+            name=f'motion-worker-{index}', daemon=True
+        )
+        process.start()
+        self._inboxes[index] = inbox
+        self._workers[index] = process
+
+    def worker_for(self, camera):
+        return self._assignment[camera]
+
+    def submit(self, camera, frame):
+        self._inboxes[self.worker_for(camera)].put(
+            (camera, frame.number, frame.captured_at, frame.wall_time, frame.image, frame.source_width)
+        )
+
+    def check(self):
+        """Restart dead workers; returns the cameras whose detector state was lost"""
+        lost = []
+        for index, process in enumerate(self._workers):
+            if process is not None and not process.is_alive():
+                lost += self.restart_worker(index, f'died (exit code {process.exitcode})')
+        return lost
+
+    def restart_worker(self, index, reason, hung=False):
+        """Replace a worker (killing it when it hung); returns the cameras whose detector state was lost"""
+        print(f"Detection worker {index} {reason}, restarting")
+        self.restarts += 1
+        if hung:
+            self.hung += 1
+        self._start_worker(index)
+        return [name for name in self.settings if self.worker_for(name) == index]
+
+    @property
+    def pids(self):
+        return [process.pid for process in self._workers if process is not None]
+
+    def stop(self):
+        for inbox in self._inboxes:
+            if inbox is not None:
+                inbox.put(None)
+        for process in self._workers:
+            if process is not None:
+                process.join(2)
+                if process.is_alive():
+                    process.terminate()
+        for inbox in self._inboxes:
+            if inbox is not None:
+                inbox.cancel_join_thread()
+        self.results.cancel_join_thread()
+
+
+class Camera:
+    """One stream: its grabber, the sampler feeding the pool and its alert channel"""
+
+    def __init__(self, config, pool, publisher=None, clips_dir=None, metrics=None):
+        self.name = config['name']
+        self.label = config.get('label', self.name)
+        self.url = config['url']
+        self.interval = config.get('interval', CAPTURE_INTERVAL)
+        self.alert_file = config.get('alert_file', CAMERA_ALERT_FILE.format(name=self.name))
+        self.pace = config.get('pace', FILE_PACE if os.path.isfile(self.url) else None)
+        self.source = choose_source(
+            self.url, config.get('detector', {}).get('process_width', PROCESS_WIDTH), self.interval,
+            config.get('substream'), config.get('substream_width'), config.get('keyframe_interval'),
+            config.get('width'), config.get('source')
+        )
+        self.pool = pool
+        self.publisher = publisher
+        self.recorder = None
+        if clips_dir and config.get('record', True):
+            try:
+                self.recorder = ClipRecorder(clips_dir, self.name, self.label)
+            except (OSError, RuntimeError) as e:
+                print(f"[{self.name}] Clips are not recorded: {e}")
+        self.grabber = None
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.watch(self.name, lambda: self.grabber)
+            self._frame_seconds = metrics.frames.labels(self.name)
+            self._stages = metrics.stages.timer(self.name)
+            self._motion = metrics.motion.labels(self.name)
+        self.pending = None  # Frame waiting in the pool
+        self.pending_since = None  # When it was submitted (monotonic)
+        self.hung_after = max(HUNG_AFTER, HUNG_INTERVALS * self.interval)
+        self._stop = threading.Event()
+        self._sampler = None
+
+        self.analyzed = 0
+        self.busy_skips = 0  # Samples dropped because the previous one was still in the pool
+        self.misses = 0
+        self.errors = 0
+        self.motion_events = 0
+        self.restarts = 0
+        self.last_motion = None
+        self.detect_seconds = 0.0
+        self.last_result_at = None
+
+    def start(self):
+        self.grabber = self._new_grabber()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f'sampler-{self.name}', daemon=True)
+        self._sampler.start()
+        if self.recorder is not None:
+            self.recorder.start().capture(self.url)
+        return self
+
+    def _new_grabber(self):
+        return FrameGrabber(self.source.url, self.source.open, name=self.name, pace=self.pace).start()
+
+    def restart_grabber(self, reason):
+        print(f"[{self.name}] Restarting grabber: {reason}")
+        self.restarts += 1
+        old = self.grabber
+        self.grabber = self._new_grabber()
+        self.pending = None
+        old.stop(timeout=1)
+
+    def _sample_loop(self):
+        next_capture = time.monotonic()
+        while not self._stop.is_set():
+            delay = next_capture - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            next_capture = max(next_capture + self.interval, time.monotonic())
+            if self.pending is not None:
+                self.busy_skips += 1
+                continue
+            grabber = self.grabber
+            frame = grabber.read(timeout=READ_TIMEOUT)
+            if frame is None:
+                self.misses += 1
+                continue
+            self.pending_since = time.monotonic()
+            self.pending = frame
+            self.pool.submit(self.name, frame)
+
+    def handle(self, number, captured_at, result, detail, timings=None):
+        """A detection came back from the pool"""
+        frame, self.pending = self.pending, None
+        self.last_result_at = time.monotonic()
+        if result is None:
+            self.errors += 1
+            print(f"[{self.name}] Detection failed: {detail}")
+            return
+        self.analyzed += 1
+        self.detect_seconds += detail
+        if self.metrics is not None:
+            self._frame_seconds.observe(detail)
+            for stage, seconds in (timings or {}).items():
+                self._stages.add(stage, seconds)
+        if frame is not None and frame.number != number:
+            frame = None
+        if frame is not None:
+            self.grabber.done(frame)
+        if result.motion:
+            self.motion_events += 1
+            if self.metrics is not None:
+                self._motion.inc()
+            self.last_motion = time.time()
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"[{timestamp}] 🚨 {self.label}: {len(result.objects)} object(s), area {result.total_area}")
+            self.alert(result, frame)
+
+    def alert(self, result, frame=None):
+        """Motion event (with a thumbnail of the frame) for the server, a clip, plus the alert files"""
+        wall_time = frame.wall_time if frame is not None else time.time()
+        if self.publisher is not None:
+            image = frame.image if frame is not None else None
+            self.publisher.publish(motion_event(self.name, result, wall_time, self.label), image)
+        if self.recorder is not None:
+            self.recorder.trigger(wall_time)
+        write_alert(self.alert_file)
+        write_alert(ALERT_FILE)
+
+    def waiting(self):
+        """Seconds the frame in the pool has waited for its result, 0 when there is none"""
+        since = self.pending_since
+        return time.monotonic() - since if self.pending is not None and since is not None else 0
+
+    def check(self):
+        """Restart the grabber when its thread died or the stream stalled"""
+        grabber = self.grabber
+        if not grabber.alive:
+            self.restart_grabber('thread stopped')
+        elif grabber.last_frame_at is not None and time.monotonic() - grabber.last_frame_at > STALL_AFTER:
+            self.restart_grabber(f'no frame for {STALL_AFTER}s')
+
+    def stop(self):
+        self._stop.set()
+        if self.recorder is not None:
+            self.recorder.stop()
+        if self.grabber is not None:
+            self.grabber.stop(timeout=1)
+
+    def stats(self):
+        stream = self.grabber.stats() if self.grabber else {}
+        return {
+            'label': self.label,
+            'source': self.source.describe(),
+            'stream': stream,
+            'analyzed': self.analyzed,
+            'busy_skips': self.busy_skips,
+            'misses': self.misses,
+            'errors': self.errors,
+            'restarts': self.restarts,
+            'motion_events': self.motion_events,
+            'last_motion': self.last_motion,
+            'detect_ms': round(1000 * self.detect_seconds / self.analyzed, 2) if self.analyzed else None,
+            'clips': self.recorder.stats() if self.recorder else None,
+        }
+
+
+class MotionSupervisor:
+    def __init__(self, cameras, workers=None, events_url=EVENTS_URL, clips_dir=CLIPS_DIR, metrics_name=METRICS_NAME):
+        settings = {config['name']: config.get('detector', {}) for config in cameras}
+        self.pool = DetectionPool(settings, workers)
+        self.publisher = MotionPublisher(events_url) if events_url else None
+        self.registry = Registry()
+        self.metrics = DetectorMetrics(self.registry)
+        self.registry.collect(lambda: [family(
+            'motion_worker_restarts_total', 'counter', 'Detection worker processes restarted',
+            [({'reason': 'died'}, self.pool.restarts - self.pool.hung), ({'reason': 'hung'}, self.pool.hung)]
+        )])
+        self.pusher = None
+        if metrics_name:
+            try:
+                self.pusher = MetricsPusher(self.registry, metrics_name, profiler=profiler_from_env())
+            except OSError as e:
+                print(f"  ⚠️  Warning: Metrics are not pushed: {e}")
+        self.cameras = {config['name']: Camera(config, self.pool, self.publisher, clips_dir, self.metrics)
+                        for config in cameras}
+        self._stop = threading.Event()
+        self._collector = None
+
+    def start(self):
+        if self.publisher is not None:
+            self.publisher.start()
+        if self.pusher is not None:
+            self.pusher.start()
+        self.pool.start()
+        for camera in self.cameras.values():
+            camera.start()
+        self._collector = threading.Thread(target=self._collect, name='motion-results', daemon=True)
+        self._collector.start()
+        return self
+
+    def _collect(self):
+        while not self._stop.is_set():
+            try:
+                name, number, captured_at, result, detail, timings = self.pool.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            camera = self.cameras.get(name)
+            if camera is not None:
+                camera.handle(number, captured_at, result, detail, timings)
+
+    def check(self):
+        lost = self.pool.check()
+        for camera in self.cameras.values():
+            # A worker that hangs without dying would keep the camera's frame forever
+            waiting = camera.waiting()
+            if waiting > camera.hung_after and camera.name not in lost:
+                index = self.pool.worker_for(camera.name)
+                lost += self.pool.restart_worker(index, f'hung ({camera.name} waited {waiting:.0f}s)', hung=True)
+        for name in lost:
+            self.cameras[name].pending = None  # Its frame died with the worker
+        for camera in self.cameras.values():
+            camera.check()
+
+    def run(self):
+        """Supervise until interrupted"""
+        last_stats = time.monotonic()
+        try:
+            while not self._stop.wait(HEALTH_INTERVAL):
+                self.check()
+                if time.monotonic() - last_stats >= STATS_INTERVAL:
+                    last_stats = time.monotonic()
+                    self.print_stats()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def print_stats(self):
+        for name, stats in self.stats()['cameras'].items():
+            stream = stats['stream']
+            print(f"  [{name}] {stream.get('state')}: {stream.get('decode_fps')} fps decoded, "
+                  f"{stats['analyzed']} analyzed, {stats['busy_skips']} busy, "
+                  f"latency {stream.get('latency', 0) * 1000:.0f} ms, {stats['restarts']} restarts")
+
+    def stop(self):
+        self._stop.set()
+        for camera in self.cameras.values():
+            camera.stop()
+        self.pool.stop()
+        if self.publisher is not None:
+            self.publisher.stop()
+        if self.pusher is not None:
+            self.pusher.stop()
+
+    def stats(self):
+        return {
+            'workers': self.pool.size,
+            'worker_restarts': self.pool.restarts,
+            'workers_hung': self.pool.hung,
+            'events': self.publisher.stats() if self.publisher else None,
+            'cameras': {name: camera.stats() for name, camera in self.cameras.items()},
+        }
+
+
+def load_cameras(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', help='JSON file with the camera list')
+    parser.add_argument('--camera', action='append', default=[], metavar='NAME=URL',
+                        help='watch this stream or video file instead (repeatable)')
+    parser.add_argument('--workers', type=int, help='detection processes (default: CPU count)')
+    parser.add_argument('--events-url', default=EVENTS_URL,
+                        help='where motion events are POSTed (empty = do not publish)')
+    parser.add_argument('--clips-dir', default=CLIPS_DIR, help='where clips are recorded (empty = do not record)')
+    args = parser.parse_args()
+
+    if args.camera:
+        cameras = [dict(zip(('name', 'url'), item.split('=', 1))) for item in args.camera]
+    elif args.config:
+        cameras = load_cameras(args.config)
+    else:
+        cameras = CAMERAS
+
+    supervisor = MotionSupervisor(cameras, args.workers, args.events_url, args.clips_dir).start()
+    print(f"Watching {len(cameras)} camera(s) with {supervisor.pool.size} detection worker(s)")
+    for camera in supervisor.cameras.values():
+        print(f"  [{camera.name}] {camera.source.describe()}")
+    supervisor.run()
+    print("\nSupervisor stopped.")
+
+
+if __name__ == '__main__':
+    main()
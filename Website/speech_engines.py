@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Speech Engines
+Pluggable speech-to-text backends for the voice assistant.
+  - GoogleEngine: the free Google Web Speech API (needs internet)
+  - VoskEngine: offline CPU recognition with a Vosk model (pip install vosk,
+    models from https://alphacephei.com/vosk/models). The model is loaded
+    once and shared by every worker thread.
+SpeechRecognizer runs the engines on a small worker pool and caches the
+ambient-noise calibration per device: instead of spending the first 0.5 s of
+every utterance on adjust_for_ambient_noise, a device is calibrated once
+every CALIBRATION_TTL seconds and utterances that never rise above its noise
+level are rejected without calling an engine.
+"""
+
+import json
+import math
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import speech_recognition as sr
+
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+from voice_pipeline import SAMPLE_RATE, SAMPLE_WIDTH
+
+LANGUAGE = "es-ES"
+CALIBRATION_TTL = 600  # Seconds before a device is calibrated again
+ENERGY_RATIO = 1.5  # Speech must be this much louder than the background
+WINDOW_SECONDS = 0.1  # Energy is compared per window of this length
+
+
+class EngineUnavailable(Exception):
+    """The requested engine is unknown or could not be loaded"""
+
+
+class SpeechEngine:
+    """A speech-to-text backend working on 16 kHz mono s16le PCM"""
+
+    name = None
+
+    def load(self):
+        """Load models or open clients, called once at startup"""
+
+    @property
+    def available(self):
+        return True
+
+    def transcribe(self, pcm, sample_rate=SAMPLE_RATE, language=LANGUAGE):
+        """Return the transcript, raise sr.UnknownValueError or sr.RequestError"""
+        raise NotImplementedError
+
+
+class GoogleEngine(SpeechEngine):
+    name = 'google'
+
+    def transcribe(self, pcm, sample_rate=SAMPLE_RATE, language=LANGUAGE):
+        audio_data = sr.AudioData(pcm, sample_rate, SAMPLE_WIDTH)
+        return sr.Recognizer().recognize_google(audio_data, language=language)
+
+
+class VoskEngine(SpeechEngine):
+    name = 'vosk'
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.model = None
+        self.error = None
+
+    def load(self):
+        if vosk is None:
+            self.error = "vosk is not installed (pip install vosk)"
+            return
+        try:
+            start = time.perf_counter()
+            vosk.SetLogLevel(-1)
+            self.model = vosk.Model(self.model_path)
+            print(f"Vosk model loaded from {self.model_path} in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            self.error = f"could not load Vosk model {self.model_path}: {e}"
+
+    @property
+    def available(self):
+        return self.model is not None
+
+    def transcribe(self, pcm, sample_rate=SAMPLE_RATE, language=LANGUAGE):
+        if self.model is None:
+            raise sr.RequestError(self.error or "Vosk model not loaded")
+        # The model is shared, recognizers are cheap and per call
+        recognizer = vosk.KaldiRecognizer(self.model, sample_rate)
+        recognizer.AcceptWaveform(pcm)
+        transcript = json.loads(recognizer.FinalResult()).get('text', '')
+        if not transcript:
+            raise sr.UnknownValueError()
+        return transcript
+
+
+def rms(pcm):
+    """Root mean square energy of s16le PCM"""
+    samples = array('h', pcm[:len(pcm) - len(pcm) % SAMPLE_WIDTH])
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+
+
+class NoiseCalibration:
+    """Per-device background energy, taken from the quietest part of an utterance"""
+
+    def __init__(self, ttl=CALIBRATION_TTL, sample_rate=SAMPLE_RATE):
+        self.ttl = ttl
+        self.sample_rate = sample_rate
+        self._thresholds = {}  # device -> (energy_threshold, calibrated_at)
+        self._lock = threading.Lock()
+        self.calibrations = 0
+
+    def threshold(self, device, pcm):
+        """
+        Return (energy_threshold, cached) for the device, calibrating on the
+        start of this audio when there is no recent calibration
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._thresholds.get(device)
+        if cached is not None and now - cached[1] < self.ttl:
+            return cached[0], True
+
+        threshold = min(self._window_energies(pcm), default=0.0) * ENERGY_RATIO
+        with self._lock:
+            self._thresholds[device] = (threshold, now)
+            self.calibrations += 1
+        return threshold, False
+
+    def is_silent(self, pcm, threshold):
+        """True when no window of the utterance rises above the threshold"""
+        return all(energy <= threshold for energy in self._window_energies(pcm))
+
+    def _window_energies(self, pcm):
+        window = int(WINDOW_SECONDS * self.sample_rate) * SAMPLE_WIDTH
+        for offset in range(0, len(pcm) - window + 1, window):
+            yield rms(pcm[offset:offset + window])
+
+    def forget(self, device):
+        with self._lock:
+            self._thresholds.pop(device, None)
+
+
+class SpeechRecognizer:
+    """Runs transcriptions for the selected engine on a bounded worker pool"""
+
+    def __init__(self, engines, default='google', workers=2, calibration=None):
+        self.engines = {engine.name: engine for engine in engines}
+        self.default = default
+        self.calibration = calibration or NoiseCalibration()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='speech')
+
+    def start(self):
+        """Load every engine's model up front so the first request is not slow"""
+        for engine in self.engines.values():
+            engine.load()
+            if not engine.available:
+                print(f"Speech engine '{engine.name}' unavailable: {getattr(engine, 'error', '')}")
+        return self
+
+    def engine(self, name=None):
+        engine = self.engines.get(name or self.default)
+        if engine is None:
+            raise EngineUnavailable(f"unknown speech engine '{name}' (available: {', '.join(self.engines)})")
+        if not engine.available:
+            raise EngineUnavailable(f"speech engine '{engine.name}' is not available")
+        return engine
+
+    def transcribe(self, pcm, engine=None, device=None, language=LANGUAGE):
+        """Transcribe PCM on the worker pool, return (transcript, engine name)"""
+        engine = self.engine(engine)
+        if device is not None:
+            threshold, cached = self.calibration.threshold(device, pcm)
+            # Only judged against an earlier calibration, a fresh one is
+            # relative to this very utterance
+            if cached and self.calibration.is_silent(pcm, threshold):
+                self.calibration.forget(device)
+                raise sr.UnknownValueError()
+        return self._pool.submit(engine.transcribe, pcm, SAMPLE_RATE, language).result(), engine.name
+
+    def close(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Spotify Service
+Spotify integration for the voice assistant, built to keep the API round
+trips off the path of a voice command:
+  - one spotipy client with a pooled requests.Session, created once
+  - the access token is kept in memory until it is about to expire instead
+    of being re-read from the token cache file on every call
+  - search results are cached per normalized query for SEARCH_TTL
+  - the device list is cached and refreshed by a background thread while
+    the assistant is being used
+  - a circuit breaker stops calling Spotify after repeated failures and
+    retries with exponential backoff, so an outage costs one fast error per
+    command instead of a timeout
+"""
+
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from spotipy.exceptions import SpotifyException
+
+SEARCH_TTL = 24 * 3600  # Seconds a query -> track result is reused
+MISS_TTL = 300  # Seconds a query that found nothing is remembered
+SEARCH_CACHE_SIZE = 512
+DEVICE_TTL = 30  # Seconds before the device list is fetched again
+DEVICE_IDLE = 600  # Stop background refreshes this long after the last command
+TOKEN_MARGIN = 60  # Refresh the access token this many seconds before expiry
+FAILURE_THRESHOLD = 3  # Consecutive failures that open the circuit
+BACKOFF_START = 5  # Seconds the circuit stays open the first time
+BACKOFF_MAX = 300
+
+
+class SpotifyUnavailable(Exception):
+    """Spotify is not configured or the circuit breaker is open"""
+
+
+def normalize_query(query):
+    """Case, accent and whitespace insensitive form of a search query"""
+    decomposed = unicodedata.normalize('NFD', query.lower())
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. After FAILURE_THRESHOLD consecutive failures it
+    opens and calls fail immediately until the backoff has passed; then one
+    trial call is let through (half-open). Every failed trial doubles the
+    backoff up to BACKOFF_MAX.
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, backoff=BACKOFF_START, max_backoff=BACKOFF_MAX):
+        self.threshold = threshold
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.backoff:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """True if a call may be made now"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.backoff:
+                return False
+            self._trial = True  # Only one trial call at a time
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.backoff = self.initial_backoff
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                self.opened_at = time.monotonic()
+                self._trial = False
+            elif self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def retry_in(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            return max(0.0, self.backoff - (time.monotonic() - self.opened_at))
+
+
+class MemoryToken:
+    """Auth manager wrapper that keeps the access token in memory until it expires"""
+
+    def __init__(self, auth_manager, margin=TOKEN_MARGIN):
+        self.auth_manager = auth_manager
+        self.margin = margin
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get_access_token(self, as_dict=False):
+        with self._lock:
+            if self._token is None or time.time() > self._expires_at - self.margin:
+                # get_access_token(as_dict=True) is deprecated: read the cached
+                # token info, refreshed when it expired
+                cache = self.auth_manager.cache_handler
+                info = self.auth_manager.validate_token(cache.get_cached_token())
+                if info is None:
+                    # Nothing usable cached yet: run the authorization flow, which caches it
+                    self._token = self.auth_manager.get_access_token(as_dict=False)
+                    info = self.auth_manager.validate_token(cache.get_cached_token())
+                if info is not None:
+                    self._token = info['access_token']
+                    self._expires_at = info.get('expires_at', time.time() + 3600)
+                else:
+                    self._expires_at = time.time() + 3600
+            return self._token
+
+
+def is_client_error(error):
+    """Spotify answered, the request itself was wrong (e.g. no active device)"""
+    return isinstance(error, SpotifyException) and 400 <= error.http_status < 500 and error.http_status != 429
+
+
+class SpotifyService:
+    """Cached, failure-tolerant access to the Spotify Web API"""
+
+    def __init__(self, client_factory, pool_size=4, search_ttl=SEARCH_TTL, device_ttl=DEVICE_TTL):
+        """client_factory(session) must return a spotipy.Spotify using that session"""
+        self.client_factory = client_factory
+        self.search_ttl = search_ttl
+        self.device_ttl = device_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.breaker = CircuitBreaker()
+
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._searches = OrderedDict()  # normalized query -> (expires_at, track or None)
+        self._search_lock = threading.Lock()
+        self._devices = None
+        self._devices_at = 0
+        self._last_used = 0
+        self._stop = threading.Event()
+        self._refresher = None
+        self.search_hits = 0
+        self.search_misses = 0
+
+    # ----- plumbing -----
+
+    def client(self):
+        """The shared spotipy client, created on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.client_factory(self.session)
+                    print("Spotify client initialized")
+        return self._client
+
+    def call(self, method, *args, **kwargs):
+        """Call a spotipy method through the circuit breaker"""
+        if not self.breaker.allow():
+            raise SpotifyUnavailable(f"Spotify unavailable, retrying in {self.breaker.retry_in():.0f}s")
+        try:
+            client = self.client()
+        except Exception as e:
+            self.breaker.failure()
+            raise SpotifyUnavailable(f"could not initialize Spotify: {e}") from e
+        try:
+            result = getattr(client, method)(*args, **kwargs)
+        except Exception as e:
+            if is_client_error(e):
+                self.breaker.success()  # Spotify is up, the request was just refused
+            else:
+                self.breaker.failure()
+            raise
+        self.breaker.success()
+        return result
+
+    # ----- search -----
+
+    def find_track(self, query):
+        """Return {'uri', 'name', 'artist'} of the best match for query, or None"""
+        key = normalize_query(query)
+        now = time.time()
+        with self._search_lock:
+            cached = self._searches.get(key)
+            if cached is not None and cached[0] > now:
+                self._searches.move_to_end(key)
+                self.search_hits += 1
+                return cached[1]
+
+        self.search_misses += 1
+        results = self.call('search', q=query, limit=1, type='track')
+        items = results['tracks']['items']
+        track = None
+        if items:
+            track = {
+                'uri': items[0]['uri'],
+                'name': items[0]['name'],
+                'artist': items[0]['artists'][0]['name'],
+            }
+
+        with self._search_lock:
+            self._searches[key] = (now + (self.search_ttl if track else MISS_TTL), track)
+            self._searches.move_to_end(key)
+            while len(self._searches) > SEARCH_CACHE_SIZE:
+                self._searches.popitem(last=False)
+        return track
+
+    # ----- devices -----
+
+    def devices(self, refresh=False):
+        """The user's Spotify devices, from cache unless stale"""
+        self._last_used = time.time()
+        if refresh or self._devices is None or time.time() - self._devices_at > self.device_ttl:
+            self._refresh_devices()
+        return self._devices or []
+
+    def device_id(self):
+        """Id of the active device, or the first one available, or None"""
+        devices = self.devices()
+        for device in devices:
+            if device.get('is_active'):
+                return device['id']
+        return devices[0]['id'] if devices else None
+
+    def _refresh_devices(self):
+        self._devices = self.call('devices')['devices']
+        self._devices_at = time.time()
+
+    def start(self):
+        """Refresh the device list in the background while the assistant is in use"""
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name='spotify-devices', daemon=True)
+            self._refresher.start()
+        return self
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.device_ttl / 2):
+            if time.time() - self._last_used > DEVICE_IDLE or self.breaker.state != 'closed':
+                continue
+            try:
+                self._refresh_devices()
+            except Exception as e:
+                print(f"Spotify device refresh failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.session.close()
+
+    # ----- playback -----
+
+    def play(self, query):
+        """
+        Find and play a track; returns the track, None when nothing matched.
+        Raises LookupError when no device is available.
+        """
+        track = self.find_track(query)
+        if track is None:
+            return None
+
+        device_id = self.device_id()
+        if device_id is None:
+            raise LookupError("no Spotify device available")
+        try:
+            self.call('start_playback', device_id=device_id, uris=[track['uri']])
+        except SpotifyException as e:
+            if e.http_status != 404:
+                raise
+            # The cached device went away, look again once
+            self.devices(refresh=True)
+            device_id = self.device_id()
+            if device_id is None:
+                raise LookupError("no Spotify device available")
+            self.call('start_playback', device_id=device_id, uris=[track['uri']])
+        return track
+
+    def pause(self):
+        self._last_used = time.time()
+        self.call('pause_playback')
+
+    def resume(self):
+        self._last_used = time.time()
+        self.call('start_playback')
+
+    def stats(self):
+        return {
+            'circuit': self.breaker.state,
+            'search_hits': self.search_hits,
+            'search_misses': self.search_misses,
+            'cached_searches': len(self._searches),
+            'devices': len(self._devices or []),
+        }
@@ -0,0 +1,7 @@
+"""The modules live next to FlaskServer.py, the benchmarks they reuse in benchmarks/"""
+
+import os
+import sys
+
+WEBSITE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [WEBSITE, os.path.join(WEBSITE, 'benchmarks')]
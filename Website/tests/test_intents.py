@@ -0,0 +1,29 @@
+"""The voice assistant's intent registry against benchmarks/intent_corpus.json"""
+
+import json
+import random
+
+import pytest
+
+from bench_intents import CORPUS, check, grow
+
+with open(CORPUS) as f:
+    ENTRIES = json.load(f)
+
+
+@pytest.fixture(scope='module')
+def registry():
+    import FlaskServer
+    return FlaskServer.intents
+
+
+@pytest.mark.parametrize('entry', ENTRIES, ids=[entry['text'] for entry in ENTRIES])
+def test_corpus_utterance(registry, entry):
+    match = registry.match(entry['text'])
+    assert match.name == entry['intent']
+    assert {slot: match.slots.get(slot) for slot in entry.get('slots', {})} == entry.get('slots', {})
+
+
+def test_corpus_with_hundreds_of_intents(registry):
+    grown = grow(registry, 300, random.Random(0))
+    assert check(grown, ENTRIES) == []
@@ -0,0 +1,87 @@
+"""
+No lost updates under concurrent requests: a reduced run of
+benchmarks/stress_lights.py, plus the compare-and-set the server relies on
+"""
+
+import threading
+import time
+
+import pytest
+
+from lights_store import JsonLightStore, RevisionConflict, SqliteLightStore
+from stress_lights import stress
+
+
+def open_store(backend, directory):
+    if backend == 'sqlite':
+        return SqliteLightStore(str(directory / 'lights_state.db'))
+    return JsonLightStore(str(directory / 'lights_state.json'), flush_delay=0.01)
+
+
+@pytest.mark.parametrize('backend, processes', [('json', 1), ('sqlite', 1), ('sqlite', 2)])
+def test_stress_loses_no_updates(backend, processes):
+    failures, summary = stress(backend, processes, threads=4, ops=40)
+    assert failures == []
+    assert summary['toggles'] > 0
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_stale_revision_is_a_conflict(backend, tmp_path):
+    store = open_store(backend, tmp_path)
+    (_, light, rev), = store.apply({'lamp': {'state': False}})
+    store.apply({'lamp': dict(light, state=True)}, expected={'lamp': rev})
+    with pytest.raises(RevisionConflict):
+        store.apply({'lamp': dict(light, state=False)}, expected={'lamp': rev})
+    assert store.get('lamp')['state'] is True
+    with pytest.raises(RevisionConflict):
+        store.apply({'new': {'state': True}}, expected={'new': 1})  # Does not exist yet
+    assert store.get('new') is None
+    store.close()
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_concurrent_compare_and_set_toggles(backend, tmp_path):
+    store = open_store(backend, tmp_path)
+    store.apply({'lamp': {'state': False, 'count': 0}})
+    revisions = []
+    lock = threading.Lock()
+
+    def toggle(times):
+        for _ in range(times):
+            while True:
+                light = store.get('lamp')
+                changed = dict(light, state=not light['state'], count=light['count'] + 1)
+                time.sleep(0.001)  # Let the other threads change it in between
+                try:
+                    (_, _, rev), = store.apply({'lamp': changed}, expected={'lamp': light['rev']})
+                    break
+                except RevisionConflict:
+                    continue
+            with lock:
+                revisions.append(rev)
+
+    threads = [threading.Thread(target=toggle, args=(25,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    light = store.get('lamp')
+    assert light['count'] == 100
+    assert light['state'] is False
+    assert len(set(revisions)) == 100
+    assert store.revision == max(revisions)
+    store.close()
+
+
+def test_sqlite_handles_share_one_revision_sequence(tmp_path):
+    first = SqliteLightStore(str(tmp_path / 'lights_state.db'))
+    second = SqliteLightStore(str(tmp_path / 'lights_state.db'))
+    revisions = []
+    for i in range(10):
+        store = first if i % 2 else second
+        (_, _, rev), = store.apply({f'light{i}': {'state': True}})
+        revisions.append(rev)
+    assert revisions == sorted(set(revisions))
+    assert first.revision == second.revision == revisions[-1]
+    first.close()
+    second.close()
@@ -0,0 +1,226 @@
+"""SpotifyService's circuit breaker, search cache and in-memory token against a fake client"""
+
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import spotify_service
+from spotify_service import MemoryToken, SpotifyService, SpotifyUnavailable
+
+
+class Clock:
+    """Stands in for the time module inside spotify_service"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeSpotify:
+    """The spotipy methods SpotifyService uses; raises 503s while down"""
+
+    def __init__(self):
+        self.down = False
+        self.calls = []
+
+    def _answer(self, method, result):
+        self.calls.append(method)
+        if self.down:
+            raise SpotifyException(503, -1, 'Service unavailable')
+        return result
+
+    def search(self, q, limit, type):
+        items = [] if 'nada' in q else [{'uri': f'spotify:track:{q}', 'name': q, 'artists': [{'name': 'Artista'}]}]
+        return self._answer('search', {'tracks': {'items': items}})
+
+    def devices(self):
+        return self._answer('devices', {'devices': [{'id': 'living-room', 'is_active': True}]})
+
+    def start_playback(self, device_id=None, uris=None):
+        return self._answer('start_playback', None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(spotify_service, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def fake():
+    return FakeSpotify()
+
+
+@pytest.fixture
+def service(fake, clock):
+    service = SpotifyService(lambda session: fake, search_ttl=60)
+    yield service
+    service.close()
+
+
+def test_breaker_open_half_open_closed(service, fake, clock):
+    breaker = service.breaker
+    fake.down = True
+    for i in range(breaker.threshold):
+        assert breaker.state == 'closed'
+        with pytest.raises(SpotifyException):
+            service.call('devices')
+    assert breaker.state == 'open'
+
+    # Open: fails fast without reaching Spotify
+    calls = len(fake.calls)
+    with pytest.raises(SpotifyUnavailable):
+        service.call('devices')
+    assert len(fake.calls) == calls
+
+    # Half-open: one trial call, which fails and doubles the backoff
+    clock.advance(breaker.initial_backoff)
+    assert breaker.state == 'half-open'
+    with pytest.raises(SpotifyException):
+        service.call('devices')
+    assert len(fake.calls) == calls + 1
+    assert breaker.state == 'open'
+    assert breaker.backoff == 2 * breaker.initial_backoff
+
+    clock.advance(breaker.initial_backoff)
+    assert breaker.state == 'open'
+    clock.advance(breaker.initial_backoff)
+    assert breaker.state == 'half-open'
+
+    # A successful trial closes it and resets the backoff
+    fake.down = False
+    assert service.call('devices')['devices'][0]['id'] == 'living-room'
+    assert breaker.state == 'closed'
+    assert breaker.backoff == breaker.initial_backoff
+    assert breaker.failures == 0
+
+
+def test_breaker_lets_one_trial_through(service, fake, clock):
+    breaker = service.breaker
+    for i in range(breaker.threshold):
+        breaker.failure()
+    clock.advance(breaker.backoff)
+    assert breaker.allow()
+    assert not breaker.allow()  # A second caller while the trial is in flight
+    breaker.success()
+    assert breaker.allow()
+
+
+def test_backoff_is_capped(service, clock):
+    breaker = service.breaker
+    for i in range(breaker.threshold):
+        breaker.failure()
+    for i in range(20):
+        clock.advance(breaker.backoff)
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.backoff == breaker.max_backoff
+    assert breaker.retry_in() == breaker.max_backoff
+
+
+def test_client_errors_keep_the_circuit_closed(service, fake):
+    def refused(**kwargs):
+        raise SpotifyException(404, -1, 'Device not found')
+    fake.start_playback = refused
+    for i in range(service.breaker.threshold + 1):
+        with pytest.raises(SpotifyException):
+            service.call('start_playback', device_id='gone')
+    assert service.breaker.state == 'closed'
+
+
+def test_search_cache_hit_and_expiry(service, fake, clock):
+    track = service.find_track('Bohemian Rhapsody')
+    assert track['uri'] == 'spotify:track:Bohemian Rhapsody'
+    # Same query up to case, accents and spacing
+    assert service.find_track('  bohemian   RHAPSÓDY ') == track
+    assert fake.calls == ['search']
+    assert (service.search_hits, service.search_misses) == (1, 1)
+
+    clock.advance(59)
+    service.find_track('bohemian rhapsody')
+    assert fake.calls == ['search']
+
+    clock.advance(1)
+    assert service.find_track('bohemian rhapsody')['uri'] == 'spotify:track:bohemian rhapsody'
+    assert fake.calls == ['search', 'search']
+    assert (service.search_hits, service.search_misses) == (2, 2)
+
+
+def test_search_misses_expire_after_miss_ttl(service, fake, clock):
+    assert service.find_track('nada de nada') is None
+    assert service.find_track('nada de nada') is None
+    assert fake.calls == ['search']
+    clock.advance(spotify_service.MISS_TTL)
+    assert service.find_track('nada de nada') is None
+    assert fake.calls == ['search', 'search']
+
+
+def test_search_cache_is_bounded(service, monkeypatch):
+    monkeypatch.setattr(spotify_service, 'SEARCH_CACHE_SIZE', 3)
+    for i in range(5):
+        service.find_track(f'cancion {i}')
+    assert service.stats()['cached_searches'] == 3
+    service.find_track('cancion 0')
+    assert service.search_misses == 6  # The oldest entries were evicted
+
+
+def test_play_uses_cached_search_and_devices(service, fake):
+    assert service.play('cancion')['name'] == 'cancion'
+    assert service.play('cancion')['name'] == 'cancion'
+    assert fake.calls == ['search', 'devices', 'start_playback', 'start_playback']
+
+
+class FakeAuth:
+    """spotipy auth manager whose cached token expires at a set time"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.issued = 0
+        self.cache_handler = self
+        self.token = None
+
+    def get_cached_token(self):
+        return self.token
+
+    def validate_token(self, info):
+        if info is None:
+            return None
+        if info['expires_at'] <= self.clock.now:
+            self._issue()  # Refreshed, as SpotifyOAuth does
+        return self.token
+
+    def get_access_token(self, as_dict=False):
+        self._issue()
+        return self.token['access_token']
+
+    def _issue(self):
+        self.issued += 1
+        self.token = {'access_token': f'token-{self.issued}', 'expires_at': self.clock.now + 3600}
+
+
+def test_memory_token_reused_until_near_expiry(clock):
+    auth = FakeAuth(clock)
+    token = MemoryToken(auth, margin=60)
+    assert token.get_access_token() == 'token-1'
+    reads = []
+    auth.get_cached_token = lambda: reads.append(1) or auth.token
+
+    clock.advance(3600 - 61)
+    assert token.get_access_token() == 'token-1'
+    assert reads == []  # Served from memory, the cache file is not read
+
+    clock.advance(2)  # Within the margin: read the cache, which is still valid
+    assert token.get_access_token() == 'token-1'
+    assert len(reads) == 1
+
+    clock.advance(60)  # Expired: refreshed through the auth manager
+    assert token.get_access_token() == 'token-2'
+    assert auth.issued == 2
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+TTS Cache
+Content-addressed cache of synthesized speech for the voice assistant.
+Every phrase is stored once as tts_<hash>.mp3 in an AudioStore, the hash
+being of the normalized text and the language, so repeated replies cost no
+network call and two replies can never overwrite each other. Pre-warmed
+phrases are pinned so the store's quota never sweeps them away.
+Replies with numbers in them ("La hora actual es 14:35") are split into
+fixed text and number fragments, each cached on its own, and the MP3
+fragments are concatenated, so only a number never heard before goes to
+the network.
+"""
+
+import hashlib
+import io
+import re
+import threading
+import unicodedata
+
+from gtts import gTTS
+
+NUMBER = re.compile(r'\d+')
+
+
+def normalize_text(text):
+    """Canonical form of a phrase: NFC, single spaces, no surrounding blanks"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(text, lang):
+    return hashlib.sha256(f"{lang}\0{normalize_text(text)}".encode('utf-8')).hexdigest()[:32]
+
+
+def split_segments(text):
+    """
+    Split a reply into fixed text and numbers:
+    "La hora actual es 14:35" -> ["La hora actual es", "14", "35"]
+    Pieces with nothing to pronounce (":", ",") are dropped.
+    """
+    segments = []
+    position = 0
+    for match in NUMBER.finditer(text):
+        segments.append(text[position:match.start()])
+        segments.append(match.group())
+        position = match.end()
+    segments.append(text[position:])
+    return [segment.strip() for segment in segments if any(c.isalnum() for c in segment)]
+
+
+def gtts_synthesize(text, lang):
+    """Synthesize with Google TTS and return the MP3 bytes"""
+    buffer = io.BytesIO()
+    gTTS(text=text, lang=lang).write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+class TTSCache:
+    """Synthesized clips addressed by the hash of their text, kept in an AudioStore"""
+
+    def __init__(self, store, lang='es', synthesize=gtts_synthesize):
+        self.store = store
+        self.lang = lang
+        self.synthesize = synthesize
+        self._key_locks = [threading.Lock() for _ in range(32)]
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, key):
+        return f"tts_{key}.mp3"
+
+    def get(self, text, lang=None):
+        """Return (key, mp3 bytes) for a phrase, synthesizing it on a miss"""
+        lang = lang or self.lang
+        key = cache_key(text, lang)
+        data = self.store.get(self.filename(key))
+        if data is not None:
+            self.hits += 1
+            return key, data
+
+        # One synthesis per phrase even when several requests miss at once
+        with self._key_locks[int(key[:8], 16) % len(self._key_locks)]:
+            data = self.store.get(self.filename(key))
+            if data is None:
+                self.misses += 1
+                data = self.synthesize(normalize_text(text), lang)
+                self.store.put(self.filename(key), data)
+        return key, data
+
+    def speak(self, text, lang=None):
+        """
+        Return the file name of a clip saying text. Replies with numbers are
+        assembled from separately cached fragments.
+        """
+        lang = lang or self.lang
+        segments = split_segments(text)
+        if len(segments) <= 1 or not any(NUMBER.fullmatch(segment) for segment in segments):
+            key, _ = self.get(text, lang)
+            return self.filename(key)
+
+        filename = self.filename(cache_key(text, lang))
+        if filename not in self.store:
+            self.store.put(filename, b''.join(self.get(segment, lang)[1] for segment in segments))
+        return filename
+
+    def prewarm(self, phrases, lang=None):
+        """Synthesize phrases that are not cached yet and pin them against eviction"""
+        lang = lang or self.lang
+        for phrase in phrases:
+            self.store.pin(self.filename(cache_key(phrase, lang)))
+        for phrase in phrases:
+            try:
+                self.get(phrase, lang)
+            except Exception as e:
+                # Most likely offline, the rest would fail the same way
+                print(f"TTS pre-warm failed for '{phrase}': {e}")
+                return False
+        return True
+
+    def prewarm_async(self, phrases, lang=None):
+        """Pre-warm from a background thread so startup is not held up by the network"""
+        thread = threading.Thread(target=self.prewarm, args=(list(phrases), lang), name='tts-prewarm', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Voice Jobs
+Asynchronous processing of voice requests.
+A job goes through a pipeline of stages (decode -> recognize -> respond),
+each with its own small pool of worker threads and a bounded queue in front
+of it. A full queue makes the previous stage wait (backpressure), and when
+the first queue is full new jobs are refused with VoiceJobsSaturated instead
+of piling up. The request thread only streams the upload into the job, so
+it is free again as soon as the upload is in. Results are read by polling
+(optionally long-polling) or by waiting on the job's status changes.
+"""
+
+import queue
+import threading
+import time
+import uuid
+
+from voice_pipeline import StageTimer
+
+JOB_TTL = 300  # Seconds a finished job is kept for its result to be fetched
+_END = object()  # End of upload marker
+
+
+class VoiceJobsSaturated(Exception):
+    """Every worker is busy and the queue is full, the client should retry later"""
+
+
+class JobFailed(Exception):
+    """Ends a job early with an error for the client"""
+
+    def __init__(self, error, status=200):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+
+
+class UploadStream:
+    """Chunks handed from the request thread to the decode stage as they arrive"""
+
+    def __init__(self):
+        self._chunks = queue.Queue()
+
+    def feed(self, chunks):
+        """Copy an upload into the stream (runs in the request thread)"""
+        try:
+            for chunk in chunks:
+                self._chunks.put(chunk)
+        except Exception as e:
+            self._chunks.put(e)
+            raise
+        finally:
+            self._chunks.put(_END)
+
+    def __iter__(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is _END:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+class Job:
+    def __init__(self, payload, options=None):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.options = options or {}
+        self.status = 'queued'
+        self.result = None
+        self.http_status = 200
+        self.created = time.time()
+        self.finished = None
+        self.timer = StageTimer()
+        self.version = 0  # Bumped on every status change
+        self._cond = threading.Condition()
+        self._queued_at = time.perf_counter()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def _set(self, status, result=None, http_status=None):
+        with self._cond:
+            self.status = status
+            if result is not None:
+                self.result = result
+            if http_status is not None:
+                self.http_status = http_status
+            if self.done:
+                self.finished = time.time()
+                self.payload = None  # Drop the audio, only the result is kept
+            self.version += 1
+            self._cond.notify_all()
+
+    def wait(self, timeout=None, version=None):
+        """
+        Block until the job is finished, or (with version) until its status
+        changed since that version. Returns True if it did before the timeout.
+        """
+        with self._cond:
+            if version is None:
+                return self._cond.wait_for(lambda: self.done, timeout)
+            return self._cond.wait_for(lambda: self.version != version or self.done, timeout)
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'created': self.created,
+            'timings': {name: round(seconds, 4) for name, seconds in self.timer.timings.items()},
+        }
+        if self.result is not None:
+            data['result'] = self.result
+        return data
+
+
+class Stage:
+    """A pipeline step: a bounded queue served by a fixed number of threads"""
+
+    def __init__(self, name, handler, workers=2, queue_size=8):
+        self.name = name
+        self.handler = handler  # handler(job, payload) -> payload for the next stage
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.busy = 0
+        self.processed = 0
+        self.lock = threading.Lock()
+
+
+class VoiceJobs:
+    """
+    Runs jobs through the stages and keeps them until their result is fetched
+    timer: optional object with add(stage, seconds), given the timings of
+    every finished job (e.g. a metrics histogram)
+    """
+
+    def __init__(self, stages, ttl=JOB_TTL, timer=None):
+        self.stages = list(stages)
+        self.ttl = ttl
+        self.timer = timer
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self._threads = []
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work, args=(index,), name=f'voice-{stage.name}-{n}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def submit(self, payload, **options):
+        """Queue a new job, raise VoiceJobsSaturated when the first stage is full"""
+        self._expire()
+        job = Job(payload, options)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self.stages[0].queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self.rejected += 1
+            raise VoiceJobsSaturated(f"{self.stages[0].name} queue is full")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            job = stage.queue.get()
+            job.timer.add(f'wait_{stage.name}', time.perf_counter() - job._queued_at)
+            job._set(stage.name)
+            with stage.lock:
+                stage.busy += 1
+            try:
+                with job.timer.stage(stage.name):
+                    payload = stage.handler(job, job.payload)
+            except JobFailed as e:
+                self._finish(job, 'failed', {'success': False, 'error': e.error}, e.status)
+                continue
+            except Exception as e:
+                print(f"Voice job {job.id} failed in {stage.name}: {e}")
+                self._finish(job, 'failed', {'success': False, 'error': f'Error processing audio: {str(e)}'}, 500)
+                continue
+            finally:
+                with stage.lock:
+                    stage.busy -= 1
+                    stage.processed += 1
+
+            if following is None:
+                self._finish(job, 'done', payload)
+            else:
+                job.payload = payload
+                job._queued_at = time.perf_counter()
+                job._set('queued')
+                following.queue.put(job)  # Blocks while the next stage is saturated
+
+    def _finish(self, job, status, result, http_status=None):
+        if self.timer is not None:
+            for name, seconds in job.timer.timings.items():
+                self.timer.add(name, seconds)
+        job._set(status, result, http_status)
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and now - job.finished > self.ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.done)
+        return {
+            'pending': pending,
+            'rejected': self.rejected,
+            'stages': {
+                stage.name: {
+                    'workers': stage.workers,
+                    'busy': stage.busy,
+                    'queued': stage.queue.qsize(),
+                    'capacity': stage.queue.maxsize,
+                    'processed': stage.processed,
+                }
+                for stage in self.stages
+            },
+        }
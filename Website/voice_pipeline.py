@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Voice Pipeline
+In-memory audio decoding for the voice assistant.
+The uploaded audio is piped straight into ffmpeg and comes back as 16 kHz
+mono 16-bit PCM, which is handed to the recognizer from a BytesIO. Nothing
+touches the filesystem. Chunks are fed to ffmpeg from a separate thread,
+so decoding starts while the upload is still arriving.
+"""
+
+import io
+import shutil
+import subprocess
+import threading
+import time
+import wave
+
+from pydub import AudioSegment
+
+SAMPLE_RATE = 16000  # Hz, what the recognizers expect
+SAMPLE_WIDTH = 2  # Bytes per sample (s16le)
+CHUNK_SIZE = 16 * 1024  # Bytes read from the upload per iteration
+
+
+class StageTimer:
+    """Collects wall-clock durations of the pipeline stages"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def summary(self):
+        return ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.timings.items())
+
+
+class _Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+def ffmpeg_binary():
+    """Path of the ffmpeg executable (the one pydub found, or from PATH)"""
+    return shutil.which(AudioSegment.converter) or shutil.which('ffmpeg') or AudioSegment.converter
+
+
+def iter_stream(stream, chunk_size=CHUNK_SIZE):
+    """Yield chunks from a file-like object until EOF"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def decode_stream(chunks, timer=None):
+    """
+    Decode an iterable of encoded audio chunks (webm/ogg/wav/...) to raw
+    16 kHz mono s16le PCM bytes through an ffmpeg pipe.
+    Falls back to pydub for containers ffmpeg cannot read from a pipe
+    (e.g. MP4 with the index at the end).
+    """
+    timer = timer or StageTimer()
+    start = time.perf_counter()
+    received = []
+
+    process = subprocess.Popen(
+        [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error',
+         '-i', 'pipe:0',
+         '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(SAMPLE_RATE),
+         'pipe:1'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    feed_error = []
+
+    def feed():
+        upload_start = time.perf_counter()
+        try:
+            for chunk in chunks:
+                received.append(chunk)
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg gave up early, its exit status tells why
+        except Exception as e:
+            feed_error.append(e)
+        finally:
+            timer.add('upload', time.perf_counter() - upload_start)
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, name='voice-feed', daemon=True)
+    feeder.start()
+
+    # stderr is drained on its own thread so a chatty ffmpeg can never block
+    errors = []
+    drainer = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+    drainer.start()
+
+    pcm = process.stdout.read()
+    process.wait()
+    feeder.join()
+    drainer.join()
+
+    if feed_error:
+        raise feed_error[0]
+
+    if process.returncode != 0 or not pcm:
+        message = (errors[0] if errors else b'').decode(errors='replace').strip()
+        print(f"ffmpeg pipe decode failed ({message or process.returncode}), falling back to pydub")
+        audio = AudioSegment.from_file(io.BytesIO(b''.join(received)))
+        audio = audio.set_frame_rate(SAMPLE_RATE).set_channels(1).set_sample_width(SAMPLE_WIDTH)
+        pcm = audio.raw_data
+
+    timer.add('decode', time.perf_counter() - start)
+    return pcm
+
+
+def pcm_to_wav(pcm, sample_rate=SAMPLE_RATE):
+    """Wrap raw PCM in an in-memory WAV file that sr.AudioFile can open"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    buffer.seek(0)
+    return buffer
+
+
+def pcm_duration(pcm, sample_rate=SAMPLE_RATE):
+    """Length of the PCM audio in seconds"""
+    return len(pcm) / float(SAMPLE_WIDTH * sample_rate)